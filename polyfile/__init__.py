@@ -1,16 +1,20 @@
 from . import (
-    nes,
-    pdf,
-    jpeg,
-    zipmatcher,
-    nitf,
-    http,
     kaitaimatcher,
-    languagematcher,
-    pickles,
-    polyfile,
-    safetensors
+    polyfile
 )
+from .magic import DefaultMagicMatcher, IdentificationWindow
+from .polyfile import register_lazy_parser
+
+# These modules add custom magic tests to the default matcher (and register parsers for them) when they are imported.
+# They are only imported once the default matcher is first loaded, so that importing PolyFile stays fast.
+for _module in ("pdfmatcher", "zipmatcher", "nitf", "http", "languagematcher", "pickles", "safetensors"):
+    DefaultMagicMatcher.register_module(f"{__name__}.{_module}")
+del _module
+
+# These parsers depend on slow-to-import libraries (pdfminer and PIL), so they are only imported when first needed
+register_lazy_parser(f"{__name__}.pdf", "pdf_parser", "application/pdf")
+register_lazy_parser(f"{__name__}.nes", "parse_ines", "application/x-nes-rom")
+register_lazy_parser(f"{__name__}.jpeg", "parse_jpeg2000", "image/jp2")
 
 from .__main__ import main
-from .polyfile import __version__, InvalidMatch, Match, Matcher, Parser, PARSERS, register_parser, Submatch
+from .polyfile import __version__, InvalidMatch, Match, Matcher, ParseBudget, Parser, PARSERS, register_parser, Submatch
@@ -1,20 +1,27 @@
 import argparse
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
 from contextlib import ExitStack
 import json
+import itertools
 import logging
-import re
+import os
 import signal
 import sys
 from textwrap import dedent
-from typing import ContextManager, Optional, TextIO
+from typing import ContextManager, Iterable, List, Optional, TextIO
 
 from . import html
 from . import logger
+from .batch import (
+    BATCH_FORMATS, BatchOptions, iter_paths, iter_stdin_paths, pool_context, resolve_filetypes, write_batch
+)
+from .cache import DEFAULT_MAX_SIZE, ResultCache
 from .fileutils import PathOrStdin, PathOrStdout
-from .magic import MagicMatcher
+from .magic import IdentificationWindow, MagicMatcher
 from .debugger import Debugger
-from .polyfile import __version__, Analyzer
+from .polyfile import __version__, Analyzer, Match, ParseBudget
 from .repl import ExitREPL
+from .server import AnalysisClient, AnalysisServer, default_socket_path, ServerError
 
 
 log = logger.getStatusLogger("polyfile")
@@ -113,11 +120,202 @@ class ValidateOutput(argparse.Action):
         ValidateOutput.add_output(args, values)
 
 
+def batch_paths(args: argparse.Namespace) -> Iterable[str]:
+    """Returns the paths given on the command line, followed by those listed on STDIN if '-' (or nothing) was given"""
+    paths: List[str] = [path for path in args.FILE if path != '-']
+    if len(paths) < len(args.FILE) or not args.FILE:
+        return itertools.chain(paths, iter_stdin_paths())
+    return paths
+
+
+def parse_budget(args: argparse.Namespace) -> Optional[ParseBudget]:
+    """Returns the budget for each parser invocation set by the command line arguments, or None if it is unlimited"""
+    limits = (args.max_parse_seconds, args.max_decoded_bytes, args.max_nesting_depth, args.max_submatches,
+              args.max_array_elements)
+    if all(limit is None for limit in limits):
+        return None
+    return ParseBudget(*limits)
+
+
+def identify_window(args: argparse.Namespace) -> Optional[IdentificationWindow]:
+    """Returns the window of each file to read up front for identification, or None if the entire file is read"""
+    if args.identify_head is None:
+        if args.identify_tail is not None:
+            log.warning("Ignoring `--identify-tail`; it can only be used with `--identify-head`.")
+        return None
+    return IdentificationWindow(args.identify_head, 0 if args.identify_tail is None else args.identify_tail)
+
+
+def batch(args: argparse.Namespace, magic_matcher: Optional[MagicMatcher], result_cache: Optional[ResultCache]) -> int:
+    formats = []
+    for output_format in args.format:
+        if output_format.output_format not in BATCH_FORMATS:
+            log.error(f"The {output_format.output_format} output format cannot be used in batch mode")
+            return 1
+        elif not output_format.output_to_stdout:
+            log.error("The `--output` argument cannot be used in batch mode; records are always written to STDOUT")
+            return 1
+        formats.append(output_format.output_format)
+    if magic_matcher is None:
+        mimetypes = None
+    else:
+        mimetypes = magic_matcher.mimetypes
+    if result_cache is None:
+        cache_dir: Optional[str] = None
+        cache_max_size = DEFAULT_MAX_SIZE
+    else:
+        cache_dir = str(result_cache.cache_dir)
+        cache_max_size = result_cache.max_size
+    options = BatchOptions(formats=formats, try_all_offsets=args.try_all_offsets, parse=not args.only_match,
+                           mimetypes=mimetypes, timeout=args.timeout, cache_dir=cache_dir,
+                           cache_max_size=cache_max_size, budget=parse_budget(args),
+                           identify_window=identify_window(args), lazy_decoding=args.lazy_decoding,
+                           validate=args.validate)
+    if logger.get_root_logger().level == logger.STATUS:
+        # the per-file progress bars would be interleaved with the records
+        logger.setLevel(logging.INFO)
+    try:
+        num_files, num_failures = write_batch(batch_paths(args), options, sys.stdout, jobs=args.jobs)
+    except KeyboardInterrupt:
+        sys.stderr.write("\n\nCaught keyboard interrupt.\n")
+        return 128 + signal.SIGINT
+    log.info(f"Analyzed {num_files} files; {num_failures} failed")
+    return 0
+
+
+def client(args: argparse.Namespace, batch_mode: bool) -> int:
+    """Runs the analysis on the `polyfile serve` server listening on `args.server`"""
+    formats = []
+    for output_format in args.format:
+        if output_format.output_format == "explain":
+            log.error("The explain output format cannot be used with `--server`")
+            return 1
+        elif output_format.output_format in ("json", "sbud", "html"):
+            formats.append("sbud")
+        else:
+            formats.append(output_format.output_format)
+    options = {
+        "formats": formats,
+        "parse": not args.only_match,
+        "try_all_offsets": args.try_all_offsets,
+        "filetype": args.filetype,
+        "timeout": args.timeout,
+        "lazy_decoding": args.lazy_decoding,
+        "validate": args.validate
+    }
+    budget = parse_budget(args)
+    if budget is not None:
+        options["budget"] = budget.to_dict()
+    window = identify_window(args)
+    if window is not None:
+        options["identify_window"] = window.to_dict()
+    try:
+        with AnalysisClient(args.server) as analysis_client:
+            if batch_mode:
+                requests = (
+                    (path, AnalysisClient.request(path=path, **options)) for path in iter_paths(batch_paths(args))
+                )
+                for path, record in analysis_client.analyze_many(requests):
+                    record.pop("id", None)
+                    record["path"] = path
+                    sys.stdout.write(json.dumps(record))
+                    sys.stdout.write("\n")
+                    sys.stdout.flush()
+                return 0
+            if args.FILE == '-':
+                record = analysis_client.analyze(data=sys.stdin.buffer.read(), name="STDIN", **options)
+            else:
+                record = analysis_client.analyze(path=args.FILE, **options)
+    except ServerError as e:
+        log.error(str(e))
+        return 1
+    if record["status"] != "ok":
+        log.error(f"{args.FILE}: {record['error']}")
+        return 1
+    for output_format in args.format:
+        with output_format.output_stream as output:
+            if output_format.output_format == "file":
+                for line in record["file"]:
+                    output.write(f"{line}\n")
+            elif output_format.output_format == "mime":
+                for mimetype in record["mime"]:
+                    output.write(f"{mimetype}\n")
+            elif output_format.output_format == "html":
+                output.write(html.generate(args.FILE, record["sbud"]))
+            elif args.omit_contents:
+                json.dump({key: value for key, value in record["sbud"].items() if key != "b64contents"}, output)
+            else:
+                json.dump(record["sbud"], output)
+    if args.require_match and not any(record.get(key) for key in ("file", "mime")) and \
+            not record.get("sbud", {}).get("struc"):
+        log.info("No matches found, exiting")
+        return 127
+    return 0
+
+
+def serve(argv) -> int:
+    parser = argparse.ArgumentParser(prog="polyfile serve",
+                                     description='Run a PolyFile analysis server on a Unix domain socket.',
+                                     formatter_class=argparse.RawTextHelpFormatter)
+    default_socket = default_socket_path()
+    parser.add_argument('SOCKET', nargs='?' if default_socket is not None else None,
+                        default=None if default_socket is None else str(default_socket),
+                        help=dedent("""the path of the Unix domain socket on which to listen
+(default is the POLYFILE_SERVER_SOCKET environment variable);
+clients connect to it with `polyfile --server SOCKET FILE`"""))
+    parser.add_argument('--jobs', '-j', type=int, default=None,
+                        help='the number of worker processes (default is the number of CPUs)')
+    parser.add_argument('--max-queue', type=int, default=None,
+                        help='the maximum number of requests to queue once all of the workers are busy; once it is '
+                             'full, the server stops reading requests until one completes (default is four times '
+                             'the number of workers)')
+    parser.add_argument('--timeout', type=float, default=None,
+                        help='the default maximum number of seconds to spend analyzing each file')
+    parser.add_argument('--cache-dir', type=str, default=None,
+                        help='cache analysis results in this directory (see `polyfile --help`)')
+    parser.add_argument('--cache-max-size', type=int, default=None,
+                        help='the maximum size of the `--cache-dir` in bytes')
+    verbosity_group = parser.add_mutually_exclusive_group()
+    verbosity_group.add_argument('--quiet', '-q', action='store_true', help='suppress all log output')
+    verbosity_group.add_argument('--debug', '-d', action='store_true', help='print debug information')
+    args = parser.parse_args(argv)
+
+    if args.quiet:
+        logger.setLevel(logging.CRITICAL)
+    elif args.debug:
+        logger.setLevel(logging.DEBUG)
+    else:
+        logger.setLevel(logging.INFO)
+
+    if args.cache_dir is not None:
+        cache: Optional[ResultCache] = ResultCache(args.cache_dir)
+    else:
+        cache = ResultCache.from_environment()
+    if cache is not None and args.cache_max_size is not None:
+        cache.max_size = args.cache_max_size
+
+    # exit cleanly (removing the socket) on SIGTERM
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        server = AnalysisServer(args.SOCKET, jobs=args.jobs, max_queue=args.max_queue, timeout=args.timeout,
+                                cache=cache)
+        server.serve_forever()
+    except ServerError as e:
+        log.error(str(e))
+        return 1
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
 def main(argv=None):
     parser = argparse.ArgumentParser(description='A utility to recursively map the structure of a file.',
                                      formatter_class=argparse.RawTextHelpFormatter)
-    parser.add_argument('FILE', nargs='?', default='-',
-                        help='the file to analyze; pass \'-\' or omit to read from STDIN')
+    parser.add_argument('FILE', nargs='*',
+                        help=dedent("""the file to analyze; pass '-' or omit to read from STDIN
+
+If more than one file or a directory is given, or if `--batch`
+is used, PolyFile runs in batch mode (see `--batch`)"""))
 
     parser.add_argument('--format', '-r', type=FormatOutput, action="append", choices=[
         FormatOutput(f) for f in FormatOutput.valid_formats + ("json",)
@@ -165,6 +363,9 @@ If an `--output` is omitted for a format,
 then it will implicitly be printed to STDOUT.
 """))
 
+    parser.add_argument('--omit-contents', action='store_true',
+                        help='omit the base64-encoded file contents (`b64contents`) from JSON/SBUD output')
+
     parser.add_argument('--filetype', '-f', action='append',
                         help='explicitly match against the given filetype or filetype wildcard (default is to match '
                              'against all filetypes)')
@@ -176,14 +377,85 @@ then it will implicitly be printed to STDOUT.
                        help=dedent("""path to write an interactive HTML file for exploring the PDF;
 equivalent to `--format html --output HTML`"""))
     group.add_argument("--explain", action="store_true", help="equivalent to `--format explain")
-    # parser.add_argument('--try-all-offsets', '-a', action='store_true',
-    #                     help='Search for a file match at every possible offset; this can be very slow for larger '
-    #                     'files')
+    parser.add_argument('--try-all-offsets', '-a', action='store_true',
+                        help=dedent("""search for files embedded at any offset (e.g., polyglots)
+
+The input is scanned once for the magic byte sequences of
+all known file types, and the full magic tests are only run
+at the offsets where a sequence was found."""))
     group.add_argument('--only-match-mime', '-I', action='store_true',
                        help=dedent(""""just print out the matching MIME types for the file, one on each line;
 equivalent to `--format mime`"""))
     parser.add_argument('--only-match', '-m', action='store_true',
                         help='do not attempt to parse known filetypes; only match against file magic')
+    parser.add_argument('--validate', action='store_true',
+                        help=dedent("""with `--only-match`, only report the matches of filetypes that
+can be checked without being fully parsed (e.g., those parsed
+by Kaitai Struct) if they are valid"""))
+    parser.add_argument('--cache-dir', type=str, default=None,
+                        help=dedent("""cache analysis results in this directory, keyed by the
+file's contents, the PolyFile version, the magic definitions,
+and the analysis options, so that re-analyzing the same file
+skips matching and parsing; defaults to the value of the
+POLYFILE_RESULT_CACHE_DIR environment variable, if set"""))
+    parser.add_argument('--cache-max-size', type=int, default=None,
+                        help=dedent(f"""the maximum size of the `--cache-dir` in bytes; the least
+recently used results are evicted once it is exceeded (default:
+the POLYFILE_RESULT_CACHE_SIZE environment variable, or
+{DEFAULT_MAX_SIZE})"""))
+    parser.add_argument('--batch', action='store_true',
+                        help=dedent("""analyze many files at once with a pool of worker processes,
+streaming one JSON record per file to STDOUT as each analysis
+completes; directories are analyzed recursively, and if no FILE
+(or '-') is given, a newline-separated list of paths is read
+from STDIN. Each record contains the file's path, a `status` of
+"ok", "error", or "timeout", and a key for each `--format`
+(file, mime, json/sbud)"""))
+    parser.add_argument('--jobs', '-j', type=int, default=None,
+                        help='the number of worker processes to use in batch mode (default is the number of CPUs)')
+    parser.add_argument('--timeout', type=float, default=None,
+                        help='in batch mode, the maximum number of seconds to spend analyzing each file')
+    parser.add_argument('--identify-head', type=int, default=None,
+                        help=dedent("""only read the first this many bytes of each file up front to
+identify it (plus the bytes of `--identify-tail`); tests that scan
+the file, like unbounded `search` tests, only scan these bytes, and
+any other bytes are only read if a test needs them (by default,
+the entire file is mapped)"""))
+    parser.add_argument('--identify-tail', type=int, default=None,
+                        help=dedent("""with `--identify-head`, also read the last this many bytes of
+each file up front to identify it (default is 0)"""))
+    parser.add_argument('--max-parse-seconds', type=float, default=None,
+                        help=dedent("""stop any parser that has run for this many seconds, keeping
+the results it has produced so far and marking its match as
+truncated"""))
+    parser.add_argument('--max-decoded-bytes', type=int, default=None,
+                        help=dedent("""stop any parser that has decoded or decompressed more than
+this many bytes, and do not decompress archive members larger
+than this"""))
+    parser.add_argument('--max-nesting-depth', type=int, default=None,
+                        help=dedent("""do not match files nested more than this many levels deep
+within other files (e.g., archives within archives)"""))
+    parser.add_argument('--max-submatches', type=int, default=None,
+                        help='stop any parser that has produced this many submatches')
+    parser.add_argument('--lazy-decoding', action='store_true',
+                        help=dedent("""do not decode embedded payloads (e.g., compressed PDF streams)
+unless their contents are output, and do not analyze them
+recursively"""))
+    parser.add_argument('--max-array-elements', type=int, default=None,
+                        help=dedent("""only expand this many elements of each array in a parsed
+structure (e.g., the packets of a packet capture)"""))
+    parser.add_argument('--parse-jobs', type=int, default=None,
+                        help=dedent("""parse each of the file types detected in a file concurrently,
+using this many workers (by default, parsing is sequential)"""))
+    parser.add_argument('--parse-executor', choices=("thread", "process"), default="thread",
+                        help=dedent("""whether the `--parse-jobs` workers are threads or processes
+(default is thread)"""))
+    parser.add_argument('--server', type=str, default=None if default_socket_path() is None
+                        else str(default_socket_path()),
+                        help=dedent("""send the analysis to the `polyfile serve` server listening on
+this Unix domain socket rather than running it in this process
+(default is the POLYFILE_SERVER_SOCKET environment variable, if
+set); the server's own result cache is used"""))
     parser.add_argument('--require-match', action='store_true', help='if no matches are found, exit with code 127')
     parser.add_argument('--max-matches', type=int, default=None,
                         help='stop scanning after having found this many matches')
@@ -206,6 +478,10 @@ equivalent to `--format mime`"""))
     if argv is None:
         argv = sys.argv
 
+    if len(argv) > 1 and argv[1] == "serve":
+        # to analyze a file named "serve", use `polyfile ./serve`
+        exit(serve(argv[2:]))
+
     try:
         args = parser.parse_args(argv[1:])
     except ValueError as e:
@@ -213,6 +489,14 @@ equivalent to `--format mime`"""))
         sys.stderr.write(f"polyfile: error: {e!s}\n")
         exit(1)
 
+    batch_mode = args.batch or len(args.FILE) > 1 or any(os.path.isdir(path) for path in args.FILE)
+    if not batch_mode:
+        setattr(args, "FILE", args.FILE[0] if args.FILE else '-')
+    elif args.debugger:
+        parser.print_usage()
+        sys.stderr.write("polyfile: error: the `--debugger` argument cannot be used in batch mode\n")
+        exit(1)
+
     if args.dumpversion:
         print(__version__)
         exit(0)
@@ -230,7 +514,7 @@ equivalent to `--format mime`"""))
 
     if args.version:
         sys.stderr.write(f"PolyFile version {__version__}\n")
-        if args.FILE == '-' and sys.stdin.isatty():
+        if (batch_mode or args.FILE == '-') and sys.stdin.isatty():
             # No file argument was provided and it doesn't look like anything was piped into STDIN,
             # so instead of blocking on STDIN just exit
             exit(0)
@@ -261,10 +545,14 @@ equivalent to `--format mime`"""))
     else:
         logger.setLevel(logger.STATUS)
 
+    if args.server is not None:
+        if args.debugger:
+            log.error("The `--debugger` argument cannot be used with `--server`")
+            exit(1)
+        exit(client(args, batch_mode))
+
     if args.filetype:
-        regex = r'|'.join(fr"({ f.replace('*', '.*').replace('?', '.?') })" for f in args.filetype)
-        matcher = re.compile(regex)
-        mimetypes = [mimetype for mimetype in MagicMatcher.DEFAULT_INSTANCE.mimetypes if matcher.fullmatch(mimetype)]
+        mimetypes = resolve_filetypes(args.filetype)
         if not mimetypes:
             log.error(f"Filetype argument(s) { args.filetype } did not match any known definitions!")
             exit(1)
@@ -273,6 +561,19 @@ equivalent to `--format mime`"""))
     else:
         magic_matcher = None
 
+    if args.debugger:
+        # the debugger needs to observe the matching and parsing, so never use cached results
+        result_cache: Optional[ResultCache] = None
+    elif args.cache_dir is not None:
+        result_cache = ResultCache(args.cache_dir)
+    else:
+        result_cache = ResultCache.from_environment()
+    if result_cache is not None and args.cache_max_size is not None:
+        result_cache.max_size = args.cache_max_size
+
+    if batch_mode:
+        exit(batch(args, magic_matcher, result_cache))
+
     sigterm_handler = SIGTERMHandler()
 
     try:
@@ -303,12 +604,39 @@ equivalent to `--format mime`"""))
         elif args.no_debug_python:
             log.warning("Ignoring `--no-debug-python`; it can only be used with the --debugger option.")
 
-        analyzer = Analyzer(file_path, parse=not args.only_match, magic_matcher=magic_matcher)
-
-        needs_sbud = any(output_format.output_format in {"html", "json", "sbud"} for output_format in args.format)
+        executor: Optional[Executor] = None
+        if args.parse_jobs is not None and args.parse_jobs > 1:
+            if args.debugger:
+                log.warning("Ignoring `--parse-jobs`; the debugger can only instrument sequential parsing.")
+            elif args.parse_executor == "process":
+                executor = stack.enter_context(ProcessPoolExecutor(max_workers=args.parse_jobs,
+                                                                   mp_context=pool_context()))
+            else:
+                executor = stack.enter_context(ThreadPoolExecutor(max_workers=args.parse_jobs))
+
+        analyzer = Analyzer(file_path, try_all_offsets=args.try_all_offsets, parse=not args.only_match,
+                            magic_matcher=magic_matcher, cache=result_cache, executor=executor,
+                            budget=parse_budget(args), identify_window=identify_window(args),
+                            lazy_decoding=args.lazy_decoding, validate=args.validate)
+
+        needs_matches = any(
+            output_format.output_format in {"html", "json", "sbud"} for output_format in args.format
+        )
+        # only the HTML output needs the whole SBUD in memory; JSON output is streamed
+        needs_sbud = any(output_format.output_format == "html" for output_format in args.format)
+        # if there is only one JSON output, the matches can be written to it as they are found, without retaining them;
+        # otherwise, they are all found (and retained) up front
+        stream_matches = not needs_sbud and args.max_matches is None and not args.require_match and sum(
+            1 for output_format in args.format if output_format.output_format in ("json", "sbud")
+        ) == 1
         with KeyboardInterruptHandler():
             # do we need to do a full match? if so, do that up front:
-            if needs_sbud:
+            sbud: Optional[dict] = None
+            complete = True
+            if needs_matches and args.max_matches is None:
+                sbud = analyzer.cached_sbud()
+            if needs_matches and sbud is None and not stream_matches:
+                complete = False
                 if args.max_matches is None or args.max_matches > 0:
                     for match in analyzer.matches():
                         if sigterm_handler.terminated:
@@ -317,10 +645,19 @@ equivalent to `--format mime`"""))
                             if args.max_matches is not None and len(analyzer.matches_so_far) >= args.max_matches:
                                 log.info(f"Found {args.max_matches} matches; stopping early")
                                 break
-        if needs_sbud:
-            sbud = analyzer.sbud(matches=analyzer.matches_so_far)
-
-            if args.require_match and not analyzer.matches_so_far:
+                    else:
+                        complete = True
+        # if all of the matches were found, passing None will save the SBUD to the result cache
+        sbud_matches: Optional[Iterable[Match]] = None if complete else analyzer.matches_so_far
+        if needs_matches:
+            if sbud is None and needs_sbud:
+                sbud = analyzer.sbud(matches=sbud_matches)
+
+            if sbud is not None:
+                found_match = bool(sbud['struc'])
+            else:
+                found_match = bool(analyzer.matches_so_far)
+            if args.require_match and not found_match:
                 log.info("No matches found, exiting")
                 exit(127)
 
@@ -328,18 +665,14 @@ equivalent to `--format mime`"""))
             with output_format.output_stream as output:
                 if output_format.output_format == "file":
                     istty = sys.stderr.isatty() and output.isatty() and logging.root.level <= logging.INFO
-                    lines = set()
                     with KeyboardInterruptHandler():
-                        for match in analyzer.magic_matches():
-                            line = str(match)
-                            if line not in lines:
-                                lines.add(line)
-                                if istty:
-                                    log.clear_status()
-                                    output.write(f"{line}\n")
-                                    output.flush()
-                                else:
-                                    output.write(f"{line}\n")
+                        for line in analyzer.descriptions():
+                            if istty:
+                                log.clear_status()
+                                output.write(f"{line}\n")
+                                output.flush()
+                            else:
+                                output.write(f"{line}\n")
                     if istty:
                         log.clear_status()
                 elif output_format.output_format in ("mime", "explain"):
@@ -349,7 +682,12 @@ equivalent to `--format mime`"""))
                         longest_mimetype = max(len(mimetype) for mimetype in analyzer.magic_matcher.mimetypes)
                     found_match = False
                     with KeyboardInterruptHandler():
-                        for mimetype, match in analyzer.mime_types():
+                        if output_format.output_format == "explain":
+                            # explanations need the actual matches, so they cannot come from the result cache
+                            mime_types = analyzer.mime_types()
+                        else:
+                            mime_types = analyzer.mime_type_descriptions()
+                        for mimetype, match in mime_types:
                             found_match = True
                             if omm:
                                 log.clear_status()
@@ -365,7 +703,7 @@ equivalent to `--format mime`"""))
                                 output.write("\n")
                             if output_format.output_format == "explain":
                                 output.write(match.explain(ansi_color=output.isatty(), file=file_path))
-                    if args.require_match and not found_match and not needs_sbud:
+                    if args.require_match and not found_match and not needs_matches:
                         log.info("No matches found, exiting")
                         exit(127)
                     if omm:
@@ -373,8 +711,20 @@ equivalent to `--format mime`"""))
                     elif not output_format.output_to_stdout:
                         log.info(f"Saved MIME output to {output_format.output_path}")
                 elif output_format.output_format == "json" or output_format.output_format == "sbud":
-                    assert needs_sbud
-                    json.dump(sbud, output)
+                    assert needs_matches
+                    if sbud is not None:
+                        if args.omit_contents:
+                            sbud = dict(sbud)
+                            del sbud['b64contents']
+                        json.dump(sbud, output)
+                    elif stream_matches:
+                        # on a keyboard interrupt, write_sbud completes the document of the matches so far before
+                        # re-raising, so the current progress has already been output
+                        with KeyboardInterruptHandler():
+                            analyzer.write_sbud(output, include_contents=not args.omit_contents,
+                                                stop=lambda: sigterm_handler.terminated)
+                    else:
+                        analyzer.write_sbud(output, matches=sbud_matches, include_contents=not args.omit_contents)
                     if not output_format.output_to_stdout:
                         log.info(f"Saved {output_format.output_format.upper()} output to {output_format.output_path}")
                 elif output_format.output_format == "html":
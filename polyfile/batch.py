@@ -0,0 +1,265 @@
+"""
+Batch analysis of many files with a pool of worker processes.
+
+Each worker process builds (or, on platforms that support `fork`, inherits copy-on-write from the parent) the magic
+matcher once and then analyzes many files, so the interpreter start-up, package import, and magic definition parsing
+costs are only paid once per worker rather than once per file. Results are streamed as one JSON record per file, in
+the order in which they complete.
+
+"""
+import json
+import multiprocessing
+import os
+import re
+import signal
+import sys
+import threading
+from time import perf_counter
+from typing import Any, Dict, Iterable, Iterator, List, Optional, TextIO, Tuple
+
+from . import logger
+from .cache import DEFAULT_MAX_SIZE, ResultCache
+from .magic import IdentificationWindow, MagicMatcher
+from .polyfile import Analyzer, load_parsers, ParseBudget, PayloadMemo
+
+
+log = logger.getStatusLogger("polyfile")
+
+BATCH_FORMATS = ("file", "mime", "json", "sbud")
+
+
+class AnalysisTimeout(BaseException):
+    """
+    Raised (from a `SIGALRM` handler) when the analysis of a file exceeds its timeout.
+
+    Like `KeyboardInterrupt`, this is not an `Exception`, so that it is not swallowed by the handlers that keep a
+    single failing parser from aborting an analysis.
+
+    """
+
+
+class BatchOptions:
+    """The options for analyzing each file in a batch; this is sent to every worker, so it must be picklable"""
+    def __init__(
+            self,
+            formats: Iterable[str] = ("file",),
+            try_all_offsets: bool = False,
+            parse: bool = True,
+            mimetypes: Optional[Iterable[str]] = None,
+            timeout: Optional[float] = None,
+            cache_dir: Optional[str] = None,
+            cache_max_size: int = DEFAULT_MAX_SIZE,
+            budget: Optional[ParseBudget] = None,
+            identify_window: Optional[IdentificationWindow] = None,
+            lazy_decoding: bool = False,
+            validate: bool = False
+    ):
+        self.formats: Tuple[str, ...] = tuple(formats)
+        for output_format in self.formats:
+            if output_format not in BATCH_FORMATS:
+                raise ValueError(f"batch mode does not support the {output_format!r} output format")
+        self.try_all_offsets: bool = try_all_offsets
+        self.parse: bool = parse
+        if mimetypes is None:
+            self.mimetypes: Optional[Tuple[str, ...]] = None
+        else:
+            self.mimetypes = tuple(mimetypes)
+        self.timeout: Optional[float] = timeout
+        self.cache_dir: Optional[str] = cache_dir
+        self.cache_max_size: int = cache_max_size
+        self.budget: Optional[ParseBudget] = budget
+        self.identify_window: Optional[IdentificationWindow] = identify_window
+        self.lazy_decoding: bool = lazy_decoding
+        self.validate: bool = validate
+
+
+def resolve_filetypes(filetypes: Iterable[str]) -> List[str]:
+    """Returns the MIME types known to the default magic matcher that match any of the given filetype wildcards"""
+    regex = r'|'.join(fr"({ f.replace('*', '.*').replace('?', '.?') })" for f in filetypes)
+    matcher = re.compile(regex)
+    return [mimetype for mimetype in MagicMatcher.DEFAULT_INSTANCE.mimetypes if matcher.fullmatch(mimetype)]
+
+
+def iter_paths(paths: Iterable[str]) -> Iterator[str]:
+    """
+    Yields the paths of the files to analyze.
+
+    Directories are recursively expanded into the files they contain, in sorted order. Any other path is yielded
+    as-is, even if it does not exist, so that the error can be reported in that file's record.
+
+    """
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                for filename in sorted(files):
+                    yield os.path.join(root, filename)
+        else:
+            yield path
+
+
+def iter_stdin_paths(stream: Optional[TextIO] = None) -> Iterator[str]:
+    """Lazily yields the paths from a newline-separated list (by default, on STDIN), skipping blank lines"""
+    if stream is None:
+        stream = sys.stdin
+    for line in stream:
+        line = line.rstrip("\r\n")
+        if line:
+            yield line
+
+
+class BatchWorker:
+    """
+    Analyzes files according to a :class:`BatchOptions`; there is one instance of this per worker process.
+
+    The options default to those the worker was constructed with, but can be overridden for each file.
+
+    """
+    def __init__(self, options: BatchOptions):
+        self.options: BatchOptions = options
+        self._magic_matchers: Dict[Optional[Tuple[str, ...]], MagicMatcher] = {}
+        self._caches: Dict[Tuple[str, int], ResultCache] = {}
+        # payloads that recur across files (e.g., the same library in many installers) are only analyzed once
+        self.memo: PayloadMemo = PayloadMemo()
+
+    def magic_matcher(self, options: BatchOptions) -> MagicMatcher:
+        if options.mimetypes not in self._magic_matchers:
+            if options.mimetypes is None:
+                self._magic_matchers[None] = MagicMatcher.DEFAULT_INSTANCE
+            else:
+                self._magic_matchers[options.mimetypes] = MagicMatcher.DEFAULT_INSTANCE.only_match(
+                    mimetypes=options.mimetypes
+                )
+        return self._magic_matchers[options.mimetypes]
+
+    def cache(self, options: BatchOptions) -> Optional[ResultCache]:
+        if options.cache_dir is None:
+            return None
+        key = (options.cache_dir, options.cache_max_size)
+        if key not in self._caches:
+            self._caches[key] = ResultCache(options.cache_dir, max_size=options.cache_max_size)
+        return self._caches[key]
+
+    def _analyze(self, path: str, record: Dict[str, Any], options: BatchOptions):
+        analyzer = Analyzer(path, try_all_offsets=options.try_all_offsets, parse=options.parse,
+                            magic_matcher=self.magic_matcher(options), cache=self.cache(options),
+                            budget=options.budget, memo=self.memo, identify_window=options.identify_window,
+                            lazy_decoding=options.lazy_decoding, validate=options.validate)
+        for output_format in options.formats:
+            if output_format == "file":
+                record["file"] = list(analyzer.descriptions())
+            elif output_format == "mime":
+                mimetypes = []
+                for mimetype, _ in analyzer.mime_type_descriptions():
+                    if mimetype not in mimetypes:
+                        mimetypes.append(mimetype)
+                record["mime"] = mimetypes
+            else:
+                record["sbud"] = analyzer.sbud()
+
+    def analyze(self, path: str, options: Optional[BatchOptions] = None) -> Dict[str, Any]:
+        """Returns the JSON record for the given file; this never raises an exception"""
+        if options is None:
+            options = self.options
+        record: Dict[str, Any] = {"path": path}
+        start = perf_counter()
+        timeout = options.timeout
+        # signal handlers can only be installed on the main thread
+        use_alarm = timeout is not None and timeout > 0 and hasattr(signal, "SIGALRM") \
+            and threading.current_thread() is threading.main_thread()
+        if use_alarm:
+            def on_timeout(signum, frame):
+                raise AnalysisTimeout()
+
+            old_handler = signal.signal(signal.SIGALRM, on_timeout)
+            signal.setitimer(signal.ITIMER_REAL, timeout)
+        try:
+            if not os.path.isfile(path):
+                raise FileNotFoundError(f"No such file: {path!r}")
+            self._analyze(path, record, options)
+            record["status"] = "ok"
+        except AnalysisTimeout:
+            for output_format in BATCH_FORMATS:
+                record.pop(output_format, None)
+            record["status"] = "timeout"
+            record["error"] = f"Analysis did not complete within {timeout} seconds"
+        except Exception as e:
+            for output_format in BATCH_FORMATS:
+                record.pop(output_format, None)
+            record["status"] = "error"
+            record["error"] = f"{e.__class__.__name__}: {e!s}"
+        finally:
+            if use_alarm:
+                signal.setitimer(signal.ITIMER_REAL, 0)
+                signal.signal(signal.SIGALRM, old_handler)
+        record["elapsed"] = perf_counter() - start
+        return record
+
+
+_WORKER: Optional[BatchWorker] = None
+
+
+def _init_worker(options: BatchOptions):
+    global _WORKER
+    # the parent process handles ^C and terminates the pool
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # status output from many processes at once would be illegible
+    logger.setLevel(logger.logging.WARNING)
+    _WORKER = BatchWorker(options)
+
+
+def _analyze_in_worker(path: str, options: Optional[BatchOptions] = None) -> Dict[str, Any]:
+    return _WORKER.analyze(path, options)
+
+
+def pool_context():
+    if "fork" in multiprocessing.get_all_start_methods():
+        # the workers will inherit the parent's already-loaded magic matcher copy-on-write
+        return multiprocessing.get_context("fork")
+    return multiprocessing.get_context()
+
+
+def analyze_batch(
+        paths: Iterable[str], options: BatchOptions, jobs: Optional[int] = None
+) -> Iterator[Dict[str, Any]]:
+    """
+    Yields the JSON record of every file in `paths`, in the order in which their analyses complete.
+
+    If `jobs` is None, one worker process is used per CPU. If `jobs` is 1, the files are analyzed in this process.
+    Failures and timeouts are reported in the files' records with a `status` of "error" or "timeout".
+
+    """
+    if jobs is None:
+        jobs = os.cpu_count() or 1
+    if jobs <= 1:
+        worker = BatchWorker(options)
+        for path in paths:
+            yield worker.analyze(path)
+        return
+    # load the magic matcher and parsers before forking so that every worker does not need to load them separately
+    _ = MagicMatcher.DEFAULT_INSTANCE.non_text_tests
+    load_parsers()
+    with pool_context().Pool(processes=jobs, initializer=_init_worker, initargs=(options,)) as pool:
+        yield from pool.imap_unordered(_analyze_in_worker, paths, chunksize=1)
+
+
+def write_batch(
+        paths: Iterable[str], options: BatchOptions, output: TextIO, jobs: Optional[int] = None
+) -> Tuple[int, int]:
+    """
+    Analyzes the files and streams their records to `output` in JSON Lines format.
+
+    Returns a tuple of the number of files analyzed and the number of those that failed or timed out.
+
+    """
+    num_files = 0
+    num_failures = 0
+    for record in analyze_batch(iter_paths(paths), options, jobs=jobs):
+        num_files += 1
+        if record["status"] != "ok":
+            num_failures += 1
+            log.warning(f"{record['path']}: {record['error']}")
+        output.write(json.dumps(record))
+        output.write("\n")
+        output.flush()
+    return num_files, num_failures
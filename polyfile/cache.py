@@ -0,0 +1,230 @@
+"""
+A persistent, content-addressed cache of analysis results.
+
+Results are stored as JSON files in a cache directory, named by a key derived from the analyzed content's hash, the
+PolyFile version, the magic definition fingerprint, and the analysis options (see :meth:`ResultCache.key`). The cache
+is bounded in size; when it grows too large, the least recently used entries are evicted.
+
+"""
+from contextlib import contextmanager
+import hashlib
+import json
+import os
+from pathlib import Path
+from tempfile import NamedTemporaryFile
+from typing import Any, IO, Iterator, List, Optional, TextIO, Tuple, Union
+
+from .logger import getStatusLogger
+
+
+log = getStatusLogger("polyfile")
+
+RESULT_CACHE_FORMAT = 1
+DEFAULT_MAX_SIZE: int = 1024 * 1024 * 1024  # 1 GiB
+
+
+class _CacheTee:
+    """A text stream that writes to `output` and, unless writing to it ever fails, to a cache `entry`"""
+    def __init__(self, output: TextIO, entry: Optional[IO[str]]):
+        self.output: TextIO = output
+        self.entry: Optional[IO[str]] = entry
+        self.failed: bool = entry is None
+
+    def write(self, text: str) -> int:
+        self.output.write(text)
+        if not self.failed:
+            try:
+                self.entry.write(text)  # type: ignore
+            except (OSError, ValueError) as e:
+                log.debug(f"Unable to write result to cache: {e!s}")
+                self.failed = True
+        return len(text)
+
+    def flush(self):
+        self.output.flush()
+
+
+class ResultCache:
+    """
+    An on-disk, size-bounded, least-recently-used cache of JSON-serializable analysis results.
+
+    Every read or write of the cache is best-effort: I/O errors and corrupt entries are logged and treated as cache
+    misses, so a broken cache can never cause an analysis to fail.
+
+    """
+    def __init__(self, cache_dir: Union[str, Path], max_size: int = DEFAULT_MAX_SIZE):
+        self.cache_dir: Path = Path(cache_dir)
+        self.max_size: int = max_size
+
+    @staticmethod
+    def from_environment() -> Optional["ResultCache"]:
+        """
+        Returns a result cache configured by the `POLYFILE_RESULT_CACHE_DIR` and (optional)
+        `POLYFILE_RESULT_CACHE_SIZE` environment variables, or None if result caching is not enabled.
+
+        """
+        cache_dir = os.environ.get("POLYFILE_RESULT_CACHE_DIR", "")
+        if not cache_dir:
+            return None
+        max_size = os.environ.get("POLYFILE_RESULT_CACHE_SIZE", "")
+        try:
+            return ResultCache(cache_dir, max_size=int(max_size) if max_size else DEFAULT_MAX_SIZE)
+        except ValueError:
+            log.warning(f"Invalid POLYFILE_RESULT_CACHE_SIZE {max_size!r}; using the default of {DEFAULT_MAX_SIZE}")
+            return ResultCache(cache_dir)
+
+    @staticmethod
+    def key(content_hash: str, kind: str, **options) -> str:
+        """
+        Returns the cache key for a result of the given kind (e.g., "sbud" or "mime") for content with the given hash.
+
+        `options` should include everything else that can affect the result (e.g., the PolyFile version, the magic
+        definition fingerprint, and whether parsing was enabled). Option values must be JSON-serializable.
+
+        """
+        h = hashlib.sha256()
+        h.update(json.dumps({
+            "format": RESULT_CACHE_FORMAT,
+            "content": content_hash,
+            "kind": kind,
+            "options": options
+        }, sort_keys=True).encode("utf-8"))
+        return h.hexdigest()
+
+    def path(self, key: str) -> Path:
+        return self.cache_dir / f"{key}.json"
+
+    def get(self, key: str) -> Optional[Any]:
+        """Returns the cached result for the given key, or None if it is not in the cache"""
+        path = self.path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                result = json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            log.debug(f"Ignoring invalid result cache entry {path!s}: {e!s}")
+            return None
+        try:
+            # record the access for LRU eviction; atime is not reliable (e.g., on filesystems mounted noatime)
+            os.utime(path)
+        except OSError:
+            pass
+        return result
+
+    def put(self, key: str, result: Any) -> bool:
+        """Adds the result to the cache, evicting old entries if necessary; returns whether the result was saved"""
+        try:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            with NamedTemporaryFile(
+                    "w", encoding="utf-8", dir=self.cache_dir, prefix=".result-", suffix=".tmp", delete=False
+            ) as tmp:
+                try:
+                    json.dump(result, tmp)
+                except BaseException:
+                    tmp.close()
+                    os.unlink(tmp.name)
+                    raise
+            # the rename is atomic, so concurrent processes will never see a partially written entry
+            os.replace(tmp.name, self.path(key))
+        except (OSError, TypeError, ValueError) as e:
+            log.debug(f"Unable to save result to cache {self.cache_dir!s}: {e!s}")
+            return False
+        self.evict()
+        return True
+
+    @contextmanager
+    def tee(self, key: str, output: TextIO) -> Iterator[TextIO]:
+        """
+        Yields a text stream that writes to `output` while also saving the written JSON to the cache under `key`.
+
+        This allows a result to be cached while it is streamed, without ever materializing it. The entry is only saved
+        if the context exits without an exception; like :meth:`ResultCache.put`, failing to write the entry is never
+        an error.
+
+        """
+        try:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            entry: Optional[IO[str]] = NamedTemporaryFile(
+                "w", encoding="utf-8", dir=self.cache_dir, prefix=".result-", suffix=".tmp", delete=False
+            )
+        except OSError as e:
+            log.debug(f"Unable to save result to cache {self.cache_dir!s}: {e!s}")
+            entry = None
+        stream = _CacheTee(output, entry)
+        if entry is None:
+            yield stream  # type: ignore
+            return
+        committed = False
+        try:
+            try:
+                yield stream  # type: ignore
+            finally:
+                try:
+                    entry.close()
+                except OSError:
+                    stream.failed = True
+            if not stream.failed:
+                try:
+                    # the rename is atomic, so concurrent processes will never see a partially written entry
+                    os.replace(entry.name, self.path(key))
+                    committed = True
+                except OSError as e:
+                    log.debug(f"Unable to save result to cache {self.cache_dir!s}: {e!s}")
+        finally:
+            if not committed:
+                try:
+                    os.unlink(entry.name)
+                except OSError:
+                    pass
+        if committed:
+            self.evict()
+
+    def entries(self) -> List[Tuple[Path, os.stat_result]]:
+        """Returns the (path, stat) of every entry in the cache, from least to most recently used"""
+        entries: List[Tuple[Path, os.stat_result]] = []
+        try:
+            paths = list(self.cache_dir.glob("*.json"))
+        except OSError:
+            return entries
+        for path in paths:
+            try:
+                entries.append((path, path.stat()))
+            except OSError:
+                # the entry was concurrently evicted
+                pass
+        return sorted(entries, key=lambda entry: entry[1].st_mtime_ns)
+
+    def size(self) -> int:
+        return sum(stat.st_size for _, stat in self.entries())
+
+    def evict(self) -> int:
+        """Evicts the least recently used entries until the cache is within its size bound; returns the bytes freed"""
+        entries = self.entries()
+        total_size = sum(stat.st_size for _, stat in entries)
+        freed = 0
+        for path, stat in entries:
+            if total_size - freed <= self.max_size:
+                break
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                log.debug(f"Unable to evict result cache entry {path!s}: {e!s}")
+                continue
+            freed += stat.st_size
+        return freed
+
+    def clear(self):
+        for path, _ in self.entries():
+            try:
+                path.unlink()
+            except OSError:
+                pass
+
+    def __len__(self):
+        return len(self.entries())
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}(cache_dir={self.cache_dir!r}, max_size={self.max_size!r})"
@@ -8,7 +8,8 @@ from typing import Any, Callable, Dict, Generic, Iterable, Iterator, List, Optio
 
 from .polyfile import __copyright__, __license__, __version__, PARSERS, Match, Parser, ParserFunction, Submatch
 from .magic import (
-    AbsoluteOffset, FailedTest, InvalidOffsetError, MagicMatcher, MagicTest, Offset, TestResult, TEST_TYPES
+    AbsoluteOffset, DefaultMagicMatcher, FailedTest, InvalidOffsetError, MagicMatcher, MagicTest, Offset, TestResult,
+    TEST_TYPES
 )
 from .profiling import Profiler, Unprofiled, unprofiled
 from .repl import ANSIColor, ANSIWriter, arg_completer, command, ExitREPL, log, REPL, SetCompleter, string_escape
@@ -446,6 +447,8 @@ class Debugger(REPL):
                 # this class actually implements the test() function
                 self.instrumented_tests.append(InstrumentedTest(test, self))
         if self.break_on_submatching.value:
+            # make sure that the parsers registered by the default matcher's modules are instrumented, too
+            DefaultMagicMatcher.import_modules()
             for parsers in PARSERS.values():
                 for parser in parsers:
                     self.instrumented_parsers.append(InstrumentedParser(parser, self))
@@ -454,6 +457,8 @@ class Debugger(REPL):
     def enabled(self, is_enabled: bool):
         was_enabled = self.enabled
         self._uninstrument()
+        # the debugger reports why tests fail
+        MagicTest.explain_failures = is_enabled
         if is_enabled:
             self._instrument()
             self.load_history()
@@ -4,11 +4,13 @@ import os
 from pathlib import Path
 import tempfile as tf
 import shutil
+import stat
 import sys
-from typing import AnyStr, ContextManager, IO, Iterator, Iterable, List, Optional, TextIO, Union
+from threading import Lock
+from typing import AnyStr, ContextManager, IO, Iterator, Iterable, List, Optional, TextIO, Tuple, Union
 
 
-Streamable = Union[str, Path, IO, "FileStream", bytes]
+Streamable = Union[str, Path, IO, "FileStream", "WindowedData", bytes, bytearray, memoryview]
 
 
 def make_stream(path_or_stream: Streamable, mode: str = 'rb',
@@ -19,6 +21,24 @@ def make_stream(path_or_stream: Streamable, mode: str = 'rb',
         return FileStream(path_or_stream, mode=mode, close_on_exit=close_on_exit)
 
 
+def user_cache_dir() -> Path:
+    """
+    Returns the directory in which PolyFile should store its persistent caches.
+
+    This is the value of the `POLYFILE_CACHE_DIR` environment variable, if set. Otherwise, it is the `polyfile`
+    subdirectory of `$XDG_CACHE_HOME` (or `~/.cache` if that is not set, or `%LOCALAPPDATA%` on Windows).
+    The directory is not guaranteed to exist.
+
+    """
+    if "POLYFILE_CACHE_DIR" in os.environ:
+        return Path(os.environ["POLYFILE_CACHE_DIR"])
+    elif sys.platform == "win32" and "LOCALAPPDATA" in os.environ:
+        return Path(os.environ["LOCALAPPDATA"]) / "polyfile" / "Cache"
+    elif "XDG_CACHE_HOME" in os.environ:
+        return Path(os.environ["XDG_CACHE_HOME"]) / "polyfile"
+    return Path.home() / ".cache" / "polyfile"
+
+
 class Tempfile:
     def __init__(self, contents: bytes, prefix: Optional[str] = None, suffix: Optional[str] = None):
         self._path: Optional[str] = None
@@ -48,8 +68,13 @@ class ExactNamedTempfile(Tempfile):
     def __enter__(self) -> str:
         tmpdir = Path(tf.mkdtemp())
         file_path = tmpdir / self._name
-        with open(file_path, "wb") as f:
-            f.write(self._data)
+        try:
+            with open(file_path, "wb") as f:
+                f.write(self._data)
+        except BaseException:
+            # e.g., the name is too long or is not a valid filename
+            shutil.rmtree(tmpdir)
+            raise
         self._path = str(tmpdir)
         return str(file_path)
 
@@ -101,7 +126,111 @@ class PathOrStdout(ContextManager[TextIO]):
         return None
 
 
+class _SharedSource:
+    """
+    The data underlying a tree of :class:`FileStream` views.
+
+    All reads are positional (via `os.pread`, a slice of an in-memory buffer, or a slice of a read-only `mmap`), so
+    there is no cursor shared between views and the source can safely be read from multiple threads at once.
+
+    """
+    def __init__(self, stream: IO):
+        self.stream: IO = stream
+        self._buffer: Optional[Union[bytes, mmap.mmap]] = None
+        self._fileno: Optional[int] = None
+        self._lock: Lock = Lock()
+        if isinstance(stream, BytesIO):
+            # this does not copy the buffer unless it has been modified
+            self._buffer = stream.getvalue()
+            self.size: int = len(self._buffer)
+            return
+        try:
+            fileno = stream.fileno()
+            st = os.fstat(fileno)
+        except (AttributeError, OSError, UnsupportedOperation):
+            st = None
+        if st is not None and stat.S_ISREG(st.st_mode):
+            self._fileno = fileno
+            self.size = st.st_size
+        else:
+            # an arbitrary seekable stream, which we have to fall back to seeking within under a lock
+            with self._lock:
+                orig_pos = stream.tell()
+                try:
+                    self.size = stream.seek(0, SEEK_END)
+                finally:
+                    stream.seek(orig_pos)
+
+    @property
+    def in_memory(self) -> bool:
+        return self._fileno is None and isinstance(self.stream, BytesIO)
+
+    def buffer(self) -> Union[bytes, mmap.mmap]:
+        """Returns the entire contents of the source, memory mapping it (once) if it is a file"""
+        if self._buffer is None:
+            with self._lock:
+                if self._buffer is None:
+                    if self._fileno is not None:
+                        self._check_open()
+                        if self.size == 0:
+                            # empty files cannot be memory mapped
+                            self._buffer = b""
+                        else:
+                            # the mapping remains valid even after the file is closed
+                            self._buffer = mmap.mmap(self._fileno, 0, access=mmap.ACCESS_READ)
+                    else:
+                        orig_pos = self.stream.tell()
+                        try:
+                            self.stream.seek(0)
+                            self._buffer = self.stream.read()
+                        finally:
+                            self.stream.seek(orig_pos)
+        return self._buffer
+
+    def _check_open(self):
+        # the file descriptor could otherwise be reused by a file opened after this one was closed
+        if self.stream.closed:
+            raise ValueError("I/O operation on closed file")
+
+    def pread(self, offset: int, n: int) -> bytes:
+        """Reads up to `n` bytes starting at absolute `offset` without moving any file position"""
+        if self._buffer is not None:
+            return bytes(self._buffer[offset:offset + n])
+        elif self._fileno is not None and _HAS_PREAD:
+            self._check_open()
+            chunks: List[bytes] = []
+            while n > 0:
+                chunk = os.pread(self._fileno, n, offset)
+                if not chunk:
+                    break
+                chunks.append(chunk)
+                offset += len(chunk)
+                n -= len(chunk)
+            return b"".join(chunks)
+        elif self._fileno is not None:
+            # platforms without pread (i.e., Windows) share a read-only mmap instead
+            return bytes(self.buffer()[offset:offset + n])
+        with self._lock:
+            orig_pos = self.stream.tell()
+            try:
+                self.stream.seek(offset)
+                return self.stream.read(n)
+            finally:
+                self.stream.seek(orig_pos)
+
+
+_HAS_PREAD: bool = hasattr(os, "pread")
+
+
 class FileStream(IO):
+    """
+    A read-only view of the `[start, start + length)` window of a file, stream, or in-memory buffer.
+
+    Every view has its own position, and all reads are positional against a source that is shared between a stream
+    and all of the views created from it (e.g., by slicing, which is O(1)). Distinct views of the same file can
+    therefore be read concurrently from multiple threads.
+
+    """
     def __init__(
             self,
             path_or_stream: Streamable,
@@ -117,40 +246,38 @@ class FileStream(IO):
             if close_on_exit is None:
                 close_on_exit = True
         else:
-            if isinstance(path_or_stream, bytes):
+            if isinstance(path_or_stream, (bytes, bytearray, memoryview)):
                 path_or_stream = BytesIO(path_or_stream)
                 setattr(path_or_stream, "name", "bytes")
+            elif isinstance(path_or_stream, WindowedData):
+                # read the view through the window's stream rather than materializing it
+                available = max(len(path_or_stream) - start, 0)
+                length = available if length is None else min(length, available)
+                start += path_or_stream.base
+                path_or_stream = path_or_stream.stream
             elif not path_or_stream.seekable():
                 raise ValueError('FileStream can only wrap streams that are seekable')
             elif not path_or_stream.readable():
                 raise ValueError('FileStream can only wrap streams that are readable')
             self._stream = path_or_stream
-        if isinstance(path_or_stream, FileStream):
-            if length is None:
-                self._length = len(path_or_stream) - start
-            else:
-                self._length = min(length, len(path_or_stream))
+        if isinstance(self._stream, FileStream):
+            self._source: _SharedSource = self._stream._source
+            self._offset: int = self._stream._offset + start
+            available = len(self._stream) - start
         else:
-            if isinstance(path_or_stream, BytesIO):
-                orig_pos = path_or_stream.tell()
-                path_or_stream.seek(0, SEEK_END)
-                try:
-                    filesize = path_or_stream.tell()
-                finally:
-                    path_or_stream.seek(orig_pos)
-            else:
-                filesize = os.path.getsize(self._stream.name)
-            if length is None:
-                self._length = filesize - start
-            else:
-                self._length = min(filesize, length) - start
+            self._source = _SharedSource(self._stream)
+            self._offset = start
+            available = self._source.size - start
+        if length is None:
+            length = available
         if close_on_exit is None:
             close_on_exit = False
+        self._length: int = max(min(length, available), 0)
         self._name = self._stream.name
         self.start = start
         self.close_on_exit = close_on_exit
         self._entries = 0
-        self._root = None
+        self._pos: int = 0
 
     def __len__(self):
         return self._length
@@ -169,88 +296,107 @@ class FileStream(IO):
         return self._name
 
     @property
-    def root(self):
-        if self._root is None:
-            if isinstance(self._stream, FileStream):
-                self._root = self._stream.root
-            else:
-                self._root = self._stream
-        return self._root
+    def root(self) -> IO:
+        return self._source.stream
 
     def save_pos(self):
         f = self
 
         class SP:
             def __init__(self):
-                self.pos = f.root.tell()
+                self.pos = f.tell()
 
             def __enter__(self, *args, **kwargs) -> FileStream:
                 return f
 
             def __exit__(self, *args, **kwargs):
-                f.root.seek(self.pos)
+                f._pos = self.pos
 
         return SP()
 
+    @property
+    def in_memory(self) -> bool:
+        """Whether this stream is backed by an in-memory buffer rather than by a file"""
+        return self._source.in_memory
+
+    def buffer(self) -> Union[bytes, mmap.mmap]:
+        """
+        Returns the contents of this stream.
+
+        If this stream spans the entirety of its source, this is the source's shared buffer (a read-only `mmap`, in
+        the case of a file), so the contents are not copied into memory.
+
+        """
+        if self._offset == 0 and self._length == self._source.size:
+            return self._source.buffer()
+        return self.content
+
+    def shared_buffer(self) -> Union[bytes, mmap.mmap]:
+        """
+        Returns the shared buffer of the entire source of this stream, without copying it.
+
+        This stream's contents span bytes `offset()` through `offset() + len(self)` of the buffer.
+
+        """
+        return self._source.buffer()
+
+    def view(self) -> memoryview:
+        """Returns a read-only view of the contents of this stream without copying them (see :meth:`buffer`)"""
+        with memoryview(self.shared_buffer()) as source:
+            return source[self._offset:self._offset + self._length].toreadonly()
+
     def fileno(self):
         return self._stream.fileno()
 
     def offset(self):
-        if isinstance(self._stream, FileStream):
-            return self._stream.offset() + self.start
-        else:
-            return self.start
+        return self._offset
 
     def seek(self, offset, from_what=0):
         if from_what == 1:
-            offset = self.tell() + offset
+            offset = self._pos + offset
         elif from_what == 2:
             offset = len(self) + offset
-        if offset - self.start > self._length:
+        if offset < 0:
+            raise ValueError(f"negative seek position {offset}")
+        elif offset > self._length:
             raise IndexError(f"{self!r} is {len(self)} bytes long, but seek was requested for byte {offset}")
-        self._stream.seek(self.start + offset)
+        self._pos = offset
+        return offset
 
     def tell(self):
-        return min(max(self._stream.tell() - self.start, 0), self._length)
+        return self._pos
 
     def read(self, n=None) -> bytes:
-        if self._stream.tell() - self.start < 0:
-            # another context moved the position, so move it back to our zero index:
-            self.seek(0)
-            pos = 0
-        else:
-            pos = self.tell()
-        ls = len(self)
-        if pos >= ls:
+        remaining = self._length - self._pos
+        if n is None or n < 0 or n > remaining:
+            n = remaining
+        if n <= 0:
             return b''
-        elif n is None:
-            return self._stream.read()[:ls - pos]
-        else:
-            return self._stream.read(min(n, ls - pos))
+        data = self._source.pread(self._offset + self._pos, n)
+        self._pos += len(data)
+        return data
 
     def contains_all(self, *args):
         if args:
-            with mmap.mmap(self.fileno(), 0, access=mmap.ACCESS_READ) as filecontent:
-                for string in args:
-                    if filecontent.find(string, self.offset(), self.offset() + len(self)) < 0:
-                        return False
+            filecontent = self._source.buffer()
+            for string in args:
+                if filecontent.find(string, self._offset, self._offset + len(self)) < 0:
+                    return False
         return True
 
     def first_index_of(self, byte_sequence: bytes) -> int:
-        with mmap.mmap(self.fileno(), 0, access=mmap.ACCESS_READ) as filecontent:
-            start_offset = self.offset()
-            end_offset = start_offset + len(self)
-            index = filecontent.find(byte_sequence, start_offset, end_offset)
-            if start_offset <= index < end_offset:
-                return index - start_offset
-            else:
-                return -1
+        filecontent = self._source.buffer()
+        start_offset = self._offset
+        end_offset = start_offset + len(self)
+        index = filecontent.find(byte_sequence, start_offset, end_offset)
+        if start_offset <= index < end_offset:
+            return index - start_offset
+        else:
+            return -1
 
     @property
     def content(self) -> bytes:
-        with self.save_pos():
-            self.seek(0)
-            return self.read(len(self))
+        return self._source.pread(self._offset, self._length)
 
     def __bytes__(self):
         return self.content
@@ -282,23 +428,17 @@ class FileStream(IO):
 
     def __getitem__(self, index) -> Union[bytes, "FileStream"]:
         if isinstance(index, int):
-            with self.save_pos():
-                self.seek(index)
-                return self.read(1)
+            if index < 0:
+                index += len(self)
+            if not 0 <= index <= len(self):
+                raise IndexError(f"{self!r} is {len(self)} bytes long, but byte {index} was requested")
+            return self._source.pread(self._offset + index, 1)
         elif not isinstance(index, slice):
             raise ValueError(f"unexpected argument {index}")
-        if index.step is not None and index.step != 1:
+        start, stop, step = index.indices(len(self))
+        if step != 1:
             raise ValueError(f"Invalid slice step: {index}")
-        length=None
-        if index.stop is not None:
-            if index.stop < 0 and (
-                    (index.stop < index.start and index.start > 0) or (index.stop > index.start and index.start < 0)):
-                length = len(self) + index.stop - index.start
-            elif index.stop < index.start:
-                length = 0
-            else:
-                length = index.stop - index.start
-        return FileStream(self, start=index.start, length=length, close_on_exit=False)
+        return FileStream(self, start=start, length=max(stop - start, 0), close_on_exit=False)
 
     def __enter__(self) -> "FileStream":
         self._entries += 1
@@ -341,3 +481,154 @@ class FileStream(IO):
 
     def __iter__(self) -> Iterator[AnyStr]:
         raise UnsupportedOperation()
+
+
+class WindowedData:
+    """
+    A read-only, bytes-like view of a file of which only the first `head` and the last `tail` bytes are read up front.
+
+    The length of the view is the length of the entire file, so offsets relative to the end of the file are served
+    from the tail, and any other range of the file is read lazily (and positionally) when it is sliced. Slicing always
+    produces `bytes`. `lazy_bytes` counts the bytes that had to be read outside of the head and tail.
+
+    """
+    FIND_CHUNK_SIZE: int = 1024 * 1024
+
+    def __init__(self, stream: FileStream, head: int, tail: int = 0):
+        self.stream: FileStream = stream
+        self.size: int = len(stream)
+        head = min(max(head, 0), self.size)
+        tail = min(max(tail, 0), self.size - head)
+        self.head: bytes = stream[:head].content
+        self.tail_start: int = self.size - tail
+        self.tail: bytes = stream[self.tail_start:].content
+        self.lazy_bytes: int = 0
+        self.base: int = 0
+
+    @property
+    def name(self) -> str:
+        return self.stream.name
+
+    def segments(self, start: int = 0) -> Iterator[Tuple[int, bytes]]:
+        """Yields (offset, data) pairs for the parts of the head and the tail at or after `start`, in order"""
+        if start < len(self.head):
+            yield start, self.head[start:]
+        if self.tail:
+            start = max(start, self.tail_start)
+            if start < self.size:
+                yield start, self.tail[start - self.tail_start:]
+
+    def view(self, start: int) -> "WindowedData":
+        """Returns a view of the data at or after `start` that shares this view's stream, head, and tail"""
+        start = min(max(start, 0), self.size)
+        view = WindowedData.__new__(WindowedData)
+        view.stream = self.stream
+        view.size = self.size - start
+        view.head = self.head[start:]
+        view.tail_start = max(self.tail_start - start, 0)
+        view.tail = self.tail[max(start - self.tail_start, 0):]
+        view.lazy_bytes = 0
+        view.base = self.base + start
+        return view
+
+    def _read(self, start: int, stop: int) -> bytes:
+        if start >= stop:
+            return b""
+        elif stop <= len(self.head):
+            return self.head[start:stop]
+        elif start >= self.tail_start:
+            return self.tail[start - self.tail_start:stop - self.tail_start]
+        parts: List[bytes] = []
+        if start < len(self.head):
+            parts.append(self.head[start:])
+            start = len(self.head)
+        middle_stop = min(stop, self.tail_start)
+        parts.append(self.stream._source.pread(self.stream.offset() + self.base + start, middle_stop - start))
+        self.lazy_bytes += middle_stop - start
+        if stop > self.tail_start:
+            parts.append(self.tail[:stop - self.tail_start])
+        return b"".join(parts)
+
+    def find(self, sub: bytes, start: int = 0, end: Optional[int] = None) -> int:
+        """Equivalent to `bytes.find`, reading the data lazily in chunks"""
+        start, end, _ = slice(start, end).indices(self.size)
+        if not sub:
+            return start if start <= end else -1
+        while start < end:
+            chunk_end = min(start + self.FIND_CHUNK_SIZE, end)
+            # overlap the chunks so that occurrences spanning two of them are found
+            index = self._read(start, min(chunk_end + len(sub) - 1, end)).find(sub)
+            if index >= 0:
+                return start + index
+            start = chunk_end
+        return -1
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, index) -> Union[int, bytes]:
+        if isinstance(index, int):
+            if index < 0:
+                index += self.size
+            if not 0 <= index < self.size:
+                raise IndexError(f"{self!r} is {self.size} bytes long, but byte {index} was requested")
+            return self._read(index, index + 1)[0]
+        elif not isinstance(index, slice):
+            raise ValueError(f"unexpected argument {index}")
+        start, stop, step = index.indices(self.size)
+        if step == 1:
+            return self._read(start, stop)
+        return self._read(0, self.size)[index]
+
+    def __bytes__(self):
+        return self._read(0, self.size)
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({self.name!r}, head={len(self.head)}, tail={len(self.tail)})"
+
+
+class OffsetData:
+    """
+    A read-only, bytes-like view of the data at or after `offset` in other bytes-like data (e.g., an `mmap`).
+
+    Unlike slicing the underlying data, creating the view does not copy anything; like :class:`WindowedData`, slicing
+    the view produces `bytes`.
+
+    """
+    def __init__(self, data: Union[bytes, mmap.mmap, "OffsetData"], offset: int):
+        if isinstance(data, OffsetData):
+            offset += data.offset
+            data = data.data
+        self.data: Union[bytes, mmap.mmap] = data
+        self.offset: int = min(max(offset, 0), len(data))
+
+    def find(self, sub: bytes, start: int = 0, end: Optional[int] = None) -> int:
+        """Equivalent to `bytes.find`"""
+        start, end, _ = slice(start, end).indices(len(self))
+        index = self.data.find(sub, self.offset + start, self.offset + end)
+        if index < 0:
+            return -1
+        return index - self.offset
+
+    def __len__(self):
+        return len(self.data) - self.offset
+
+    def __getitem__(self, index) -> Union[int, bytes]:
+        if isinstance(index, int):
+            if index < 0:
+                index += len(self)
+            if not 0 <= index < len(self):
+                raise IndexError(f"{self!r} is {len(self)} bytes long, but byte {index} was requested")
+            return self.data[self.offset + index]
+        elif not isinstance(index, slice):
+            raise ValueError(f"unexpected argument {index}")
+        start, stop, step = index.indices(len(self))
+        if step == 1:
+            return self.data[self.offset + start:self.offset + max(start, stop)]
+        return self.data[self.offset:][index]
+
+    def __bytes__(self):
+        return self.data[self.offset:]
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({len(self.data)} bytes, offset={self.offset})"
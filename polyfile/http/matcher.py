@@ -1,8 +1,6 @@
-from pathlib import Path
-
 from ..ast import Node as ASTNode
-from ..fileutils import ExactNamedTempfile, FileStream
-from ..magic import MagicMatcher
+from ..fileutils import FileStream
+from ..magic import MagicDefinition, MagicMatcher
 from ..polyfile import register_parser, Match
 
 
@@ -13,13 +11,12 @@ HTTP_11_MIME_TYPE: str = f"{HTTP_MIME_TYPE}; version=1.1"
 
 
 # Register a magic matcher for HTTP 1.1 headers:
-with ExactNamedTempfile(b"""0 regex/s [^\\\\n]*?\\\\s+HTTP/1.1\\\\s*$ HTTP 1.1
+http_11_matcher = MagicMatcher.DEFAULT_INSTANCE.add(MagicDefinition(b"""0 regex/s [^\\\\n]*?\\\\s+HTTP/1.1\\\\s*$ HTTP 1.1
 !:mime """ + HTTP_11_MIME_TYPE.encode("utf-8") + b"""
 >0 string GET GET request header
 >0 string POST POST request header
 >0 string PUT PUT request header
-""", name="HTTP1.1Matcher") as t:
-    http_11_matcher = MagicMatcher.DEFAULT_INSTANCE.add(Path(t))[0]
+""", name="HTTP1.1Matcher"))[0]
 
 
 @register_parser(HTTP_11_MIME_TYPE)
@@ -10,6 +10,11 @@ class LazyIterableSequence(Generic[T], Sequence[T], AbstractSequence):
         self._source_iter: Optional[Iterator[T]] = iter(source)
         self._items: List[T] = []
 
+    @property
+    def items_so_far(self) -> Sequence[T]:
+        """Returns the items that have been read from the source iterator so far, without reading any more"""
+        return self._items
+
     def _get_next_source_item(self) -> T:
         if self._source_iter is None:
             raise StopIteration()
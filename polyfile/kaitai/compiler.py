@@ -17,7 +17,6 @@ import stat
 import subprocess
 import sys
 from typing import Iterable, List, Optional, Union
-from urllib.request import urlopen
 from zipfile import ZipFile
 
 
@@ -59,6 +58,9 @@ class CompiledKSY:
 
 
 def install_compiler():
+    # urllib is slow to import, and this is rarely needed
+    from urllib.request import urlopen
+
     resp = urlopen("https://github.com/kaitai-io/kaitai_struct_compiler/releases/download/0.9/"
                    "kaitai-struct-compiler-0.9.zip")
     zipfile = ZipFile(BytesIO(resp.read()))
@@ -1,20 +1,26 @@
 from abc import ABC, abstractmethod
+import ast
 from dataclasses import dataclass
 from enum import Enum
 from importlib import resources
 import importlib.util
 import inspect
 from io import BufferedReader, BytesIO
+from itertools import islice
 import json
+import mmap
+import os
 from pathlib import Path
+import struct
 import sys
+from types import ModuleType
 from typing import Any, Dict, Iterator, List, Optional, Set, Type, Union
 
 from . import parsers
 from .compiler import CompiledKSY
 from ..fileutils import FileStream
 
-from kaitaistruct import KaitaiStruct
+from kaitaistruct import EndOfStreamError, InvalidArgumentError, KaitaiStream, KaitaiStruct, NoTerminatorFoundError
 
 with resources.path(parsers, "manifest.json") as manifest_path:
     PARSER_DIR: Path = manifest_path.parent
@@ -40,6 +46,8 @@ del MANIFEST
 
 _IMPORTED_SPECS: Set[Path] = set()
 _PARSERS_BY_KSY: Dict[str, Type[KaitaiStruct]] = {}
+_UNMARKED_PARSERS_BY_KSY: Dict[str, Type[KaitaiStruct]] = {}
+_UNMARKED_MODULES: Dict[str, ModuleType] = {}
 
 
 def import_spec(compiled: CompiledKSY) -> Optional[Type[KaitaiStruct]]:
@@ -59,6 +67,77 @@ def import_spec(compiled: CompiledKSY) -> Optional[Type[KaitaiStruct]]:
     raise ImportError(f"Could not find parser class {compiled.class_name!r} in {compiled.python_path}")
 
 
+def _references_debug(node: ast.AST) -> bool:
+    return any(isinstance(n, ast.Attribute) and n.attr == "_debug" for n in ast.walk(node))
+
+
+def _strip_debug(statements: List[ast.stmt]) -> List[ast.stmt]:
+    """
+    Removes the statements that record field offsets in `_debug` from code generated by the Kaitai Struct compiler.
+
+    Imports of the other generated parsers are replaced by calls to `_import_unmarked_module`, so that they are stripped,
+    too.
+
+    """
+    stripped: List[ast.stmt] = []
+    for statement in statements:
+        if isinstance(statement, ast.ImportFrom) and statement.module == parsers.__name__:
+            stripped.extend(
+                ast.Assign(
+                    targets=[ast.Name(id=alias.asname or alias.name, ctx=ast.Store())],
+                    value=ast.Call(
+                        func=ast.Name(id="_import_unmarked_module", ctx=ast.Load()),
+                        args=[ast.Constant(value=alias.name)],
+                        keywords=[]
+                    )
+                )
+                for alias in statement.names
+            )
+            continue
+        blocks = ("body", "orelse", "finalbody", "handlers")
+        if any(
+                _references_debug(value)
+                for field, values in ast.iter_fields(statement)
+                if field not in blocks
+                for value in (values if isinstance(values, list) else (values,))
+                if isinstance(value, ast.AST)
+        ):
+            # this is either a bookkeeping statement or a block that only exists to initialize the bookkeeping
+            continue
+        for field in blocks:
+            block = getattr(statement, field, None)
+            if not block:
+                continue
+            if field == "handlers":
+                for handler in block:
+                    handler.body = _strip_debug(handler.body) or [ast.Pass()]
+            elif field == "body":
+                statement.body = _strip_debug(block) or [ast.Pass()]
+            else:
+                setattr(statement, field, _strip_debug(block))
+        stripped.append(statement)
+    return stripped
+
+
+def _import_unmarked_module(module_name: str) -> ModuleType:
+    """Imports the generated parser module `module_name` without the statements that record field offsets"""
+    if module_name not in _UNMARKED_MODULES:
+        path = PARSER_DIR / f"{module_name}.py"
+        tree = ast.parse(path.read_text(encoding="utf-8"), filename=str(path))
+        tree.body = _strip_debug(tree.body)
+        module = ModuleType(f"{__name__}.unmarked.{module_name}")
+        module.__file__ = str(path)
+        module.__dict__["_import_unmarked_module"] = _import_unmarked_module
+        # register the module before executing it, in case parsers import each other
+        _UNMARKED_MODULES[module_name] = module
+        try:
+            exec(compile(ast.fix_missing_locations(tree), str(path), "exec"), module.__dict__)
+        except BaseException:
+            del _UNMARKED_MODULES[module_name]
+            raise
+    return _UNMARKED_MODULES[module_name]
+
+
 @dataclass(unsafe_hash=True, order=True, frozen=True)
 class Segment:
     start: int
@@ -135,8 +214,8 @@ class ASTNode:
         return self.offset + self.segment.end
 
     @property
-    def raw_value(self):
-        """Sequence of bytes of this segment."""
+    def raw_value(self) -> memoryview:
+        """A zero-copy view of the bytes of this segment."""
         return self.root.get_value(self.start, self.end)
 
     @property
@@ -193,6 +272,32 @@ class CompoundNode(ASTNode, ABC):
             yield top
             stack.extend(reversed(top.children))
 
+    def stream(self, max_array_elements: Optional[int] = None) -> Iterator[ASTNode]:
+        """
+        Yields this node and its descendants in the same order as :meth:`dfs`, but without building the list of any
+        node's children.
+
+        Only the nodes on the path to the most recently yielded node are kept alive, and each element of a parsed array
+        is released as soon as it and its descendants have been yielded, so the memory used by the parsed struct shrinks
+        as it is streamed. This consumes the parse: afterward, its arrays no longer contain their elements.
+
+        If `max_array_elements` is not None, at most that many elements of each array are yielded.
+
+        """
+        yield self
+        stack: List[Iterator[ASTNode]] = [self._stream_children(max_array_elements)]
+        while stack:
+            child = next(stack[-1], None)
+            if child is None:
+                stack.pop()
+                continue
+            yield child
+            if isinstance(child, CompoundNode):
+                stack.append(child._stream_children(max_array_elements))
+
+    def _stream_children(self, max_array_elements: Optional[int]) -> Iterator[ASTNode]:
+        return self.explore()
+
     def make_child(
             self,
             obj: KaitaiStruct,
@@ -241,16 +346,146 @@ class ArrayNode(CompoundNode):
             name = f"{self.name}[{i}]"
             yield self.make_child(obj, name, segment, self.offset)
 
+    def _stream_children(self, max_array_elements: Optional[int]) -> Iterator[ASTNode]:
+        for i, child in enumerate(islice(self.explore(), max_array_elements)):
+            yield child
+            # the child's descendants have all been streamed by the time the next child is requested
+            self.obj[i] = None
+            self.parent.obj._debug[self.name]["arr"][i] = None
+
 
 class RootNode(StructNode):
-    def __init__(self, buffer: bytes, obj: KaitaiStruct):
-        self.buffer: bytes = buffer
+    def __init__(self, buffer: Union[bytes, memoryview, mmap.mmap], obj: KaitaiStruct):
+        # slicing a memoryview does not copy, so the nodes' raw values all share this buffer
+        self.buffer: memoryview = memoryview(buffer).toreadonly()
         super().__init__(obj, name=obj.__class__.__name__, segment=Segment(0, len(self.buffer)), offset=0)
 
-    def get_value(self, start, end):
+    def get_value(self, start, end) -> memoryview:
         return self.buffer[start:end]
 
 
+def _unpacker(packer: struct.Struct):
+    unpack_from = packer.unpack_from
+    size = packer.size
+
+    def read(self: "MappedKaitaiStream"):
+        if self.bits_left:
+            self.align_to_byte()
+        pos = self._pos
+        if pos + size > self._end:
+            raise EndOfStreamError(
+                f"requested {size} bytes, but only {max(self._end - pos, 0)} bytes available", size,
+                max(self._end - pos, 0)
+            )
+        self._pos = pos + size
+        return unpack_from(self._buffer, pos)[0]
+
+    return read
+
+
+class MappedKaitaiStream(KaitaiStream):
+    """
+    A read-only :class:`KaitaiStream` over a :class:`FileStream`.
+
+    Reads are served straight from the stream's shared in-memory buffer (a read-only `mmap`, in the case of a file) at
+    absolute offsets, rather than going through the `FileStream`'s `seek`/`read`, so the numeric reads in the hot loops
+    of the generated parsers are each a single unpack.
+
+    """
+    def __init__(self, stream: FileStream):
+        self._buffer: Union[bytes, mmap.mmap] = stream.shared_buffer()
+        # the absolute offsets of the start and end of `stream` within `self._buffer`, and of the current position
+        self._start: int = stream.offset()
+        self._end: int = self._start + len(stream)
+        self._pos: int = self._start
+        super().__init__(stream)
+
+    def is_eof(self):
+        if not self.bits_write_mode and self.bits_left > 0:
+            return False
+        return self._pos >= self._end
+
+    def seek(self, n):
+        if n < 0:
+            raise InvalidArgumentError(f"cannot seek to invalid position {n}")
+        self.align_to_byte()
+        self._pos = self._start + n
+
+    def pos(self):
+        return self._pos - self._start
+
+    def size(self):
+        return self._end - self._start
+
+    def read_bytes(self, n):
+        if self.bits_left:
+            self.align_to_byte()
+        return self._read_bytes_not_aligned(n)
+
+    def _read_bytes_not_aligned(self, n):
+        if n < 0:
+            raise InvalidArgumentError(f"requested invalid {n} amount of bytes")
+        pos = self._pos
+        if pos + n > self._end:
+            available = max(self._end - pos, 0)
+            raise EndOfStreamError(f"requested {n} bytes, but only {available} bytes available", n, available)
+        self._pos = pos + n
+        return bytes(self._buffer[pos:pos + n])
+
+    def read_bytes_full(self):
+        self.align_to_byte()
+        pos = self._pos
+        self._pos = max(pos, self._end)
+        return bytes(self._buffer[pos:self._end])
+
+    def read_bytes_term(self, term, include_term, consume_term, eos_error):
+        self.align_to_byte()
+        pos = self._pos
+        found = self._buffer.find(KaitaiStream.byte_from_int(term), pos, self._end)
+        if found < 0:
+            if eos_error:
+                raise NoTerminatorFoundError(KaitaiStream.byte_from_int(term), 0)
+            self._pos = max(pos, self._end)
+            return bytes(self._buffer[pos:self._end])
+        self._pos = found + 1 if consume_term else found
+        return bytes(self._buffer[pos:found + 1 if include_term else found])
+
+    def read_bytes_term_multi(self, term, include_term, consume_term, eos_error):
+        self.align_to_byte()
+        unit_size = len(term)
+        pos = self._pos
+        # the terminator must be aligned to a multiple of its size from the current position
+        found = pos
+        while found + unit_size <= self._end and self._buffer[found:found + unit_size] != term:
+            found += unit_size
+        if found + unit_size > self._end:
+            if eos_error:
+                raise NoTerminatorFoundError(term, max(self._end - found, 0))
+            self._pos = max(pos, self._end)
+            return bytes(self._buffer[pos:self._end])
+        self._pos = found + unit_size if consume_term else found
+        return bytes(self._buffer[pos:found + unit_size if include_term else found])
+
+    read_s1 = _unpacker(KaitaiStream.packer_s1)
+    read_s2be = _unpacker(KaitaiStream.packer_s2be)
+    read_s4be = _unpacker(KaitaiStream.packer_s4be)
+    read_s8be = _unpacker(KaitaiStream.packer_s8be)
+    read_s2le = _unpacker(KaitaiStream.packer_s2le)
+    read_s4le = _unpacker(KaitaiStream.packer_s4le)
+    read_s8le = _unpacker(KaitaiStream.packer_s8le)
+    read_u1 = _unpacker(KaitaiStream.packer_u1)
+    read_u2be = _unpacker(KaitaiStream.packer_u2be)
+    read_u4be = _unpacker(KaitaiStream.packer_u4be)
+    read_u8be = _unpacker(KaitaiStream.packer_u8be)
+    read_u2le = _unpacker(KaitaiStream.packer_u2le)
+    read_u4le = _unpacker(KaitaiStream.packer_u4le)
+    read_u8le = _unpacker(KaitaiStream.packer_u8le)
+    read_f4be = _unpacker(KaitaiStream.packer_f4be)
+    read_f8be = _unpacker(KaitaiStream.packer_f8be)
+    read_f4le = _unpacker(KaitaiStream.packer_f4le)
+    read_f8le = _unpacker(KaitaiStream.packer_f8le)
+
+
 class KaitaiInspector:
     def __init__(self, struct: KaitaiStruct):
         self.struct: KaitaiStruct = struct
@@ -259,14 +494,21 @@ class KaitaiInspector:
     @property
     def ast(self) -> RootNode:
         if self._ast is None:
+            if not hasattr(self.struct, "_debug"):
+                raise ValueError(f"{self.struct.__class__.__name__} was parsed without recording field offsets, so it "
+                                 "has no AST; load its parser with `offsets=True`")
             _io = self.struct._io._io
             if isinstance(_io, FileStream):
-                buffer = _io.content
+                buffer: Union[bytes, memoryview, mmap.mmap] = _io.view()
             elif isinstance(_io, BytesIO):
-                buffer = _io.getbuffer().tobytes()
+                buffer = _io.getvalue()
             elif isinstance(_io, BufferedReader):
                 with open(self.struct._io._io.name, 'rb') as f:
-                    buffer = f.read()
+                    if os.fstat(f.fileno()).st_size == 0:
+                        buffer = b""
+                    else:
+                        # the mapping remains valid after the file is closed
+                        buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
             else:
                 raise TypeError('Unsupported stream type')
 
@@ -276,11 +518,12 @@ class KaitaiInspector:
 
 
 class KaitaiParser:
-    def __init__(self, struct_type: Type[KaitaiStruct]):
+    def __init__(self, struct_type: Type[KaitaiStruct], offsets: bool = True):
         self.struct_type: Type[KaitaiStruct] = struct_type
+        self.offsets: bool = offsets
 
     @staticmethod
-    def load(ksy_path: str) -> "KaitaiParser":
+    def load(ksy_path: str, offsets: bool = True) -> "KaitaiParser":
         """Returns a parser for the given KSY file and input file.
 
         The KSY file is specified as a relative path to the file within the Kaitai struct format library.
@@ -290,7 +533,19 @@ class KaitaiParser:
              "image/jpeg.ksy"
              "network/pcap.ksy"
 
+        The parsers are compiled to record the offsets of every field they parse, which the AST requires. If `offsets`
+        is False, a variant of the parser that skips that bookkeeping is returned instead; it is considerably faster,
+        and is sufficient for checking whether an input is valid (see :meth:`validate`), but its parses have no AST.
+
         """
+        if not offsets:
+            if ksy_path not in _UNMARKED_PARSERS_BY_KSY:
+                if ksy_path not in COMPILED_INFO_BY_KSY:
+                    raise KeyError(ksy_path)
+                info = COMPILED_INFO_BY_KSY[ksy_path]
+                module = _import_unmarked_module(info.python_path.name[:-3])
+                _UNMARKED_PARSERS_BY_KSY[ksy_path] = getattr(module, info.class_name)
+            return KaitaiParser(_UNMARKED_PARSERS_BY_KSY[ksy_path], offsets=False)
         if ksy_path not in _PARSERS_BY_KSY:
             if ksy_path not in COMPILED_INFO_BY_KSY:
                 raise KeyError(ksy_path)
@@ -298,13 +553,24 @@ class KaitaiParser:
             _PARSERS_BY_KSY[ksy_path] = import_spec(info)  # type: ignore
         return KaitaiParser(_PARSERS_BY_KSY[ksy_path])
 
-    def parse(self, input_file_path_or_content: Union[str, Path, bytes, BytesIO]) -> KaitaiInspector:
+    def validate(self, input_file_path_or_content: Union[str, Path, bytes, BytesIO, FileStream]) -> bool:
+        """Returns whether the input parses successfully"""
+        try:
+            self.parse(input_file_path_or_content)
+        except Exception:
+            # the generated parsers can raise almost anything on malformed input, not just a `KaitaiStructError`
+            return False
+        return True
+
+    def parse(self, input_file_path_or_content: Union[str, Path, bytes, BytesIO, FileStream]) -> KaitaiInspector:
         if isinstance(input_file_path_or_content, Path):
             input_file_path_or_content = str(input_file_path_or_content)
         if isinstance(input_file_path_or_content, str):
             struct = self.struct_type.from_file(input_file_path_or_content)
         elif isinstance(input_file_path_or_content, bytes):
             struct = self.struct_type.from_bytes(input_file_path_or_content)
+        elif isinstance(input_file_path_or_content, FileStream):
+            struct = self.struct_type(MappedKaitaiStream(input_file_path_or_content))
         else:
             # Treat it like BytesIO
             struct = self.struct_type.from_io(input_file_path_or_content)
@@ -1,13 +1,11 @@
 import base64
 import re
-from typing import Dict, Iterator, List, Tuple, Type
+from typing import Dict, Iterator, List, Optional, Tuple, Type
 
 from kaitaistruct import KaitaiStruct, KaitaiStructError
 
-from .kaitai.parser import ASTNode, KaitaiParser, RootNode
-from .kaitai.parsers.gif import Gif
-from .kaitai.parsers.jpeg import Jpeg
-from .kaitai.parsers.png import Png
+from .fileutils import FileStream
+from .kaitai.parser import ArrayNode, ASTNode, CompoundNode, KaitaiParser, RootNode
 from .logger import getStatusLogger
 from .polyfile import register_parser, InvalidMatch, Match, Parser, Submatch
 
@@ -60,17 +58,33 @@ IMAGE_MIMETYPES = {
 MIME_BY_PARSER: Dict[Type[KaitaiStruct], str] = {}
 
 
-def ast_to_matches(ast: RootNode, parent: Match) -> Iterator[Submatch]:
-    stack: List[Tuple[Match, ASTNode]] = [(parent, ast)]
-    while stack:
-        parent, node = stack.pop()
+def ast_to_matches(ast: RootNode, parent: Match, max_array_elements: Optional[int] = None) -> Iterator[Submatch]:
+    """
+    Converts the parse `ast` into submatches of `parent`.
+
+    The parse is streamed (see :meth:`CompoundNode.stream`), so it is consumed by the conversion, and the parsed array
+    elements are released as they are converted. If `max_array_elements` is not None, at most that many elements of
+    each array are converted, and the submatches of the longer arrays are marked as truncated.
+
+    """
+    # the AST nodes on the path to the current node, and their submatches
+    path: List[Tuple[ASTNode, Match]] = []
+    for node in ast.stream(max_array_elements):
+        while path and path[-1][0] is not node.parent:
+            path.pop()
+        if path:
+            parent_node, parent_match = path[-1]
+            parent_start = parent_node.start
+        else:
+            # node offsets are relative to the start of the parsed stream, which is where `parent` starts
+            parent_match, parent_start = parent, 0
 
         new_node = Submatch(
             name=node.name,
             match_obj=node.raw_value,
-            relative_offset=node.start - parent.offset,
+            relative_offset=node.start - parent_start,
             length=len(node.segment),
-            parent=parent
+            parent=parent_match
         )
 
         if node is ast and node.obj.__class__ in MIME_BY_PARSER:  # type: ignore
@@ -79,35 +93,71 @@ def ast_to_matches(ast: RootNode, parent: Match) -> Iterator[Submatch]:
                 # this is an image type, so create a preview
                 new_node.img_data = f"data:{mtype};base64,{base64.b64encode(ast.raw_value).decode('utf-8')}"
 
-        yield new_node
-        stack.extend(reversed([(new_node, c) for c in node.children]))
-
-
-for mimetype, kaitai_path in KAITAI_MIME_MAPPING.items():
-    class parse_:
-        kaitai_parser = KaitaiParser.load(kaitai_path)
-
-        def __call__(self, stream, match):
-            try:
-                ast = self.kaitai_parser.parse(stream).ast
-            except KaitaiStructError as e:
-                log.warning(f"Error parsing {stream.name} using {self.kaitai_parser}: {e!s}")
-                raise InvalidMatch()
-            except Exception as e:
-                log.error(f"Unexpected exception parsing {stream.name} using {self.kaitai_parser}: {e!s}")
-                raise InvalidMatch()
-            yield from ast_to_matches(ast, parent=match)
+        if max_array_elements is not None and isinstance(node, ArrayNode) and len(node.obj) > max_array_elements:
+            new_node.truncated = f"exceeded the limit of {max_array_elements} array elements"
 
-    func_name = mimetype.replace("/", "_").replace("-", "_")
+        yield new_node
+        if isinstance(node, CompoundNode):
+            path.append((node, new_node))
+
+
+class KaitaiMatcher(Parser):
+    """
+    Parses a MIME type using a Kaitai struct.
+
+    The generated parser module is only imported the first time a file of the MIME type is parsed, so that importing
+    PolyFile (and matching files that never need it) does not have to load every Kaitai parser.
+
+    """
+    def __init__(self, mimetype: str, ksy_path: str):
+        self.mimetype: str = mimetype
+        self.ksy_path: str = ksy_path
+        self._kaitai_parser: Optional[KaitaiParser] = None
+        self._kaitai_validator: Optional[KaitaiParser] = None
+
+    @property
+    def kaitai_parser(self) -> KaitaiParser:
+        if self._kaitai_parser is None:
+            self._kaitai_parser = KaitaiParser.load(self.ksy_path)
+            MIME_BY_PARSER[self._kaitai_parser.struct_type] = self.mimetype
+        return self._kaitai_parser
+
+    def load(self):
+        _ = self.kaitai_parser
+
+    def validate(self, stream: FileStream) -> bool:
+        """
+        Returns whether `stream` is a valid instance of this parser's MIME type.
+
+        This uses the variant of the Kaitai parser that does not record field offsets (see :meth:`KaitaiParser.load`),
+        so it is much faster than :meth:`parse`.
+
+        """
+        if self._kaitai_validator is None:
+            self._kaitai_validator = KaitaiParser.load(self.ksy_path, offsets=False)
+        return self._kaitai_validator.validate(stream)
+
+    def parse(self, stream: FileStream, match: Match) -> Iterator[Submatch]:
+        kaitai_parser = self.kaitai_parser
+        try:
+            ast = kaitai_parser.parse(stream).ast
+        except KaitaiStructError as e:
+            log.warning(f"Error parsing {stream.name} using {kaitai_parser}: {e!s}")
+            raise InvalidMatch()
+        except Exception as e:
+            log.error(f"Unexpected exception parsing {stream.name} using {kaitai_parser}: {e!s}")
+            raise InvalidMatch()
+        budget = match.matcher.budget
+        yield from ast_to_matches(
+            ast, parent=match, max_array_elements=None if budget is None else budget.max_array_elements
+        )
 
-    parse_.__name__ = f"{parse_.__name__}{func_name}"
-    parse_.__qualname__ = f"{parse_.__qualname__}{func_name}"
+    def __str__(self):
+        return f"parse_{self.mimetype.replace('/', '_').replace('-', '_')}"
 
-    register_parser(mimetype)(parse_())
 
-    MIME_BY_PARSER[parse_.kaitai_parser.struct_type] = mimetype
+for mimetype, kaitai_path in KAITAI_MIME_MAPPING.items():
+    register_parser(mimetype)(KaitaiMatcher(mimetype, kaitai_path))
 
-del func_name
 del kaitai_path
 del mimetype
-del parse_
@@ -3,7 +3,9 @@ from typing import List, Optional, Sequence
 
 from .logger import StatusLogger
 from .polyfile import Match, Submatch, register_parser
-from .magic import AbsoluteOffset, FailedTest, MagicMatcher, MagicTest, MatchedTest, TestResult, TestType
+from .magic import (
+    AbsoluteOffset, FailedTest, MagicMatcher, MagicTest, MatchedTest, TestResult, TestType, window_segments
+)
 
 
 log = StatusLogger("polyfile")
@@ -129,7 +131,9 @@ class BFMatcher(MagicTest):
 
     def test(self, data: bytes, absolute_offset: int, parent_match: Optional[TestResult]) -> TestResult:
         try:
-            program = BFProgram.parse(data[absolute_offset:])
+            # if the data are windowed, only the rest of the head is scanned
+            _, program_data = next(window_segments(data, absolute_offset), (absolute_offset, b""))
+            program = BFProgram.parse(program_data)
         except BFParseError as e:
             return FailedTest(self, offset=e.offset, message=str(e))
         important_commands = frozenset(BFCommandType) - {BFCommandType.INPUT}
@@ -9,31 +9,43 @@ details about the file.
 
 """
 from abc import ABC, abstractmethod
+import codecs
 from collections import defaultdict
+from contextlib import nullcontext
 import csv
 from datetime import datetime
+import gc
+import hashlib
 from enum import Enum, IntFlag
+import importlib
 from importlib import resources
+import io
 from io import StringIO
 import json
 import logging
+import mmap
+import operator
+import os
 from pathlib import Path
+import pickle
 import re
+import stat
 import struct
 import sys
+from tempfile import NamedTemporaryFile
 from time import gmtime, localtime, strftime
 from typing import (
-    Any, BinaryIO, Callable, Dict, Generic, Iterable, Iterator, List, Optional, Set, Tuple, Type, TypeVar, Union
+    Any, BinaryIO, Callable, ContextManager, Dict, Generic, IO, Iterable, Iterator, List, Optional, Set, Tuple, Type,
+    TypeVar, Union
 )
 from uuid import UUID
 
-from chardet.universaldetector import UniversalDetector
-
 from .arithmetic import CStyleInt, make_c_style_int
-from .fileutils import Streamable
+from .fileutils import FileStream, OffsetData, Streamable, user_cache_dir, WindowedData
 from .iterators import LazyIterableSet
 from .logger import getStatusLogger, TRACE
 from .repl import ANSIColor, ANSIWriter
+from .search import MultiSequenceSearch
 
 from . import magic_defs
 
@@ -69,6 +81,9 @@ MAGIC_DEFS: List[Path] = [
     if resource_name not in ("COPYING", "magic.mgc", "__pycache__") and not resource_name.startswith(".")
 ]
 
+# FIXME: skip the DER definition for now because we don't yet support it
+DEFAULT_MAGIC_DEFS: List[Path] = [d for d in MAGIC_DEFS if d.name != "der"]
+
 
 WHITESPACE: bytes = b" \r\t\n\v\f"
 ESCAPES = {
@@ -258,6 +273,32 @@ class FailedTest(TestResult):
         writer.write(f"{self.test} did not match at offset {self.offset} because {self.message}\n", dim=True)
 
 
+class _Mismatch(FailedTest):
+    """
+    The result of any test that did not match, when failures are not being explained.
+
+    See :attr:`MagicTest.explain_failures`. This is a singleton, so returning it allocates nothing.
+
+    """
+    test = None
+    offset = -1
+    parent = None
+    message = "the test did not match (enable `MagicTest.explain_failures` for details)"
+    _child_matched = False
+
+    def __init__(self):
+        pass
+
+    def __hash__(self):
+        return id(self)
+
+    def __repr__(self):
+        return "MISMATCH"
+
+
+MISMATCH: FailedTest = _Mismatch()
+
+
 class Endianness(Enum):
     NATIVE = "="
     LITTLE = "<"
@@ -290,6 +331,35 @@ def parse_numeric(text: Union[str, bytes]) -> int:
         return int(text) * factor
 
 
+def identity(n: int) -> int:
+    return n
+
+
+def divide(a, b):
+    """C-style division: integer division for integers, and true division for floats"""
+    if isinstance(a, float):
+        return a / b
+    return a // b
+
+
+class OperandFunction:
+    """
+    A unary function that applies a binary operator with a fixed right-hand operand; e.g., `lambda n: n * operand`.
+
+    Unlike a lambda, this can be pickled, which is required for magic snapshots.
+
+    """
+    def __init__(self, operator: Callable[[Any, Any], Any], operand: Any):
+        self.operator: Callable[[Any, Any], Any] = operator
+        self.operand: Any = operand
+
+    def __call__(self, n):
+        return self.operator(n, self.operand)
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}(operator={self.operator!r}, operand={self.operand!r})"
+
+
 class Offset(ABC):
     @abstractmethod
     def to_absolute(self, data: bytes, last_match: Optional[TestResult], allow_invalid: bool = False) -> int:
@@ -405,7 +475,7 @@ class IndirectOffset(Offset):
     OctalIndirectOffset = -1
 
     def __init__(self, offset: Offset, num_bytes: int, endianness: Endianness, signed: bool,
-                 post_process: Callable[[int], int] = lambda n: n):
+                 post_process: Callable[[int], int] = identity):
         self.offset: Offset = offset
         self.num_bytes: int = num_bytes
         self.endianness: Endianness = endianness
@@ -427,7 +497,7 @@ class IndirectOffset(Offset):
             value: Optional[int] = None
             if octal_string_end > offset:
                 try:
-                    value = int(data[:octal_string_end], 8)
+                    value = int(data[offset:octal_string_end], 8)
                 except ValueError:
                     pass
             if value is None:
@@ -499,7 +569,7 @@ class IndirectOffset(Offset):
             raise ValueError(f"Unsupported indirect specifier type: {m.group('type')!r}")
         pp = m.group("post_process")
         if pp is None:
-            post_process = lambda n: n
+            post_process: Callable[[int], int] = identity
         else:
             multiply = pp.startswith("*")
             bitwise_and = pp.startswith("&")
@@ -516,13 +586,13 @@ class IndirectOffset(Offset):
                 pp = pp[1:-1]
             operand = parse_numeric(pp)
             if multiply:
-                post_process = lambda n: n * operand
+                post_process = OperandFunction(operator.mul, operand)
             elif bitwise_and:
-                post_process = lambda n: n & operand
+                post_process = OperandFunction(operator.and_, operand)
             elif divide:
-                post_process = lambda n: n // operand
+                post_process = OperandFunction(operator.floordiv, operand)
             else:
-                post_process = lambda n: n + operand
+                post_process = OperandFunction(operator.add, operand)
         return IndirectOffset(
             offset=Offset.parse(m.group("offset")),
             num_bytes=num_bytes,
@@ -556,21 +626,128 @@ class SourceInfo:
         return f"{self.path!s}:{self.line}"
 
 
+class MagicDefinition:
+    """
+    Magic definitions held in memory, which can be used anywhere a definition file path can.
+
+    `name` is used in place of a file path when reporting the source of the tests (e.g., in the debugger).
+
+    """
+    def __init__(self, definitions: Union[str, bytes], name: str):
+        if isinstance(definitions, str):
+            definitions = definitions.encode("utf-8")
+        self.definitions: bytes = definitions
+        self.name: str = name
+
+    @property
+    def path(self) -> Path:
+        return Path(self.name)
+
+    def readlines(self) -> List[bytes]:
+        return self.definitions.splitlines(keepends=True)
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}(definitions={self.definitions!r}, name={self.name!r})"
+
+    def __str__(self):
+        return self.name
+
+
+class IdentificationWindow:
+    """
+    Bounds the data that are read up front to identify a file: its first `head` bytes and its last `tail` bytes.
+
+    Like libmagic's `bytes_max` parameter, tests that scan the data rather than read them at an offset (e.g., `search`
+    tests without a range) only scan the window. Every other read is still answered, lazily reading the part of the
+    file outside of the window if a test really needs it (see :class:`fileutils.WindowedData`), and the length of
+    the data is always the length of the entire file, so offsets relative to the end of the file are served from the
+    tail.
+
+    """
+    def __init__(self, head: int, tail: int = 0):
+        if head < 0 or tail < 0:
+            raise ValueError("the head and tail of an identification window cannot be negative")
+        self.head: int = head
+        self.tail: int = tail
+
+    def to_dict(self) -> Dict[str, int]:
+        return {"head": self.head, "tail": self.tail}
+
+    def __eq__(self, other):
+        return isinstance(other, IdentificationWindow) and self.to_dict() == other.to_dict()
+
+    def __hash__(self):
+        return hash((self.head, self.tail))
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}(head={self.head!r}, tail={self.tail!r})"
+
+
+def window_segments(data: Union[bytes, mmap.mmap, WindowedData], start: int) -> Iterator[Tuple[int, bytes]]:
+    """
+    Yields (offset, data) pairs for the data at or after `start` that a test scanning for something should see.
+
+    This is the remainder of the data unless they are windowed, in which case it is the remainder of the head followed
+    by the tail.
+
+    """
+    if isinstance(data, WindowedData):
+        yield from data.segments(start)
+    else:
+        yield start, data[start:]
+
+
+def window_head(data: Union[bytes, mmap.mmap, WindowedData], start: int) -> Tuple[bytes, bool]:
+    """
+    Returns the data at or after `start` that a test parsing them should see, and whether they were cut off.
+
+    This is the remainder of the data unless they are windowed, in which case it is only the remainder of the head, and
+    it is cut off if the head does not extend to the end of the data.
+
+    """
+    if isinstance(data, WindowedData):
+        return data.head[start:], len(data.head) < len(data)
+    return data[start:], False
+
+
 class MatchContext:
-    def __init__(self, data: bytes, path: Optional[Path] = None, only_match_mime: bool = False):
-        self.data: bytes = data
+    """
+    The data against which magic tests are matched.
+
+    `data` may either be `bytes`, a read-only `mmap` of the input file, or a :class:`fileutils.WindowedData` view of
+    it. Slicing a context from an offset does not copy the data, but rather produces a context whose data are a view
+    of the remainder (see :class:`fileutils.OffsetData`). Either way, slicing `data` produces `bytes`, so tests should
+    only ever slice out the (bounded) window of data that they need rather than the entire remainder of the file; see
+    :meth:`DataType.window`.
+
+    """
+    def __init__(
+            self,
+            data: Union[bytes, mmap.mmap, WindowedData, OffsetData],
+            path: Optional[Path] = None,
+            only_match_mime: bool = False
+    ):
+        self.data: Union[bytes, mmap.mmap, WindowedData, OffsetData] = data
         self.path: Optional[Path] = path
         self.only_match_mime: bool = only_match_mime
 
     def __getitem__(self, s: slice) -> "MatchContext":
         if not isinstance(s, slice):
             raise ValueError("Match contexts can only be sliced")
-        return MatchContext(data=self.data[s], path=self.path, only_match_mime=self.only_match_mime)
+        if s.stop is not None or s.step is not None:
+            data: Union[bytes, mmap.mmap, WindowedData, OffsetData] = self.data[s]
+        elif isinstance(self.data, WindowedData):
+            data = self.data.view(s.start or 0)
+        else:
+            # do not copy the remainder of the data (e.g., when carving a large file at many offsets)
+            data = OffsetData(self.data, s.start or 0)
+        return MatchContext(data=data, path=self.path, only_match_mime=self.only_match_mime)
 
     @property
     def is_executable(self) -> bool:
         if self.path is None:
-            log.warning("Unable to determine if the input data is executable; assuming it is not.")
+            # e.g., the data were decoded from within another file
+            log.debug("Unable to determine if the input data is executable; assuming it is not.")
             return False
         try:
             return bool(self.path.stat().st_mode & 0o111)
@@ -579,15 +756,63 @@ class MatchContext:
             return False
 
     @staticmethod
-    def load(stream_or_path: Union[str, Path, BinaryIO], only_match_mime: bool = False) -> "MatchContext":
+    def load(
+            stream_or_path: Union[str, Path, BinaryIO],
+            only_match_mime: bool = False,
+            window: Optional[IdentificationWindow] = None
+    ) -> "MatchContext":
+        """
+        Loads the data to be matched from a file.
+
+        If a `window` is given and the file is larger than it, only the window is read up front. A file given by its
+        path then remains open for as long as the context's data are referenced, since the rest of it is read lazily;
+        a stream must be kept open by the caller.
+
+        """
         if isinstance(stream_or_path, str) or isinstance(stream_or_path, Path):
+            if window is not None:
+                stream = FileStream(stream_or_path)
+                if len(stream) > window.head + window.tail:
+                    return MatchContext.load(stream, only_match_mime, window)
+                stream.close()
             with open(stream_or_path, "rb") as f:
                 return MatchContext.load(f, only_match_mime)
-        if hasattr(stream_or_path, "name") and stream_or_path.name is not None:
-            path: Optional[Path] = Path(stream_or_path.name)
+        if isinstance(stream_or_path, FileStream):
+            if stream_or_path.in_memory:
+                path: Optional[Path] = None
+            else:
+                path = Path(stream_or_path.name)
+            if window is not None and not stream_or_path.in_memory \
+                    and len(stream_or_path) > window.head + window.tail:
+                return MatchContext(WindowedData(stream_or_path, window.head, window.tail), path, only_match_mime)
+            return MatchContext(stream_or_path.buffer(), path, only_match_mime)
+        elif window is not None and stream_or_path.seekable():
+            with FileStream(stream_or_path) as stream:
+                return MatchContext.load(stream, only_match_mime, window)
+        elif hasattr(stream_or_path, "name") and stream_or_path.name is not None:
+            path = Path(stream_or_path.name)
         else:
             path = None
-        return MatchContext(stream_or_path.read(), path, only_match_mime)
+        data: Optional[Union[bytes, mmap.mmap]] = MatchContext._map(stream_or_path)
+        if data is None:
+            data = stream_or_path.read()
+        return MatchContext(data, path, only_match_mime)
+
+    @staticmethod
+    def _map(stream: BinaryIO) -> Optional[mmap.mmap]:
+        """Memory maps the stream if it is a non-empty regular file that is at its start; otherwise returns None"""
+        if not isinstance(stream, (io.BufferedReader, io.BufferedRandom, io.FileIO)):
+            return None
+        try:
+            if stream.tell() != 0:
+                return None
+            fileno = stream.fileno()
+            st = os.fstat(fileno)
+            if not stat.S_ISREG(st.st_mode) or st.st_size == 0:
+                return None
+            return mmap.mmap(fileno, 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            return None
 
 
 class Message(ABC):
@@ -685,6 +910,16 @@ class TestType(IntFlag):
 class MagicTest(ABC):
     AUTO_REGISTER_TEST: bool = True
 
+    explain_failures: bool = False
+    """
+    Whether tests that do not match should return a :class:`FailedTest` explaining why.
+
+    Matching discards failed results, so by default the most frequently evaluated tests return the :data:`MISMATCH`
+    singleton instead, without allocating a result or formatting its message. The debugger enables this while it is
+    attached.
+
+    """
+
     def __init__(
             self,
             offset: Offset,
@@ -925,6 +1160,26 @@ class MagicTest(ABC):
     def calculate_absolute_offset(self, data: bytes, parent_match: Optional[TestResult] = None) -> int:
         return self.offset.to_absolute(data, parent_match)
 
+    def magic_prefix(self) -> Optional[Tuple[int, bytes]]:
+        """
+        Returns an (absolute offset, bytes) pair such that this test can only match data that contain those bytes at that
+        offset, or None if there is no such pair.
+
+        """
+        return None
+
+    def dispatch_key(self) -> Optional[Tuple[int, int]]:
+        """
+        Returns an (absolute offset, byte value) pair such that this test can only match data that have that byte
+        value at that offset, or None if there is no such pair. This is used by :class:`DispatchIndex`.
+
+        """
+        prefix = self.magic_prefix()
+        if prefix is None:
+            return None
+        offset, magic = prefix
+        return offset, magic[0]
+
     def _match(self, context: MatchContext, parent_match: Optional[TestResult] = None) -> Iterator[MatchedTest]:
         if context.only_match_mime and not self.can_match_mime:
             return
@@ -1060,6 +1315,25 @@ class DataType(ABC, Generic[T]):
     def match(self, data: bytes, expected: T) -> DataTypeMatch:
         raise NotImplementedError()
 
+    def window(self, expected: T) -> Optional[int]:
+        """
+        Returns the maximum number of bytes that `self.match` could possibly consume when matching `expected`.
+
+        Callers need only pass that many bytes to `self.match`. None means that the amount is unbounded.
+
+        """
+        return None
+
+    def prefix(self, expected: T) -> Optional[bytes]:
+        """
+        Returns the bytes with which any data matching `expected` must start, or None if they are not fixed.
+
+        This is used to index tests by the bytes they expect (see :class:`DispatchIndex`), so it must be conservative:
+        if this returns a prefix, `self.match` must fail on any data that does not start with it.
+
+        """
+        return None
+
     @staticmethod
     def parse(fmt: str) -> "DataType":
         if fmt in TYPES_BY_NAME:
@@ -1115,6 +1389,14 @@ class GUIDType(DataType[Union[UUID, UUIDWildcard]]):
             specification = "B61BE100-5B4E-11CF-A8FD-00805F5C442B"
         return UUID(str(specification.strip()))
 
+    def window(self, expected: Union[UUID, UUIDWildcard]) -> int:
+        return 16
+
+    def prefix(self, expected: Union[UUID, UUIDWildcard]) -> Optional[bytes]:
+        if isinstance(expected, UUIDWildcard):
+            return None
+        return expected.bytes_le
+
     def match(self, data: bytes, expected: Union[UUID, UUIDWildcard]) -> DataTypeMatch:
         if len(data) < 16:
             return DataTypeMatch.INVALID
@@ -1148,6 +1430,12 @@ class UTF16Type(DataType[bytes]):
         else:
             return specification.encode("utf-16-be")
 
+    def window(self, expected: bytes) -> int:
+        return len(expected)
+
+    def prefix(self, expected: bytes) -> bytes:
+        return expected
+
     def match(self, data: bytes, expected: bytes) -> DataTypeMatch:
         if data.startswith(expected):
             if self.endianness == Endianness.LITTLE:
@@ -1180,6 +1468,14 @@ class StringTest(ABC):
     def matches(self, data: bytes) -> DataTypeMatch:
         raise NotImplementedError()
 
+    def max_length(self) -> Optional[int]:
+        """Returns the maximum number of bytes a match could span, or None if it is unbounded"""
+        return None
+
+    def prefix(self) -> Optional[bytes]:
+        """Returns the bytes with which any match must start, or None if they are not fixed"""
+        return None
+
     @abstractmethod
     def is_always_text(self) -> bool:
         raise NotImplementedError()
@@ -1250,6 +1546,9 @@ class StringWildcard(StringTest):
     def is_always_text(self) -> bool:
         return False
 
+    def max_length(self) -> Optional[int]:
+        return self.num_bytes
+
     def search(self, data: bytes) -> DataTypeMatch:
         return self.matches(data)
 
@@ -1265,6 +1564,10 @@ class NegatedStringTest(StringWildcard):
     def is_always_text(self) -> bool:
         return self.parent.is_always_text()
 
+    def max_length(self) -> Optional[int]:
+        # if the parent test fails, we fall back to matching a null-terminated string of unbounded length
+        return None
+
     def matches(self, data: bytes) -> DataTypeMatch:
         result = self.parent.matches(data)
         if result == DataTypeMatch.INVALID:
@@ -1401,6 +1704,12 @@ class StringMatch(StringTest):
             flags |= re.IGNORECASE
         return flags
 
+    def __getstate__(self):
+        # compiled patterns are expensive to unpickle, so let them be lazily recompiled on demand
+        state = dict(self.__dict__)
+        state["_pattern"] = None
+        return state
+
     @property
     def pattern(self) -> re.Pattern:
         if self._pattern is None:
@@ -1420,6 +1729,21 @@ class StringMatch(StringTest):
                     self._is_always_text = False
         return self._is_always_text
 
+    def max_length(self) -> Optional[int]:
+        if self.compact_whitespace:
+            # each whitespace character can match an arbitrary amount of whitespace
+            return None
+        elif self.full_word_match:
+            # we need to be able to see the character after the match to determine whether it is on a word boundary
+            return len(self.string) + 1
+        return len(self.string)
+
+    def prefix(self) -> Optional[bytes]:
+        if self.case_insensitive_lower or self.case_insensitive_upper or self.compact_whitespace or \
+                self.optional_blanks:
+            return None
+        return self.string
+
     def matches(self, data: bytes) -> DataTypeMatch:
         m = self.pattern.match(data)
         if m:
@@ -1486,6 +1810,12 @@ class StringType(DataType[StringTest]):
             num_bytes=self.num_bytes
         )
 
+    def window(self, expected: StringTest) -> Optional[int]:
+        return expected.max_length()
+
+    def prefix(self, expected: StringTest) -> Optional[bytes]:
+        return expected.prefix()
+
     def match(self, data: bytes, expected: StringTest) -> DataTypeMatch:
         return expected.matches(data)
 
@@ -1558,6 +1888,17 @@ class SearchType(StringType):
     def is_text(self, value: StringTest) -> bool:
         return value.is_always_text()
 
+    def window(self, expected: StringTest) -> Optional[int]:
+        # libmagic only tries to match at the first `repetitions` offsets
+        length = expected.max_length()
+        if self.repetitions is None or length is None:
+            return None
+        return self.repetitions + length
+
+    def prefix(self, expected: StringTest) -> None:
+        # the match can start anywhere in the search range
+        return None
+
     def match(self, data: bytes, expected: StringTest) -> DataTypeMatch:
         return expected.search(data)
 
@@ -1639,6 +1980,12 @@ class PascalStringType(DataType[StringTest]):
     def parse_expected(self, specification: str) -> StringTest:
         return StringTest.parse(specification)
 
+    def window(self, expected: StringTest) -> Optional[int]:
+        if self.byte_length == 4:
+            return None
+        # the length prefix plus the longest string it can express
+        return self.byte_length + (1 << (8 * self.byte_length)) - 1
+
     def match(self, data: bytes, expected: StringTest) -> DataTypeMatch:
         if len(data) < self.byte_length:
             return DataTypeMatch.INVALID
@@ -1759,6 +2106,11 @@ class RegexType(DataType[Pattern[bytes]]):
         except re.error as e:
             raise ValueError(str(e))
 
+    def window(self, expected: Pattern[bytes]) -> int:
+        if self.limit_lines:
+            return 80 * self.length
+        return self.length
+
     def match(self, data: bytes, expected: Pattern[bytes]) -> DataTypeMatch:
         if self.limit_lines:
             limit = self.length
@@ -1885,6 +2237,10 @@ class BaseNumericDataType(Enum):
         self.to_value: Callable[[int], Any] = to_value
         BASE_NUMERIC_TYPES_BY_NAME[name] = self
 
+    def __reduce_ex__(self, protocol):
+        # our values contain lambdas, so pickle by name rather than by value
+        return getattr, (self.__class__, self.name)
+
 
 NUMERIC_OPERATORS_BY_SYMBOL: Dict[str, "NumericOperator"] = {}
 
@@ -1912,6 +2268,10 @@ class NumericOperator(Enum):
     def get(symbol: str) -> "NumericOperator":
         return NUMERIC_OPERATORS_BY_SYMBOL[symbol]
 
+    def __reduce_ex__(self, protocol):
+        # our values contain lambdas, so pickle by name rather than by value
+        return getattr, (self.__class__, self.name)
+
     def __str__(self):
         return self.symbol
 
@@ -1998,7 +2358,7 @@ class NumericDataType(DataType[NumericValue]):
             base_type: BaseNumericDataType,
             unsigned: bool = False,
             endianness: Endianness = Endianness.NATIVE,
-            preprocess: Callable[[int], int] = lambda x: x
+            preprocess: Callable[[int], int] = identity
     ):
         super().__init__(name)
         self.base_type: BaseNumericDataType = base_type
@@ -2007,6 +2367,12 @@ class NumericDataType(DataType[NumericValue]):
         self.preprocess: Callable[[int], int] = preprocess
         if self.endianness == Endianness.PDP and self.base_type.num_bytes != 4:
             raise ValueError(f"PDP endianness can only be used with four byte base types, not {self.base_type}")
+        if self.unsigned and self.base_type not in (BaseNumericDataType.DOUBLE, BaseNumericDataType.FLOAT):
+            struct_fmt = self.base_type.struct_fmt.upper()
+        else:
+            struct_fmt = self.base_type.struct_fmt
+        # this is computed once rather than every time the type is matched
+        self.struct_fmt: str = f"{self.endianness.value}{struct_fmt}"
 
     def is_text(self, value: NumericValue) -> bool:
         return False
@@ -2017,6 +2383,21 @@ class NumericDataType(DataType[NumericValue]):
         else:
             return NumericValue.parse(specification, self.base_type.num_bytes)
 
+    def window(self, expected: NumericValue) -> int:
+        return self.base_type.num_bytes
+
+    def prefix(self, expected: NumericValue) -> Optional[bytes]:
+        if not isinstance(expected, IntegerValue) or expected.operator != NumericOperator.EQUALS \
+                or self.preprocess is not identity or self.endianness == Endianness.PDP \
+                or self.base_type in (BaseNumericDataType.FLOAT, BaseNumericDataType.DOUBLE):
+            return None
+        # integers are compared as C-style integers of the same width, so they are equal iff their bits are equal
+        num_bytes = self.base_type.num_bytes
+        value = expected.value & ((1 << (8 * num_bytes)) - 1)
+        if self.endianness == Endianness.LITTLE or (self.endianness == Endianness.NATIVE and sys.byteorder == "little"):
+            return value.to_bytes(num_bytes, "little")
+        return value.to_bytes(num_bytes, "big")
+
     def match(self, data: bytes, expected: NumericValue) -> DataTypeMatch:
         if len(data) < self.base_type.num_bytes:
             return DataTypeMatch.INVALID
@@ -2028,13 +2409,8 @@ class NumericDataType(DataType[NumericValue]):
                 be_data = bytes([data[1], data[0], data[3], data[2]])
                 value = struct.unpack(">i", be_data)[0]
         else:
-            if self.unsigned and self.base_type not in (BaseNumericDataType.DOUBLE, BaseNumericDataType.FLOAT):
-                struct_fmt = self.base_type.struct_fmt.upper()
-            else:
-                struct_fmt = self.base_type.struct_fmt
-            struct_fmt = f"{self.endianness.value}{struct_fmt}"
             try:
-                value = struct.unpack(struct_fmt, data[:self.base_type.num_bytes])[0]
+                value = struct.unpack_from(self.struct_fmt, data)[0]
             except struct.error:
                 return DataTypeMatch.INVALID
         if expected.test(value, self.unsigned, self.base_type.num_bytes, self.preprocess):
@@ -2064,24 +2440,23 @@ class NumericDataType(DataType[NumericValue]):
             fmt = fmt[2:]
         else:
             endianness = Endianness.NATIVE
-        for symbol, operator in (
-                ("&", lambda a, b: a & b),
-                ("%", lambda a, b: a % b),
-                ("+", lambda a, b: a + b),
-                ("-", lambda a, b: a - b),
-                ("^", lambda a, b: a ^ b),
-                ("/", lambda a, b: [a // b, a / b][isinstance(a, float)]),
-                ("*", lambda a, b: a * b),
-                ("|", lambda a, b: a | b)
+        preprocess: Callable[[int], int] = identity
+        for symbol, op in (
+                ("&", operator.and_),
+                ("%", operator.mod),
+                ("+", operator.add),
+                ("-", operator.sub),
+                ("^", operator.xor),
+                ("/", divide),
+                ("*", operator.mul),
+                ("|", operator.or_)
         ):
             pos = fmt.find(symbol)
             if pos > 0:
                 operand = parse_numeric(fmt[pos+1:])
-                preprocess = lambda n: operator(n, operand)
+                preprocess = OperandFunction(op, operand)
                 fmt = fmt[:pos]
                 break
-        else:
-            preprocess = lambda n: n
         if fmt not in BASE_NUMERIC_TYPES_BY_NAME:
             raise ValueError(f"Invalid numeric data type: {name!r}")
         return NumericDataType(
@@ -2107,6 +2482,7 @@ class ConstantMatchTest(MagicTest, Generic[T]):
         super().__init__(offset=offset, mime=mime, extensions=extensions, message=message, parent=parent)
         self.data_type: DataType[T] = data_type
         self.constant: T = constant
+        self.window: Optional[int] = data_type.window(constant)
 
     def subtest_type(self) -> TestType:
         if self.data_type.is_text(self.constant):
@@ -2117,11 +2493,32 @@ class ConstantMatchTest(MagicTest, Generic[T]):
     def calculate_absolute_offset(self, data: bytes, parent_match: Optional[TestResult] = None) -> int:
         return self.offset.to_absolute(data, parent_match, self.data_type.allows_invalid_offsets(self.constant))
 
+    def magic_prefix(self) -> Optional[Tuple[int, bytes]]:
+        if type(self.offset) is not AbsoluteOffset or self.data_type.allows_invalid_offsets(self.constant):
+            return None
+        prefix = self.data_type.prefix(self.constant)
+        if not prefix:
+            return None
+        return self.offset.offset, prefix
+
     def test(self, data: bytes, absolute_offset: int, parent_match: Optional[TestResult]) -> TestResult:
-        match = self.data_type.match(data[absolute_offset:], self.constant)
+        if self.window is None and isinstance(data, WindowedData):
+            # an unbounded test only scans the identification window
+            match = DataTypeMatch.INVALID
+            for segment_offset, segment in window_segments(data, absolute_offset):
+                match = self.data_type.match(segment, self.constant)
+                if match:
+                    match.initial_offset += segment_offset - absolute_offset
+                    break
+        elif self.window is None:
+            match = self.data_type.match(data[absolute_offset:], self.constant)
+        else:
+            match = self.data_type.match(data[absolute_offset:absolute_offset + self.window], self.constant)
         if match:
             return MatchedTest(self, offset=absolute_offset + match.initial_offset, length=len(match.raw_match),
                                value=match.value, parent=parent_match)
+        elif not MagicTest.explain_failures:
+            return MISMATCH
         else:
             return FailedTest(
                 self,
@@ -2150,6 +2547,8 @@ class OffsetMatchTest(MagicTest):
     def test(self, data: bytes, absolute_offset: int, parent_match: Optional[TestResult]) -> TestResult:
         if self.value.test(absolute_offset, unsigned=True, num_bytes=8):
             return MatchedTest(self, offset=0, length=absolute_offset, value=absolute_offset, parent=parent_match)
+        elif not MagicTest.explain_failures:
+            return MISMATCH
         else:
             return FailedTest(
                 test=self,
@@ -2208,6 +2607,12 @@ class IndirectTest(MagicTest):
         return IndirectResult(self, absolute_offset, parent_match)
 
 
+class NamedTestOffset(Offset):
+    def to_absolute(self, data: bytes, last_match: Optional[TestResult], allow_invalid: bool = False) -> int:
+        assert last_match is not None
+        return last_match.offset
+
+
 class NamedTest(MagicTest):
     def __init__(
             self,
@@ -2221,11 +2626,6 @@ class NamedTest(MagicTest):
             # by default, named tests should not add a space if they don't contain an explicit message
             message = "\b"
         assert isinstance(offset, AbsoluteOffset) and offset.offset == 0
-
-        class NamedTestOffset(Offset):
-            def to_absolute(self, data: bytes, last_match: Optional[TestResult], allow_invalid: bool = False) -> int:
-                assert last_match is not None
-                return last_match.offset
         offset = NamedTestOffset()
         super().__init__(offset=offset, mime=mime, extensions=extensions, message=message, parent=None)
         self.name: str = name
@@ -2246,6 +2646,12 @@ class NamedTest(MagicTest):
         return self.name
 
 
+class LateBindingNamedTest(NamedTest):
+    """A placeholder for a named test that is used before it is defined; it is resolved after parsing completes"""
+    def __init__(self, name: str):
+        super().__init__(name, offset=AbsoluteOffset(0))
+
+
 class UseTest(MagicTest):
     def __init__(
             self,
@@ -2305,9 +2711,51 @@ class UseTest(MagicTest):
 
 
 class JSONTest(MagicTest):
+    # JSON values can only start with one of these, or otherwise with a byte order mark or a UTF-16/32 null byte
+    JSON_VALUE_START: bytes = b"{[\"-0123456789tfn\x00\xef\xfe\xff"
+    # the prefixes of the JSON tokens that can be cut off without the document being invalid
+    PARTIAL_TOKEN: Pattern[str] = re.compile(r"[-+.0-9eE]*|t(r(ue?)?)?|f(a(l(se?)?)?)?|n(u(ll?)?)?")
+
+    @staticmethod
+    def cut_off(document: str, error: json.JSONDecodeError) -> bool:
+        """Returns whether `document` only failed to parse because it ended prematurely"""
+        if not document[:error.pos].strip() or error.msg == "Extra data":
+            return False
+        elif error.msg.startswith("Unterminated string"):
+            return True
+        elif error.msg.startswith("Invalid \\uXXXX escape"):
+            return error.pos + 5 > len(document)
+        return JSONTest.PARTIAL_TOKEN.fullmatch(document, error.pos) is not None
+
     def test(self, data: bytes, absolute_offset: int, parent_match: Optional[TestResult]) -> Optional[TestResult]:
+        # make sure the data could plausibly be JSON before copying all of it to be parsed
+        head_end = absolute_offset + 1024
+        if isinstance(data, WindowedData):
+            head_end = min(head_end, len(data.head))
+        head = data[absolute_offset:head_end].lstrip()
+        if head and head[0] not in JSONTest.JSON_VALUE_START:
+            return FailedTest(
+                test=self,
+                offset=absolute_offset,
+                parent=parent_match,
+                message="the data do not start with a JSON value"
+            )
+        segment, cut_off = window_head(data, absolute_offset)
         try:
-            parsed = json.loads(data[absolute_offset:])
+            if cut_off:
+                # like libmagic with `bytes_max`, only the identification window is parsed, so a JSON value that is
+                # cut off by the end of the window is accepted
+                document = codecs.getincrementaldecoder(json.detect_encoding(segment))("surrogatepass").decode(
+                    segment, final=False
+                )
+                try:
+                    parsed = json.loads(document)
+                except json.JSONDecodeError as e:
+                    if not JSONTest.cut_off(document, e):
+                        raise
+                    parsed = None
+            else:
+                parsed = json.loads(segment)
             return MatchedTest(self, offset=absolute_offset, length=len(data) - absolute_offset, value=parsed,
                                parent=parent_match)
         except (json.JSONDecodeError, UnicodeDecodeError) as e:
@@ -2324,10 +2772,20 @@ class JSONTest(MagicTest):
 
 class CSVTest(MagicTest):
     def test(self, data: bytes, absolute_offset: int, parent_match: Optional[TestResult]) -> TestResult:
+        head_end = absolute_offset + 65536
+        if isinstance(data, WindowedData):
+            head_end = min(head_end, len(data.head))
         try:
-            text = data[absolute_offset:].decode("utf-8")
+            # make sure the start of the data could be text before decoding all of it
+            codecs.getincrementaldecoder("utf-8")().decode(data[absolute_offset:head_end], final=False)
+            segment, cut_off = window_head(data, absolute_offset)
+            text = codecs.getincrementaldecoder("utf-8")().decode(segment, final=not cut_off)
         except UnicodeDecodeError as e:
             return FailedTest(test=self, offset=absolute_offset, parent=parent_match, message=str(e))
+        if cut_off and "\n" in text:
+            # like libmagic with `bytes_max`, only the identification window is parsed, so ignore the last row if it
+            # was cut off by the end of the window
+            text = text[:text.rindex("\n") + 1]
         for dialect in csv.list_dialects():
             string_data = StringIO(text, newline="")
             reader = csv.reader(string_data, dialect=dialect)
@@ -2368,6 +2826,8 @@ class DefaultTest(MagicTest):
     def test(self, data: bytes, absolute_offset: int, parent_match: Optional[TestResult]) -> TestResult:
         if parent_match is None or not parent_match.child_matched:
             return MatchedTest(self, offset=absolute_offset, length=0, value=True, parent=parent_match)
+        elif not MagicTest.explain_failures:
+            return MISMATCH
         else:
             return FailedTest(self, offset=absolute_offset, parent=parent_match, message="the parent test already "
                                                                                          "has a child that matched")
@@ -2416,20 +2876,29 @@ class PlainTextTest(MagicTest):
     def test(self, data: bytes, absolute_offset: int, parent_match: Optional[TestResult]) -> TestResult:
         if not isinstance(self.message, ConstantMessage) or self.message.message:
             raise ValueError(f"A new PlainTextTest must be constructed for each call to .test")
+        # chardet is slow to import, so only do so once a plain text test is actually run
+        from chardet.universaldetector import UniversalDetector
+
         detector = UniversalDetector()
         offset = absolute_offset
-        while not detector.done and offset < min(len(data), 5000000):
+        limit = min(len(data), 5000000)
+        if isinstance(data, WindowedData):
+            # only scan the identification window
+            limit = min(limit, len(data.head))
+        while not detector.done and offset < limit:
             # feed 1kB at a time until we have high confidence in the classification
             # up to a maximum of 5MiB
-            detector.feed(data[offset:offset+1024])
+            detector.feed(data[offset:min(offset + 1024, limit)])
             offset += 1024
         detector.close()
         if detector.result["confidence"] >= self.minimum_encoding_confidence:
             encoding = detector.result["encoding"]
+            # if the data are windowed, the value is only the text within the window
+            segment, _ = window_head(data, absolute_offset)
             try:
-                value = data[absolute_offset:].decode(encoding)
+                value = segment.decode(encoding)
             except UnicodeDecodeError:
-                value = data[absolute_offset:]
+                value = segment
             self.message = ConstantMessage(f"{encoding} text")
             return MatchedTest(self, offset=absolute_offset, length=len(data) - absolute_offset, parent=parent_match,
                                value=value)
@@ -2489,6 +2958,9 @@ def _split_with_escapes(text: str) -> Tuple[str, str]:
     return text[:first_length], text[first_length + delimiter_length:]
 
 
+C_LENGTH_MODIFIER_PATTERN: Pattern[str] = re.compile(r"(?<!%)%([-#0 +]*\d*(?:\.\d+)?)(?:hh|h|ll|l|j|z|t|q)([diouxXc])")
+
+
 class Match:
     def __init__(
             self, matcher: "MagicMatcher", context: MatchContext, results: Iterable[TestResult]
@@ -2579,7 +3051,8 @@ class Match:
                 # sometimes we parsed a negative value and want to print it as an unsigned int:
                 result_str = result_str % (result.value + 2**(8 * result.length),)
             elif "%" in result_str.replace("%%", ""):
-                result_str = result_str.replace("%lld", "%d")
+                # Python does not support C's length modifiers, like in `%lld` or `%lx`:
+                result_str = C_LENGTH_MODIFIER_PATTERN.sub(r"%\1\2", result_str)
                 result_str = result_str % (result.value,)
             result_str = result_str.replace("%%", "%")
             msg = f"{msg}{result_str}"
@@ -2588,14 +3061,239 @@ class Match:
     __str__ = message
 
 
+class DispatchIndex:
+    """
+    An index of level-zero tests that allows a matcher to only evaluate the tests that could possibly match some data.
+
+    Tests that have a :meth:`MagicTest.dispatch_key` (e.g., a string or integer constant at an absolute offset) are
+    bucketed by the byte they expect at that offset. All other tests (e.g., indirect, relative, search, regex, or
+    custom tests) are always candidates. Candidates are returned in the order in which they were added.
+
+    """
+    def __init__(self):
+        self._order: Dict[MagicTest, int] = {}
+        self._unindexed: List[MagicTest] = []
+        self._by_offset: Dict[int, Dict[int, List[MagicTest]]] = {}
+
+    def add(self, test: MagicTest):
+        if test in self._order:
+            return
+        self._order[test] = len(self._order)
+        key = test.dispatch_key()
+        if key is None:
+            self._unindexed.append(test)
+        else:
+            offset, value = key
+            self._by_offset.setdefault(offset, {}).setdefault(value, []).append(test)
+
+    def discard(self, test: MagicTest):
+        if test not in self._order:
+            return
+        del self._order[test]
+        key = test.dispatch_key()
+        if key is None:
+            self._unindexed.remove(test)
+        else:
+            offset, value = key
+            self._by_offset[offset][value].remove(test)
+
+    def candidates(self, data: bytes) -> List[MagicTest]:
+        """Returns the tests that could match the given data"""
+        tests = list(self._unindexed)
+        data_length = len(data)
+        for offset, tests_by_value in self._by_offset.items():
+            if offset < data_length:
+                bucket = tests_by_value.get(data[offset])
+                if bucket:
+                    tests.extend(bucket)
+        tests.sort(key=self._order.__getitem__)
+        return tests
+
+    def __len__(self):
+        return len(self._order)
+
+
+class CarvingIndex:
+    """
+    Finds the offsets in some data at which an embedded file might start.
+
+    The constant magic prefixes of the level-zero tests (see :meth:`MagicTest.magic_prefix`) are compiled into an
+    Aho-Corasick automaton, so that the data only need to be scanned once. A hit for a prefix that a test expects at
+    offset `o` means that an embedded file matching that test might start `o` bytes before the hit.
+
+    Prefixes with fewer than `min_significant_bytes` bytes other than 0x00 and 0xFF are ignored, since they would be
+    found nearly everywhere (e.g., the many tests that expect an integer field to be zero).
+
+    """
+    def __init__(self, tests: Iterable[MagicTest], min_significant_bytes: int = 3):
+        self.min_significant_bytes: int = min_significant_bytes
+        self.tests_by_prefix: Dict[bytes, List[Tuple[int, MagicTest]]] = {}
+        self._order: Dict[MagicTest, int] = {}
+        for test in tests:
+            self._order[test] = len(self._order)
+            prefix = test.magic_prefix()
+            if prefix is None or len(prefix[1]) - prefix[1].count(0) - prefix[1].count(0xFF) < min_significant_bytes:
+                continue
+            offset, magic = prefix
+            self.tests_by_prefix.setdefault(magic, []).append((offset, test))
+        self.search: MultiSequenceSearch = MultiSequenceSearch(*self.tests_by_prefix.keys())
+
+    def candidates(self, data: bytes) -> Iterator[Tuple[int, List[MagicTest]]]:
+        """Yields (offset, tests) pairs, in increasing order of offset, for the tests that might match at each offset"""
+        tests_by_offset: Dict[int, Set[MagicTest]] = defaultdict(set)
+        for hit_offset, magic in self.search.search(data):
+            for test_offset, test in self.tests_by_prefix[magic]:
+                if hit_offset >= test_offset:
+                    tests_by_offset[hit_offset - test_offset].add(test)
+        for offset in sorted(tests_by_offset.keys()):
+            yield offset, sorted(tests_by_offset[offset], key=self._order.__getitem__)
+
+    def __len__(self):
+        return len(self.tests_by_prefix)
+
+
+MAGIC_SNAPSHOT_FORMAT: int = 4
+"""Increment this whenever a change to this module would make previously saved snapshots incompatible"""
+
+
+class MagicSnapshot:
+    """
+    A precompiled, on-disk snapshot of a parsed :class:`MagicMatcher`.
+
+    Parsing all of the magic definitions is expensive, so the parsed matcher (including its tests, named tests, and
+    MIME/extension indexes) is pickled to the user cache directory (see :func:`fileutils.user_cache_dir`) the first
+    time it is built. The snapshot's filename includes a fingerprint of the definition files, this module, the Python
+    version, and the PolyFile version, so a stale snapshot is never loaded.
+
+    Snapshots can be disabled by setting the `POLYFILE_NO_MAGIC_SNAPSHOT` environment variable.
+
+    """
+    def __init__(self, def_files: Iterable[Path], cache_dir: Optional[Path] = None):
+        self.def_files: Tuple[Path, ...] = tuple(def_files)
+        if cache_dir is None:
+            cache_dir = user_cache_dir()
+        self.cache_dir: Path = cache_dir
+        self._fingerprint: Optional[str] = None
+
+    @staticmethod
+    def enabled() -> bool:
+        return not os.environ.get("POLYFILE_NO_MAGIC_SNAPSHOT", "")
+
+    @property
+    def fingerprint(self) -> str:
+        if self._fingerprint is None:
+            try:
+                from importlib.metadata import version
+                polyfile_version = version("polyfile")
+            except Exception:
+                polyfile_version = "unknown"
+            h = hashlib.sha256()
+            h.update(f"{MAGIC_SNAPSHOT_FORMAT}:{polyfile_version}:{sys.version_info[0]}.{sys.version_info[1]}\n"
+                     .encode("utf-8"))
+            for path in (Path(__file__),) + self.def_files:
+                stat = os.stat(path)
+                h.update(f"{path.name}:{stat.st_size}:{stat.st_mtime_ns}\n".encode("utf-8"))
+            self._fingerprint = h.hexdigest()[:32]
+        return self._fingerprint
+
+    @property
+    def path(self) -> Path:
+        return self.cache_dir / f"magic-{self.fingerprint}.pickle"
+
+    def load(self) -> Optional["MagicMatcher"]:
+        """Returns the snapshotted matcher, or None if there is no valid snapshot"""
+        try:
+            with open(self.path, "rb") as f:
+                # the test graph contains many millions of references, and the cyclic garbage collector would
+                # otherwise be triggered repeatedly while it is being reconstructed, tripling the load time
+                gc_was_enabled = gc.isenabled()
+                gc.disable()
+                try:
+                    matcher = pickle.load(f)
+                finally:
+                    if gc_was_enabled:
+                        gc.enable()
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            log.debug(f"Ignoring invalid magic snapshot {self.path!s}: {e!s}")
+            return None
+        if not isinstance(matcher, MagicMatcher):
+            log.debug(f"Ignoring invalid magic snapshot {self.path!s}: unexpected type {type(matcher)!r}")
+            return None
+        return matcher
+
+    def save(self, matcher: "MagicMatcher") -> bool:
+        """Saves a snapshot of the matcher, replacing any stale snapshots; returns whether the save was successful"""
+        # make sure the indexes are computed so they are included in the snapshot
+        matcher._reassign_test_types()
+        try:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            with NamedTemporaryFile(dir=self.cache_dir, prefix=".magic-", suffix=".tmp", delete=False) as tmp:
+                try:
+                    pickle.dump(matcher, tmp, protocol=pickle.HIGHEST_PROTOCOL)
+                except BaseException:
+                    tmp.close()
+                    os.unlink(tmp.name)
+                    raise
+            # the rename is atomic, so concurrent processes will never see a partially written snapshot
+            os.replace(tmp.name, self.path)
+        except (OSError, pickle.PicklingError, RecursionError) as e:
+            log.debug(f"Unable to save magic snapshot to {self.cache_dir!s}: {e!s}")
+            return False
+        for stale in self.cache_dir.glob("magic-*.pickle"):
+            if stale != self.path:
+                try:
+                    stale.unlink()
+                except OSError:
+                    pass
+        return True
+
+
 class DefaultMagicMatcher:
     _DEFAULT_INSTANCE: Optional["MagicMatcher"] = None
+    _MODULES: List[str] = []
+    _IMPORTED_MODULES: Set[str] = set()
+
+    @staticmethod
+    def register_module(module: str):
+        """
+        Registers a module that adds custom tests to the default instance (and usually parsers for them) on import.
+
+        The module is only imported once the default instance is first loaded, so that importing PolyFile does not
+        require importing every such module (and their dependencies).
+
+        """
+        if module not in DefaultMagicMatcher._MODULES:
+            DefaultMagicMatcher._MODULES.append(module)
+        if DefaultMagicMatcher._DEFAULT_INSTANCE is not None:
+            DefaultMagicMatcher.import_modules()
+
+    @staticmethod
+    def import_modules():
+        """Imports all of the registered modules that have not yet been imported"""
+        for module in DefaultMagicMatcher._MODULES:
+            if module not in DefaultMagicMatcher._IMPORTED_MODULES:
+                DefaultMagicMatcher._IMPORTED_MODULES.add(module)
+                importlib.import_module(module)
 
     def __get__(self, instance, owner) -> "MagicMatcher":
         if DefaultMagicMatcher._DEFAULT_INSTANCE is None:
             # DefaultMagicMatcher._DEFAULT_INSTANCE = MagicMatcher.parse(*MAGIC_DEFS)
-            # FIXME: skip the DER definition for now because we don't yet support it
-            DefaultMagicMatcher._DEFAULT_INSTANCE = MagicMatcher.parse(*(d for d in MAGIC_DEFS if d.name != "der"))
+            def_files = DEFAULT_MAGIC_DEFS
+            matcher: Optional[MagicMatcher] = None
+            if MagicSnapshot.enabled():
+                snapshot = MagicSnapshot(def_files)
+                matcher = snapshot.load()
+                if matcher is None:
+                    matcher = MagicMatcher.parse(*def_files)
+                    snapshot.save(matcher)
+            else:
+                matcher = MagicMatcher.parse(*def_files)
+            # Custom matchers registered at import time (e.g., by `polyfile.zipmatcher`) are added on top of this
+            # instance via `MagicMatcher.add`, which incrementally updates the snapshotted indexes.
+            DefaultMagicMatcher._DEFAULT_INSTANCE = matcher
+            DefaultMagicMatcher.import_modules()
         return DefaultMagicMatcher._DEFAULT_INSTANCE
 
     def __set__(self, instance, value: Optional["MagicMatcher"]):
@@ -2616,6 +3314,9 @@ class MagicMatcher:
         self._tests_that_can_be_indirect: Set[MagicTest] = set()
         self._non_text_tests: Set[MagicTest] = set()
         self._text_tests: Set[MagicTest] = set()
+        self._non_text_index: DispatchIndex = DispatchIndex()
+        self._text_index: DispatchIndex = DispatchIndex()
+        self._carving_index: Optional[CarvingIndex] = None
         self._dirty: bool = True
         for test in tests:
             self.add(test)
@@ -2645,7 +3346,15 @@ class MagicMatcher:
         self._reassign_test_types()
         return self._text_tests
 
-    def add(self, test: Union[MagicTest, Path], test_type: TestType = TestType.UNKNOWN) -> List[MagicTest]:
+    def add(
+            self, test: Union[MagicTest, Path, MagicDefinition], test_type: TestType = TestType.UNKNOWN
+    ) -> List[MagicTest]:
+        """
+        Adds a test, or all of the tests in a definition file (or in-memory :class:`MagicDefinition`).
+
+        Returns the level zero tests that were added.
+
+        """
         if not isinstance(test, MagicTest):
             level_zero_tests, _, tests_with_mime, indirect_tests = self._parse_file(test, self)
             for test in tests_with_mime:
@@ -2664,37 +3373,56 @@ class MagicMatcher:
         if test_type != TestType.UNKNOWN:
             test.test_type = test_type
 
-        self._dirty = True
-
         if isinstance(test, NamedTest):
             if test.name in self.named_tests:
                 raise ValueError(f"A test named {test.name} already exists in this matcher!")
             self.named_tests[test.name] = test
         else:
             self._tests.append(test)
+            if not self._dirty:
+                # The indexes are up to date (e.g., because this matcher was loaded from a snapshot), so update them
+                # incrementally rather than recomputing them from scratch. The new test might be a descendant of an
+                # existing test, in which case that test can now match additional MIME types and extensions.
+                self._index_test(test)
+                for ancestor in test.ancestors():
+                    if ancestor.parent is None and not isinstance(ancestor, NamedTest) and ancestor in self._tests:
+                        self._index_test(ancestor)
 
         return [test]
 
+    def _index_test(self, test: MagicTest):
+        self._carving_index = None
+        if test.test_type == TestType.TEXT:
+            self._non_text_tests.discard(test)
+            self._non_text_index.discard(test)
+            self._text_tests.add(test)
+            self._text_index.add(test)
+        else:
+            self._text_tests.discard(test)
+            self._text_index.discard(test)
+            self._non_text_tests.add(test)
+            self._non_text_index.add(test)
+        if test.can_be_indirect:
+            self._tests_that_can_be_indirect.add(test)
+        for mime in test.mimetypes():
+            self._tests_by_mime[mime].add(test)
+        for ext in test.all_extensions():
+            self._tests_by_ext[ext].add(test)
+
     def _reassign_test_types(self):
         if not self._dirty:
             return
         self._dirty = False
         self._text_tests = set()
         self._non_text_tests = set()
+        self._text_index = DispatchIndex()
+        self._non_text_index = DispatchIndex()
+        self._carving_index = None
         self._tests_that_can_be_indirect = set()
         self._tests_by_ext = defaultdict(set)
         self._tests_by_mime = defaultdict(set)
         for test in self._tests:
-            if test.test_type == TestType.TEXT:
-                self._text_tests.add(test)
-            else:
-                self._non_text_tests.add(test)
-            if test.can_be_indirect:
-                self._tests_that_can_be_indirect.add(test)
-            for mime in test.mimetypes():
-                self._tests_by_mime[mime].add(test)
-            for ext in test.all_extensions():
-                self._tests_by_ext[ext].add(test)
+            self._index_test(test)
 
     def only_match(
             self,
@@ -2745,7 +3473,10 @@ class MagicMatcher:
         elif not isinstance(to_match, MatchContext):
             to_match = MatchContext.load(to_match)
         yielded = False
-        for test in log.range(self.non_text_tests, desc="binary matching", unit=" tests", delay=1.0):
+        self._reassign_test_types()
+        # only evaluate the tests that could possibly match the data:
+        binary_tests = self._non_text_index.candidates(to_match.data)
+        for test in log.range(binary_tests, desc="binary matching", unit=" tests", delay=1.0):
             m = Match(matcher=self, context=to_match, results=test.match(to_match))
             if m and (not to_match.only_match_mime or any(t is not None for t in m.mimetypes)):
                 yield m
@@ -2755,7 +3486,8 @@ class MagicMatcher:
         is_text = text_matcher and (not to_match.only_match_mime or any(t is not None for t in text_matcher.mimetypes))
         if is_text:
             # this is a text file, so try all of the textual tests:
-            for test in log.range(self.text_tests, desc="text matching", unit=" tests", delay=1.0):
+            text_tests = self._text_index.candidates(to_match.data)
+            for test in log.range(text_tests, desc="text matching", unit=" tests", delay=1.0):
                 m = Match(matcher=self, context=to_match, results=test.match(to_match))
                 if m and (not to_match.only_match_mime or any(t is not None for t in m.mimetypes)):
                     yield m
@@ -2766,6 +3498,45 @@ class MagicMatcher:
             else:
                 yield Match(matcher=self, context=to_match, results=OctetStreamTest().match(to_match))
 
+    @property
+    def carving_index(self) -> CarvingIndex:
+        self._reassign_test_types()
+        if self._carving_index is None:
+            self._carving_index = CarvingIndex(self._tests)
+        return self._carving_index
+
+    def carve(self, to_match: Union[bytes, BinaryIO, str, Path, MatchContext]) -> Iterator[Tuple[int, Match]]:
+        """
+        Yields (offset, match) pairs for files that are embedded in the data at nonzero offsets.
+
+        Rather than trying every test at every offset, the data are scanned once for the constant magic prefixes of the
+        level-zero tests (see :class:`CarvingIndex`), and only the tests whose prefix was found are run, and only at
+        the offsets implied by the hit. The offsets of the results in each match are relative to the yielded offset.
+
+        """
+        if isinstance(to_match, bytes):
+            to_match = MatchContext(to_match)
+        elif not isinstance(to_match, MatchContext):
+            to_match = MatchContext.load(to_match)
+        for offset, tests in self.carving_index.candidates(to_match.data):
+            if offset == 0:
+                # files at offset zero are found by `self.match`
+                continue
+            log.status(f"carving at offset {offset}")
+            context = to_match[offset:]
+            for test in tests:
+                m = Match(matcher=self, context=context, results=test.match(context))
+                try:
+                    # evaluate all of the results now, so that a test that is unsupported for the data at this offset
+                    # cannot abort the entire carve
+                    len(m)
+                except NotImplementedError as e:
+                    log.warning(f"Skipping {test.source_info!s} while carving at offset {offset}: {e!s}")
+                    continue
+                if m and (not context.only_match_mime or any(t is not None for t in m.mimetypes)):
+                    yield offset, m
+        log.clear_status()
+
     @staticmethod
     def parse_test(
             line: str,
@@ -2829,12 +3600,7 @@ class MagicMatcher:
                     flip_endianness = False
                 if test_str not in matcher.named_tests:
                     late_binding = True
-
-                    class LateBindingNamedTest(NamedTest):
-                        def __init__(self):
-                            super().__init__(test_str, offset=AbsoluteOffset(0))
-
-                    named_test: NamedTest = LateBindingNamedTest()
+                    named_test: NamedTest = LateBindingNamedTest(test_str)
                 else:
                     late_binding = False
                     named_test = matcher.named_tests[test_str]
@@ -2876,7 +3642,7 @@ class MagicMatcher:
 
     @staticmethod
     def _parse_file(
-            def_file: Union[str, Path], matcher: "MagicMatcher"
+            def_file: Union[str, Path, MagicDefinition], matcher: "MagicMatcher"
     ) -> Tuple[Iterable[MagicTest], Iterable[UseTest], Set[MagicTest], Set[IndirectTest]]:
         current_test: Optional[MagicTest] = None
         late_bindings: List[UseTest] = []
@@ -2884,7 +3650,12 @@ class MagicMatcher:
         tests_with_mime: Set[MagicTest] = set()
         indirect_tests: Set[IndirectTest] = set()
         comments: List[Comment] = []
-        with open(def_file, "rb") as f:
+        if isinstance(def_file, MagicDefinition):
+            definitions: ContextManager[Union[IO[bytes], MagicDefinition]] = nullcontext(def_file)
+            def_file = def_file.path
+        else:
+            definitions = open(def_file, "rb")
+        with definitions as f:
             for line_number, raw_line in enumerate(f.readlines()):
                 line_number += 1
                 raw_line = raw_line.lstrip()
@@ -2945,7 +3716,7 @@ class MagicMatcher:
         return level_zero_tests, late_bindings, tests_with_mime, indirect_tests
 
     @staticmethod
-    def parse(*def_files: Union[str, Path]) -> "MagicMatcher":
+    def parse(*def_files: Union[str, Path, MagicDefinition]) -> "MagicMatcher":
         late_bindings: Dict[str, List[UseTest]] = {}
         zero_level_tests: List[MagicTest] = []
         tests_with_mime: Set[MagicTest] = set()
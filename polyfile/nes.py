@@ -3,7 +3,7 @@ from io import BytesIO
 
 from PIL import Image, ImageDraw
 
-from .polyfile import register_parser, InvalidMatch, Submatch
+from .polyfile import InvalidMatch, Submatch
 
 
 def parse_ines_header(header, parent=None):
@@ -75,7 +75,6 @@ def parse_ines_header(header, parent=None):
     )
 
 
-@register_parser("application/x-nes-rom")
 def parse_ines(file_stream, parent):
     header = file_stream.read(16)
     yield from parse_ines_header(header, parent)
@@ -21,13 +21,13 @@ from pdfminer.pdftypes import (
 )
 
 from .fileutils import FileStream
-from .fileutils import Tempfile
 from .logger import getStatusLogger
-from .magic import AbsoluteOffset, FailedTest, MagicMatcher, MagicTest, MatchedTest, TestResult, TestType
-from .polyfile import Match, Matcher, Submatch, register_parser
+from .polyfile import BudgetExceeded, Match, Matcher, Submatch
 
 log = getStatusLogger("PDF")
 
+INFLATE_CHUNK_SIZE: int = 1024 * 1024
+
 
 def load_trailer(self, parser: "PDFParser") -> None:
     try:
@@ -547,8 +547,41 @@ class PNGPredictor(PSBytes):
         return ret
 
 
+class DecodingLimitExceeded(BudgetExceeded):
+    """Raised when decoding a stream would exceed the decoded size limit of the parser's :class:`ParseBudget`"""
+    pass
+
+
+def inflate(
+        data: bytes, max_length: Optional[int] = None, check_deadline: Optional[Callable[[], None]] = None
+) -> bytes:
+    """
+    Equivalent to `zlib.decompress(data)`, but decompresses the data in chunks.
+
+    If `max_length` is given, decompression stops as soon as more than `max_length` bytes have been decompressed, so a
+    decompression bomb is never fully inflated (the result is then truncated, but still longer than `max_length`).
+    `check_deadline` is called after each chunk, so it can stop a long decompression by raising an exception.
+
+    """
+    decompressor = zlib.decompressobj()
+    chunks: List[bytes] = []
+    length = 0
+    while not decompressor.eof:
+        chunk = decompressor.decompress(data, INFLATE_CHUNK_SIZE)
+        data = decompressor.unconsumed_tail
+        if not chunk and not data:
+            raise zlib.error("Error -5 while decompressing data: incomplete or truncated stream")
+        chunks.append(chunk)
+        length += len(chunk)
+        if max_length is not None and length > max_length:
+            break
+        if check_deadline is not None:
+            check_deadline()
+    return b"".join(chunks)
+
+
 class PDFObjectStream(PDFStream):
-    def __init__(self, parent: PDFStream, pdf_offset: int, pdf_bytes: int):
+    def __init__(self, parent: PDFStream, pdf_offset: int, pdf_bytes: int, budget_match: Optional[Match] = None):
         super().__init__(
             attrs=parent.attrs,
             rawdata=PSBytes(parent.rawdata, pdf_offset=pdf_offset, pdf_bytes=pdf_bytes),
@@ -557,6 +590,10 @@ class PDFObjectStream(PDFStream):
         self.parent: PDFStream = parent
         self.pdf_offset: int = pdf_offset
         self.pdf_bytes: int = pdf_bytes
+        # the match whose parser is decoding this stream, and against whose budget the decoding counts
+        self.budget_match: Optional[Match] = budget_match
+        # if set, the number of bytes that decoding may produce, regardless of when (or whether) its parser is running
+        self.decoding_limit: Optional[int] = None
         self.data = parent.data
         self.objid = parent.objid
         self.genno = parent.genno
@@ -595,12 +632,25 @@ class PDFObjectStream(PDFStream):
             self.data = data
             self.rawdata = None
             return
+        budget_match = self.budget_match
+        check_deadline: Optional[Callable[[], None]] = None
+        if budget_match is not None and budget_match.matcher.budget is not None:
+            def check_budget_deadline():
+                budget_match.matcher.check_deadline(budget_match)
+
+            check_deadline = check_budget_deadline
         for (f, params) in filters:
             decoded: Optional[bytes] = None
+            limit: Optional[int] = self.decoding_limit
+            if check_deadline is not None:
+                check_deadline()
+                remaining = budget_match.matcher.decoding_limit(budget_match)
+                if remaining is not None and (limit is None or remaining < limit):
+                    limit = remaining
             if f in LITERALS_FLATE_DECODE:
                 # will get errors if the document is encrypted.
                 try:
-                    decoded = zlib.decompress(data)
+                    decoded = inflate(data, max_length=limit, check_deadline=check_deadline)
                 except zlib.error as e:
                     decoded = DecodingError(str(e))
             elif f in LITERALS_LZW_DECODE:
@@ -626,6 +676,10 @@ class PDFObjectStream(PDFStream):
             else:
                 raise PDFNotImplementedError('Unsupported filter: %r' % f)
             if decoded is not None:
+                if limit is not None and len(decoded) > limit:
+                    raise DecodingLimitExceeded(
+                        f"exceeded the limit of {budget_match.matcher.budget.max_decoded_bytes} decoded bytes"
+                    )
                 if isinstance(f, PDFLiteral):
                     name = f.name
                 else:
@@ -668,6 +722,8 @@ class PDFObjectStream(PDFStream):
 
 class PDFParser(PDFMinerParser):
     auto_flush: bool = False
+    # the match whose parser is parsing this PDF; decoding the PDF's streams counts against that parser's budget
+    budget_match: Optional[Match] = None
 
     @staticmethod
     def string_escape(data: Union[bytes, int]) -> str:
@@ -720,7 +776,9 @@ class PDFParser(PDFMinerParser):
             elif len(obj) == 2 and isinstance(obj[1], PDFStream):
                 stream: PDFStream = obj[1]
                 pos = obj[0]
-                transformed.append((pos, PDFObjectStream(stream, pdf_offset=pos, pdf_bytes=len(stream.rawdata))))
+                transformed.append((pos, PDFObjectStream(
+                    stream, pdf_offset=pos, pdf_bytes=len(stream.rawdata), budget_match=self.budget_match
+                )))
             elif len(obj) == 2 and isinstance(obj[1], PSObject) and not isinstance(obj[1], PDFLiteral):
                 pos = obj[0]
                 psobj = obj[1]
@@ -893,8 +951,7 @@ def parse_object(obj, matcher: Matcher, parent: Optional[Match] = None, pdf_head
             parent=parent
         )
         yield deciphered
-        with Tempfile(obj) as f:
-            yield from matcher.match(f, parent=deciphered)
+        yield from matcher.match(obj, parent=deciphered)
     elif isinstance(obj, PSBytes):
         if isinstance(obj, PNGPredictor):
             match = Submatch(
@@ -920,8 +977,7 @@ def parse_object(obj, matcher: Matcher, parent: Optional[Match] = None, pdf_head
             yield from parse_object(obj.original_bytes, matcher=matcher, parent=match,
                                     pdf_header_offset=pdf_header_offset)
         # recursively match against the deflated contents
-        with Tempfile(obj) as f:
-            yield from matcher.match(f, parent=match)
+        yield from matcher.match(obj, parent=match)
     elif hasattr(obj, "pdf_offset") and hasattr(obj, "pdf_bytes"):
         yield Submatch(
             obj.__class__.__name__,
@@ -990,28 +1046,6 @@ class InstrumentedPDFDocument(PDFDocument):
         return deciphered
 
 
-# The default libmagic test for detecting PDFs is too restrictive:
-class RelaxedPDFMatcher(MagicTest):
-    def __init__(self):
-        super().__init__(
-            offset=AbsoluteOffset(0),
-            mime="application/pdf",
-            extensions=("pdf",),
-            message="Malformed PDF"
-        )
-
-    def subtest_type(self) -> TestType:
-        return TestType.BINARY
-
-    def test(self, data: bytes, absolute_offset: int, parent_match: Optional[TestResult]) -> TestResult:
-        if b"%PDF-" in data:
-            return MatchedTest(self, value=data, offset=0, length=len(data))
-        return FailedTest(self, offset=0, message="data did not contain \"%PDF-\"")
-
-
-MagicMatcher.DEFAULT_INSTANCE.add(RelaxedPDFMatcher())
-
-
 def reverse_skip_whitespace(file_stream) -> bool:
     found_whitespace = False
     while True:
@@ -1070,14 +1104,53 @@ def reverse_expect(file_stream, expected: Union[bytes, Callable[[int, bytes], bo
         file_stream.seek(start_pos - skipped_bytes)
 
 
-def pdf_obj_parser(file_stream, obj, objid: int, parent: Match, pdf_header_offset: int = 0) -> Iterator[Submatch]:
-    data: Optional[bytes] = None
-    if isinstance(obj, PDFObjectStream):
-        log.status(f"Parsing PDF obj {obj.objid!s} {obj.genno!s}")
+def lazily_decode(obj: PDFObjectStream, match: Submatch) -> Callable[[], Optional[bytes]]:
+    """
+    Returns a function that decodes the stream (the first time it is called) and returns its decoded data.
+
+    The parser that produced `match` has usually finished by the time the stream is decoded, so the number of bytes it
+    could still have decoded is captured now; if decoding would exceed that, `match` is marked as truncated instead.
+
+    """
+    obj.decoding_limit = match.matcher.decoding_limit(match.parent)
+
+    def decode() -> Optional[bytes]:
         try:
             data = obj.get_data()
         except PDFNotImplementedError as e:
             log.error(f"Unsupported PDF stream filter in object {obj.objid!s} {obj.genno!s}: {e!s}")
+            return None
+        except DecodingLimitExceeded as e:
+            match.truncated = str(e)
+            log.warning(f"Not decoding the stream in PDF object {obj.objid!s} {obj.genno!s} because it "
+                        f"{match.truncated}")
+            return None
+        except Exception as e:
+            log.error(f"Error decoding the stream in PDF object {obj.objid!s} {obj.genno!s}: {e!s}")
+            return None
+        if isinstance(data, PDFStreamFilter) and data.error is not None:
+            log.error(f"Error decoding the stream in PDF object {obj.objid!s} {obj.genno!s}: {data.error.message!s}")
+            return None
+        return bytes(data)
+
+    return decode
+
+
+def pdf_obj_parser(file_stream, obj, objid: int, parent: Match, pdf_header_offset: int = 0) -> Iterator[Submatch]:
+    data: Optional[bytes] = None
+    truncated: Optional[str] = None
+    lazy = parent.matcher.lazy_decoding
+    if isinstance(obj, PDFObjectStream):
+        log.status(f"Parsing PDF obj {obj.objid!s} {obj.genno!s}")
+        if not lazy:
+            try:
+                data = obj.get_data()
+            except PDFNotImplementedError as e:
+                log.error(f"Unsupported PDF stream filter in object {obj.objid!s} {obj.genno!s}: {e!s}")
+            except DecodingLimitExceeded as e:
+                truncated = str(e)
+                log.warning(f"Not decoding the stream in PDF object {obj.objid!s} {obj.genno!s} because it "
+                            f"{truncated}")
         relative_offset = obj.attrs.pdf_offset
         obj_length = obj.data_value.pdf_offset - obj.attrs.pdf_offset + obj.data_value.pdf_bytes - 1
     else:
@@ -1109,9 +1182,21 @@ def pdf_obj_parser(file_stream, obj, objid: int, parent: Match, pdf_header_offse
             length=obj_length,
             parent=parent
         )
+        match.truncated = truncated
         yield match
         yield from parse_object(obj.attrs, matcher=parent.matcher, parent=match, pdf_header_offset=pdf_header_offset)
-        if data is not None:
+        if lazy and obj.rawdata is not None:
+            # only the location of the encoded stream is recorded; it is decoded if and when its data are requested
+            stream_match = Submatch(
+                "PDFStream",
+                memoryview(obj.rawdata),
+                relative_offset=obj.rawdata.pdf_offset - (match.offset - pdf_header_offset),
+                length=obj.rawdata.pdf_bytes,
+                parent=match
+            )
+            stream_match.decoded = lazily_decode(obj, stream_match)
+            yield stream_match
+        elif data is not None:
             yield from parse_object(data, matcher=parent.matcher, parent=match, pdf_header_offset=pdf_header_offset)
     else:
         match = Submatch(
@@ -1127,7 +1212,6 @@ def pdf_obj_parser(file_stream, obj, objid: int, parent: Match, pdf_header_offse
     log.clear_status()
 
 
-@register_parser("application/pdf")
 def pdf_parser(file_stream, parent: Match):
     # pdfminer expects %PDF to be at byte offset zero in the file
     pdf_header_offset = file_stream.first_index_of(b"%PDF")
@@ -1150,12 +1234,17 @@ def pdf_parser(file_stream, parent: Match):
         with FileStream(file_stream, start=pdf_header_offset) as f:
             yield from pdf_parser(f, pdf_content)
         return
-    pdf_header_offset = file_stream.start
+    # the global offset of the start of `file_stream`, against which pdfminer's offsets are relative; this is not
+    # `file_stream.start`, which is only the same for a file that is not nested within another
+    pdf_header_offset = parent.offset
     parser = PDFParser(RawPDFStream(file_stream))
+    parser.budget_match = parent
     doc = InstrumentedPDFDocument(parser)
     yielded = set()
     for xref in doc.xrefs:
         for objid in xref.get_objids():
+            # an xref can list many objects that are not found (and so are not yielded)
+            parent.matcher.check_deadline(parent)
             try:
                 obj = doc.getobj(objid)
             except PDFObjectNotFound:
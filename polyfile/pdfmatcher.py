@@ -0,0 +1,40 @@
+"""
+The magic test for PDFs.
+
+This is kept separate from :mod:`polyfile.pdf` so that detecting a PDF does not require importing pdfminer, which is
+only needed to parse one.
+
+"""
+from typing import Optional
+
+from .fileutils import WindowedData
+from .magic import (
+    AbsoluteOffset, FailedTest, MagicMatcher, MagicTest, MatchedTest, TestResult, TestType, window_segments
+)
+
+
+# The default libmagic test for detecting PDFs is too restrictive:
+class RelaxedPDFMatcher(MagicTest):
+    def __init__(self):
+        super().__init__(
+            offset=AbsoluteOffset(0),
+            mime="application/pdf",
+            extensions=("pdf",),
+            message="Malformed PDF"
+        )
+
+    def subtest_type(self) -> TestType:
+        return TestType.BINARY
+
+    def test(self, data: bytes, absolute_offset: int, parent_match: Optional[TestResult]) -> TestResult:
+        if isinstance(data, WindowedData):
+            # only scan the identification window
+            found = any(segment.find(b"%PDF-") >= 0 for _, segment in window_segments(data, 0))
+        else:
+            found = data.find(b"%PDF-") >= 0
+        if found:
+            return MatchedTest(self, value=data, offset=0, length=len(data))
+        return FailedTest(self, offset=0, message="data did not contain \"%PDF-\"")
+
+
+MagicMatcher.DEFAULT_INSTANCE.add(RelaxedPDFMatcher())
@@ -1,8 +1,6 @@
+from io import BytesIO
 from typing import Optional
 
-from fickling.analysis import Analyzer, Severity
-from fickling.fickle import Pickled, PickleDecodeError
-
 from .magic import AbsoluteOffset, DynamicMagicTest, FailedTest, MagicMatcher, MatchedTest, TestResult, TestType
 
 
@@ -20,12 +18,16 @@ class PickleMatcher(DynamicMagicTest):
 
     def test(self, data: bytes, absolute_offset: int, parent_match: Optional[TestResult]) -> TestResult:
         prev = -1
-        for i, c in enumerate(data):
-            if i >= 128:
-                break
-            elif prev == 0x80 and c in (2, 3, 4):
+        # only slice out the header, since `data` might be a memory map
+        for c in data[:128]:
+            if prev == 0x80 and c in (2, 3, 4):
+                # fickling is slow to import, so only do so once something looks like a pickle
+                from fickling.analysis import Analyzer, Severity
+                from fickling.fickle import Pickled, PickleDecodeError
+
                 try:
-                    pickled = Pickled.load(data)
+                    # `data[:]` does not copy `bytes`, and reads windowed data in their entirety
+                    pickled = Pickled.load(BytesIO(data[:]))
                     results = Analyzer.default_instance.analyze(pickled)
                     if results.severity <= Severity.LIKELY_SAFE:
                         message = self.message
@@ -1,18 +1,29 @@
 from abc import ABC, abstractmethod
-from collections import defaultdict
+from collections import defaultdict, deque, OrderedDict
+from concurrent.futures import Executor, Future, ProcessPoolExecutor
+from functools import lru_cache
 import base64
 import hashlib
-from json import dumps
+import importlib
+import itertools
+from json import dump, dumps
+import mmap
 from mimetypes import guess_extension
 from pathlib import Path
 import sys
-from time import localtime
+from threading import Lock
+from time import localtime, perf_counter
 import traceback
-from typing import Any, Callable, Dict, IO, Iterable, Iterator, List, Optional, Set, Tuple, Union
+from typing import Any, Callable, Deque, Dict, FrozenSet, IO, Iterable, Iterator, List, Optional, Sequence, Set, TextIO, Tuple, Union
 
-from .fileutils import FileStream
+from .cache import ResultCache
+from .fileutils import FileStream, WindowedData
+from .iterators import LazyIterableSequence
 from . import logger
-from .magic import MagicMatcher, Match as MagicMatch, MatchContext, TestResult
+from .magic import (
+    DEFAULT_MAGIC_DEFS, DefaultMagicMatcher, IdentificationWindow, MagicMatcher, MagicSnapshot, Match as MagicMatch,
+    MatchContext, TestResult
+)
 
 if sys.version_info >= (3, 10):
     from importlib.metadata import version
@@ -37,6 +48,20 @@ class Parser(ABC, ParserFunction):
     def __call__(self, stream: FileStream, match: "Match") -> Iterator["Submatch"]:
         yield from self.parse(stream, match)
 
+    def load(self):
+        """Loads anything this parser would otherwise lazily load the first time it is used"""
+        pass
+
+    def validate(self, stream: FileStream) -> bool:
+        """
+        Returns whether `stream` is a valid instance of the parser's MIME type, without parsing it.
+
+        This is only overridden by parsers that can check their input much more cheaply than they can parse it; by
+        default, every input is assumed to be valid.
+
+        """
+        return True
+
     def __hash__(self):
         return id(self)
 
@@ -63,16 +88,174 @@ class ParserFunctionWrapper(Parser):
             return self.parser.__class__.__name__
 
 
+class LazyParser(Parser):
+    """A parser that is only imported from its module the first time it is used"""
+    def __init__(self, module: str, name: str):
+        self.module: str = module
+        self.name: str = name
+        self._parser: Optional[Parser] = None
+
+    @property
+    def parser(self) -> Parser:
+        if self._parser is None:
+            parser = getattr(importlib.import_module(self.module), self.name)
+            if not isinstance(parser, Parser):
+                parser = ParserFunctionWrapper(parser)
+            self._parser = parser
+        return self._parser
+
+    def load(self):
+        self.parser.load()
+
+    def validate(self, stream: FileStream) -> bool:
+        return self.parser.validate(stream)
+
+    def parse(self, stream: FileStream, match: "Match") -> Iterator["Submatch"]:
+        yield from self.parser(stream, match)
+
+    def __str__(self):
+        return self.name
+
+
 PARSERS: Dict[str, Set[Parser]] = defaultdict(set)
 
 log = logger.getStatusLogger("polyfile")
 
+HASH_CHUNK_SIZE: int = 1024 * 1024
+B64_CHUNK_SIZE: int = 3 * 256 * 1024
+
 
 class InvalidMatch(ValueError):
     pass
 
 
+class ParseBudget:
+    """
+    Limits on the work done by each parser invocation, so that a hostile input cannot stall an analysis indefinitely.
+
+    Each limit is optional:
+
+        `max_seconds`: the wall-clock time spent in a single parser invocation
+        `max_decoded_bytes`: the total size of the data decoded (e.g., decompressed) by a single parser invocation
+        `max_depth`: the number of files that may be nested within one another (e.g., an archive within an archive)
+        `max_submatches`: the number of submatches a single parser invocation may produce
+        `max_array_elements`: the number of elements of any one array in a parsed structure that are expanded into
+                              submatches (the rest are skipped, so a huge array is not expanded in its entirety)
+
+    The limits are enforced cooperatively, between the submatches a parser yields, so a parser that is exceeding its
+    budget is stopped cleanly: the submatches it has already produced are kept, its match is marked as truncated, and
+    the analysis continues with the rest of the file. Parsers that can spend a long time (or decode a lot of data)
+    without yielding anything should also check their budget themselves; see :meth:`Matcher.check_deadline` and
+    :meth:`Matcher.decoding_limit`. This object is sent to worker processes, so it must be picklable.
+
+    """
+    def __init__(
+            self,
+            max_seconds: Optional[float] = None,
+            max_decoded_bytes: Optional[int] = None,
+            max_depth: Optional[int] = None,
+            max_submatches: Optional[int] = None,
+            max_array_elements: Optional[int] = None
+    ):
+        self.max_seconds: Optional[float] = max_seconds
+        self.max_decoded_bytes: Optional[int] = max_decoded_bytes
+        self.max_depth: Optional[int] = max_depth
+        self.max_submatches: Optional[int] = max_submatches
+        self.max_array_elements: Optional[int] = max_array_elements
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "max_seconds": self.max_seconds,
+            "max_decoded_bytes": self.max_decoded_bytes,
+            "max_depth": self.max_depth,
+            "max_submatches": self.max_submatches,
+            "max_array_elements": self.max_array_elements
+        }
+
+    def __eq__(self, other):
+        return isinstance(other, ParseBudget) and self.to_dict() == other.to_dict()
+
+    def __hash__(self):
+        return hash(tuple(self.to_dict().values()))
+
+    def __repr__(self):
+        args = ", ".join(f"{key}={value!r}" for key, value in self.to_dict().items())
+        return f"{self.__class__.__name__}({args})"
+
+
+class BudgetExceeded(Exception):
+    """
+    Raised from within a parser that has exceeded its :class:`ParseBudget` before it could yield its next submatch.
+
+    This is handled just like a budget that is exceeded between submatches: the parser is stopped, the submatches it
+    has already produced are kept, and its match is marked as truncated.
+
+    """
+    pass
+
+
+class _BudgetTracker:
+    """Tracks a single parser invocation's use of a :class:`ParseBudget`"""
+    def __init__(self, budget: ParseBudget):
+        self.budget: ParseBudget = budget
+        if budget.max_seconds is None:
+            self.deadline: Optional[float] = None
+        else:
+            self.deadline = perf_counter() + budget.max_seconds
+        self.decoded_bytes: int = 0
+        self.submatches: int = 0
+
+    def exceeded(self, submatch: "Match") -> Optional[str]:
+        """Accounts for `submatch`, returning a description of the budget that has been exceeded, if any"""
+        self.submatches += 1
+        # payloads that are decoded lazily are not decoded by the parser, so they do not count against its budget
+        if submatch._decoded is not None and not callable(submatch._decoded):
+            self.decoded_bytes += len(submatch._decoded)
+        if self.budget.max_submatches is not None and self.submatches > self.budget.max_submatches:
+            return f"exceeded the limit of {self.budget.max_submatches} submatches"
+        elif self.budget.max_decoded_bytes is not None and self.decoded_bytes > self.budget.max_decoded_bytes:
+            return f"exceeded the limit of {self.budget.max_decoded_bytes} decoded bytes"
+        elif self.deadline is not None and perf_counter() > self.deadline:
+            return f"exceeded the time limit of {self.budget.max_seconds} seconds"
+        return None
+
+    def remaining_decoded_bytes(self) -> Optional[int]:
+        if self.budget.max_decoded_bytes is None:
+            return None
+        return max(self.budget.max_decoded_bytes - self.decoded_bytes, 0)
+
+    def check_deadline(self):
+        if self.deadline is not None and perf_counter() > self.deadline:
+            raise BudgetExceeded(f"exceeded the time limit of {self.budget.max_seconds} seconds")
+
+
+_UNGUESSED = object()
+
+
+@lru_cache(maxsize=None)
+def _guess_extension(mimetype: str) -> Optional[str]:
+    """Memoized, since there are many more matches than there are distinct names"""
+    extension = guess_extension(mimetype)
+    if extension is not None and extension.startswith("."):
+        # guess_extension adds a leading dot
+        extension = extension[1:]
+    return extension
+
+
 class Match:
+    """
+    A node in the tree of matches for a file.
+
+    Matches are slotted, and their global offsets are computed once at construction (a match's parent and relative
+    offset never change), so building and serializing a tree is linear in its number of nodes. For matches without an
+    explicit length, the end of the furthest child is maintained incrementally as descendants are added.
+
+    """
+    __slots__ = (
+        "_children", "name", "matcher", "_match", "img_data", "_decoded", "_offset", "_global_offset", "_length",
+        "_children_end", "_parent", "_root", "display_name", "_extension", "truncated"
+    )
+
     def __init__(
             self,
             name: str,
@@ -83,37 +266,98 @@ class Match:
             matcher: Optional["Matcher"] = None,
             display_name: Optional[str] = None,
             img_data: Optional[str] = None,
-            decoded: Optional[bytes] = None,
+            decoded: Optional[Union[bytes, Callable[[], Optional[bytes]]]] = None,
             extension: Optional[str] = None
     ):
         self._children: List[Match] = []
         self.name: str = name
         self.matcher: Optional[Matcher] = None
-        self.match = match_obj
+        self._match: Any = match_obj
         self.img_data: Optional[str] = img_data
-        self.decoded: Optional[bytes] = decoded
+        self._decoded: Optional[Union[bytes, Callable[[], Optional[bytes]]]] = decoded
         self._offset: int = relative_offset
         self._length: Optional[int] = length
+        # the maximum global end offset of any child, or None if there are no children
+        self._children_end: Optional[int] = None
         self._parent: Optional[Match] = parent
         if parent is not None:
             if not isinstance(parent, Match):
                 raise ValueError("The parent must be an instance of a Match")
-            parent._children.append(self)
             if matcher is None:
                 matcher = parent.matcher
         if matcher is None:
             raise(ValueError("A Match must be initialized with `parent` and/or `matcher` not being None"))
         self.matcher = matcher
+        if parent is None:
+            self._global_offset: int = relative_offset
+            self._root: Match = self
+        else:
+            self._global_offset = parent._global_offset + relative_offset
+            self._root = parent._root
+            parent._children.append(self)
+            parent._child_ended(self.offset + self.length)
         if display_name is None:
             self.display_name: str = name
         else:
             self.display_name = display_name
-        self.extension: Optional[str] = extension
-        if extension is None:
-            self.extension = guess_extension(self.name)
-            if self.extension is not None and self.extension.startswith("."):
-                # guess_extension adds a leading dot
-                self.extension = self.extension[1:]
+        # the extension is only guessed from the MIME type if it is requested
+        self._extension: Any = _UNGUESSED if extension is None else extension
+        # if parsing of this match was stopped early (e.g., because it exceeded its `ParseBudget`), the reason why
+        self.truncated: Optional[str] = None
+
+    def _child_ended(self, end: int):
+        """Records that a child ends at global offset `end`, propagating to ancestors whose length depends on it"""
+        match: Optional[Match] = self
+        while match is not None and (match._children_end is None or end > match._children_end):
+            match._children_end = end
+            if match._length is not None:
+                break
+            end = match.offset + match.length
+            match = match._parent
+
+    @property
+    def match(self) -> Any:
+        """
+        The object that was matched (e.g., a magic test result or a parsed value).
+
+        Parsers may match a zero-copy `memoryview` of the input (e.g., the raw bytes of a Kaitai struct field), which is
+        only copied into `bytes` here, when the value is actually needed.
+
+        """
+        if isinstance(self._match, memoryview):
+            return self._match.tobytes()
+        return self._match
+
+    @match.setter
+    def match(self, match_obj: Any):
+        self._match = match_obj
+
+    @property
+    def decoded(self) -> Optional[bytes]:
+        """
+        The data decoded from this match (e.g., a decompressed archive member or PDF stream), if any.
+
+        This may be set to a function that decodes the data, in which case the data are only decoded the first time
+        they are requested (e.g., when the match is output).
+
+        """
+        if callable(self._decoded):
+            self._decoded = self._decoded()
+        return self._decoded
+
+    @decoded.setter
+    def decoded(self, decoded: Optional[Union[bytes, Callable[[], Optional[bytes]]]]):
+        self._decoded = decoded
+
+    @property
+    def extension(self) -> Optional[str]:
+        if self._extension is _UNGUESSED:
+            self._extension = _guess_extension(self.name)
+        return self._extension
+
+    @extension.setter
+    def extension(self, extension: Optional[str]):
+        self._extension = extension
 
     @property
     def children(self) -> Tuple["Match", ...]:
@@ -135,21 +379,15 @@ class Match:
     @property
     def offset(self) -> int:
         """The global offset of this match with respect to the original file"""
-        if self.parent is not None:
-            return self.parent.offset + self.relative_offset
-        else:
-            return self.relative_offset
+        return self._global_offset
 
     @property
     def root(self) -> "Match":
-        if self.parent is None:
-            return self
-        else:
-            return self.parent.root
+        return self._root
 
     @property
     def root_offset(self) -> int:
-        return self.offset - self.root.offset
+        return self._global_offset - self._root._global_offset
 
     @property
     def relative_offset(self) -> int:
@@ -160,30 +398,77 @@ class Match:
     def length(self) -> int:
         """The number of bytes in the match"""
         if self._length is None:
-            if self._children:
-                return max(c.offset + c.length for c in self._children) - self.offset
+            if self._children_end is not None:
+                return self._children_end - self._global_offset
             else:
                 return 0
         return self._length
 
-    def to_obj(self):
-        ret = {
-            'relative_offset': self.relative_offset,
-            'offset': self.offset,
+    def _json_fields(self) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+        """Returns the fields of :meth:`Match.to_obj` that come before and after `subEls`, respectively"""
+        head = {
+            'relative_offset': self._offset,
+            'offset': self._global_offset,
             'size': self.length,
             'type': self.name,
             'name': self.display_name,
-            'value': str(self.match),
-            'subEls': [c.to_obj() for c in self]
+            'value': str(self.match)
         }
+        tail: Dict[str, Any] = {}
         if self.img_data is not None:
-            ret['img_data'] = self.img_data
+            tail['img_data'] = self.img_data
         if self.decoded is not None:
-            ret['decoded'] = base64.b64encode(self.decoded).decode('utf-8')
-        if self.extension is not None:
-            ret['extension'] = self.extension
+            tail['decoded'] = base64.b64encode(self.decoded).decode('utf-8')
+        extension = self.extension
+        if extension is not None:
+            tail['extension'] = extension
+        if self.truncated is not None:
+            tail['truncated'] = self.truncated
+        return head, tail
+
+    def to_obj(self):
+        ret, tail = self._json_fields()
+        ret['subEls'] = [c.to_obj() for c in self._children]
+        ret.update(tail)
         return ret
 
+    def write_json(self, output: TextIO):
+        """
+        Writes the same JSON as `json.dump(self.to_obj(), output)`, one node at a time.
+
+        Unlike `to_obj`, this never builds the JSON for the entire tree: only that of the nodes on the path from this
+        match to the one currently being written is held in memory (the match tree itself must already be). Since the
+        traversal does not recurse, arbitrarily deep trees are supported.
+
+        """
+        # each entry is the JSON for the fields after `subEls`, the remaining children, and whether any were written
+        stack: List[Tuple[Dict[str, Any], Iterator[Match], bool]] = []
+
+        def start(match: Match):
+            head, tail = match._json_fields()
+            # strip the closing brace so the children can be appended
+            output.write(dumps(head)[:-1])
+            output.write(', "subEls": [')
+            stack.append((tail, iter(match._children), False))
+
+        start(self)
+        while stack:
+            tail, children, wrote_child = stack[-1]
+            child = next(children, None)
+            if child is None:
+                stack.pop()
+                if tail:
+                    output.write("], ")
+                    output.write(dumps(tail)[1:])
+                else:
+                    output.write("]}")
+                continue
+            if wrote_child:
+                output.write(", ")
+            else:
+                stack[-1] = (tail, children, True)
+            start(child)
+
     def json(self) -> str:
         return dumps(self.to_obj())
 
@@ -195,7 +480,17 @@ class Match:
 
 
 class Submatch(Match):
-    pass
+    __slots__ = ()
+
+
+def _nesting_level(parent: Optional[Match]) -> int:
+    """Returns the number of files that a file matched within `parent` would be nested within"""
+    level = 0
+    while parent is not None:
+        if not isinstance(parent, Submatch):
+            level += 1
+        parent = parent.parent
+    return level
 
 
 def register_parser(*filetypes: str) -> Callable[[Union[Parser, ParserFunction]], Parser]:
@@ -208,24 +503,84 @@ def register_parser(*filetypes: str) -> Callable[[Union[Parser, ParserFunction]]
     return wrapper
 
 
+def register_lazy_parser(module: str, name: str, *filetypes: str) -> Parser:
+    """
+    Registers the parser named `name` in `module` for the given filetypes, without importing the module.
+
+    This is for parsers with expensive dependencies: the module is only imported the first time one of the filetypes
+    is parsed. The parser itself must not also be decorated with :func:`register_parser`.
+
+    """
+    return register_parser(*filetypes)(LazyParser(module, name))
+
+
+def load_parsers():
+    """
+    Loads all of the registered parsers (and the modules that register parsers along with custom magic tests).
+
+    Long-lived processes can call this before forking workers so that they do not each have to load them separately.
+
+    """
+    DefaultMagicMatcher.import_modules()
+    for parsers in PARSERS.values():
+        for parser in parsers:
+            parser.load()
+
+
 class Matcher:
-    def __init__(self, try_all_offsets: bool = False, parse: bool = True, matcher: Optional[MagicMatcher] = None):
+    """
+    Matches files against a magic matcher and parses the results.
+
+    If an `executor` is given, the parsers for each of the MIME types detected in the outermost file are run as a
+    separate task, so the parsing of independent file types (e.g., in a PDF/ZIP polyglot) is concurrent. Matches are
+    still yielded in the same order in which they are yielded without an executor. In a
+    :class:`concurrent.futures.ProcessPoolExecutor`, the parsers run in a worker process (using a matcher constructed
+    from :attr:`MagicMatcher.DEFAULT_INSTANCE` that matches the same MIME types) and only the file's path is sent to
+    it, so the file must be given as a path. Since the objects the parsers produce are not generally picklable, each
+    submatch parsed in a worker process has the string representation of its parsed object as its `match`.
+
+    If a `budget` is given, it is enforced for every parser invocation (see :class:`ParseBudget`). If a `memo` is given,
+    payloads that are analyzed recursively (e.g., archive members) are only matched and parsed once per distinct
+    content (see :class:`PayloadMemo`).
+
+    If `lazy_decoding` is True, parsers that support it (currently, the PDF parser) only record the locations of the
+    encoded payloads they find (e.g., compressed PDF streams): each payload is only decoded if its :attr:`Match.decoded`
+    is requested, and it is not analyzed recursively.
+
+    If `validate` is True and `parse` is False, MIME type matches are only yielded if their parsers find them valid (see
+    :meth:`Parser.validate`), which confirms that, e.g., a file matched by a format's magic actually parses as that
+    format without the cost of parsing it into submatches.
+
+    """
+    def __init__(self, try_all_offsets: bool = False, parse: bool = True, matcher: Optional[MagicMatcher] = None,
+                 executor: Optional[Executor] = None, budget: Optional[ParseBudget] = None,
+                 memo: Optional["PayloadMemo"] = None, lazy_decoding: bool = False, validate: bool = False):
         if matcher is None:
             self.magic_matcher: MagicMatcher = MagicMatcher.DEFAULT_INSTANCE
         else:
             self.magic_matcher = matcher
+            # the modules that add tests to the default matcher also register parsers
+            DefaultMagicMatcher.import_modules()
         self.try_all_offsets: bool = try_all_offsets
         self.parse: bool = parse
+        self.executor: Optional[Executor] = executor
+        self.budget: Optional[ParseBudget] = budget
+        self.memo: Optional[PayloadMemo] = memo
+        self.lazy_decoding: bool = lazy_decoding
+        self.validate: bool = validate
+        self._memo_scope: Optional[Tuple[Any, ...]] = None
+        # the budget trackers of the parser invocations in progress, keyed by the ID of the match being parsed
+        self._budget_trackers: Dict[int, _BudgetTracker] = {}
 
-    def handle_mimetype(
-            self, mimetype: str,
+    def _new_match(
+            self,
+            mimetype: str,
             match_obj: TestResult,
             data: bytes,
-            file_stream: Union[str, Path, IO, FileStream],
             parent: Optional[Match] = None,
             offset: int = 0,
             length: Optional[int] = None
-    ) -> Iterator[Match]:
+    ) -> Match:
         if length is None:
             length = len(data) - offset
         extension: Optional[str] = None
@@ -233,7 +588,7 @@ class Matcher:
             extension = next(iter(match_obj.test.all_extensions()))
         except StopIteration:
             pass
-        m = Match(
+        return Match(
             mimetype,
             match_obj,
             offset,
@@ -242,64 +597,483 @@ class Matcher:
             matcher=self,
             extension=extension
         )
+
+    def handle_mimetype(
+            self, mimetype: str,
+            match_obj: TestResult,
+            data: bytes,
+            file_stream: Union[str, Path, IO, bytes, FileStream],
+            parent: Optional[Match] = None,
+            offset: int = 0,
+            length: Optional[int] = None
+    ) -> Iterator[Match]:
+        m = self._new_match(mimetype, match_obj, data, parent, offset, length)
+        if self.validate and not self.parse and not self.is_valid(m, file_stream):
+            log.info(f"Not reporting the {mimetype} match at byte offset {m.offset} because it is not valid")
+            return
         yield m
         if self.parse:
-            for parser in PARSERS[mimetype]:
-                # Don't yield this custom match until we've tried its submatch function
-                # (which may throw an InvalidMatch, meaning that this match is invalid)
-                try:
-                    with FileStream(file_stream, start=offset, length=length) as fs:
-                        submatch_iter = parser(fs, m)
-                        try:
-                            first_submatch = next(submatch_iter)
-                            has_first = True
-                        except StopIteration:
-                            has_first = False
-                        if has_first:
-                            yield first_submatch
-                            yield from submatch_iter
-                except InvalidMatch:
-                    pass
-                except Exception as e:
-                    log.warning(f"Parser {parser!s} for MIME type {mimetype} raised an exception while "
-                                f"parsing {match_obj!s} in {file_stream!s}: {e!s}")
-                    if log.isEnabledFor(logger.logging.DEBUG):
-                        traceback.print_exc()
+            yield from self.parse_match(m, file_stream)
+
+    def is_valid(self, match: Match, file_stream: Union[str, Path, IO, bytes, FileStream]) -> bool:
+        """Returns whether all of the parsers for the MIME type of `match` find its portion of `file_stream` valid"""
+        for parser in PARSERS[match.name]:
+            with FileStream(file_stream, start=match.relative_offset, length=match.length) as fs:
+                if not parser.validate(fs):
+                    return False
+        return True
+
+    def parse_match(self, match: Match, file_stream: Union[str, Path, IO, bytes, FileStream]) -> Iterator[Match]:
+        """Runs all of the parsers for the MIME type of `match` on its portion of `file_stream`"""
+        for parser in PARSERS[match.name]:
+            # Don't yield this custom match until we've tried its submatch function
+            # (which may throw an InvalidMatch, meaning that this match is invalid)
+            try:
+                with FileStream(file_stream, start=match.relative_offset, length=match.length) as fs:
+                    submatch_iter = parser(fs, match)
+                    if self.budget is None:
+                        yield from submatch_iter
+                        continue
+                    tracker = _BudgetTracker(self.budget)
+                    self._budget_trackers[id(match)] = tracker
+                    try:
+                        for submatch in submatch_iter:
+                            yield submatch
+                            exceeded = tracker.exceeded(submatch)
+                            if exceeded is not None:
+                                # this runs the parser's cleanup (e.g., closing the files it opened)
+                                submatch_iter.close()
+                                raise BudgetExceeded(exceeded)
+                    finally:
+                        del self._budget_trackers[id(match)]
+            except InvalidMatch:
+                pass
+            except BudgetExceeded as e:
+                match.truncated = f"Parser {parser!s} {e!s}"
+                log.warning(f"{match.truncated} while parsing {match.name} at byte offset {match.offset}; its results "
+                            f"are truncated")
+            except Exception as e:
+                if isinstance(file_stream, (str, Path)):
+                    source = file_stream
+                else:
+                    source = getattr(file_stream, "name", "an in-memory buffer")
+                log.warning(f"Parser {parser!s} for MIME type {match.name} raised an exception while "
+                            f"parsing {match.match!s} in {source!s}: {e!s}")
+                if log.isEnabledFor(logger.logging.DEBUG):
+                    traceback.print_exc()
+
+    def _budget_tracker(self, match: Match) -> Optional[_BudgetTracker]:
+        """Returns the tracker of the innermost parser invocation that is parsing `match` or one of its ancestors"""
+        if self.budget is None:
+            return None
+        ancestor: Optional[Match] = match
+        while ancestor is not None:
+            tracker = self._budget_trackers.get(id(ancestor))
+            if tracker is not None:
+                return tracker
+            ancestor = ancestor.parent
+        return None
+
+    def decoding_limit(self, match: Match) -> Optional[int]:
+        """
+        Returns the number of bytes that the parser producing submatches of `match` may still decode, if limited.
+
+        Parsers that decode (e.g., decompress) data should never decode more than this: doing so would exceed their
+        :class:`ParseBudget` anyway, and a decompression bomb would exhaust memory before the size of its output could
+        be checked.
+
+        """
+        tracker = self._budget_tracker(match)
+        if tracker is None:
+            return None
+        return tracker.remaining_decoded_bytes()
+
+    def check_deadline(self, match: Match):
+        """
+        Raises :class:`BudgetExceeded` if the parser producing submatches of `match` has exceeded its time limit.
+
+        A parser's time limit is otherwise only checked between the submatches it yields, so this should be called
+        from loops within a parser that can run for a long time without yielding anything.
+
+        """
+        tracker = self._budget_tracker(match)
+        if tracker is not None:
+            tracker.check_deadline()
 
     def identify(
-            self, file_stream: Union[str, Path, IO, FileStream]
+            self, file_stream: Union[str, Path, IO, bytes, FileStream]
     ) -> Iterator[MagicMatch]:
         with FileStream(file_stream) as f:
             context = MatchContext.load(f, only_match_mime=False)
             yield from self.magic_matcher.match(context)
 
-    def match(self, file_stream: Union[str, Path, IO, FileStream], parent: Optional[Match] = None) -> Iterator[Match]:
+    def carve(
+            self, file_stream: Union[str, Path, IO, bytes, FileStream]
+    ) -> Iterator[Tuple[int, MagicMatch]]:
+        """Yields (offset, match) pairs for all files embedded at nonzero offsets within the given file"""
         with FileStream(file_stream) as f:
-            matched_mimetypes: Set[str] = set()
-            context = MatchContext.load(f, only_match_mime=True)
-            for magic_match in self.magic_matcher.match(context):
+            context = MatchContext.load(f, only_match_mime=False)
+            yield from self.magic_matcher.carve(context)
+
+    def match(
+            self,
+            file_stream: Union[str, Path, IO, bytes, FileStream],
+            parent: Optional[Match] = None,
+            magic_matches: Optional[Iterable[MagicMatch]] = None,
+            embedded_magic_matches: Optional[Iterable[Tuple[int, MagicMatch]]] = None
+    ) -> Iterator[Match]:
+        """
+        Yields all matches (and their submatches, if `self.parse` is True) for the given file.
+
+        If the results of matching the file against `self.magic_matcher` with `only_match_mime` have already been
+        calculated, they can be passed as `magic_matches` (and, likewise, the results of `self.magic_matcher.carve` as
+        `embedded_magic_matches`) so that the magic matching does not need to be redone.
+
+        """
+        if self.budget is not None and self.budget.max_depth is not None and parent is not None \
+                and _nesting_level(parent) > self.budget.max_depth:
+            parent.truncated = f"exceeded the limit of {self.budget.max_depth} nested files"
+            log.info(f"Not matching the file nested within {parent.name} at byte offset {parent.offset} because "
+                     f"it {parent.truncated}")
+            return
+        if self.memo is not None and parent is not None and magic_matches is None \
+                and isinstance(file_stream, (bytes, bytearray, memoryview)):
+            yield from self._match_memoized(file_stream, parent)
+        else:
+            yield from self._match(file_stream, parent, magic_matches, embedded_magic_matches)
+
+    def _memo_key(self, data: Union[bytes, bytearray, memoryview], parent: Match) -> Tuple[Any, ...]:
+        if self._memo_scope is None:
+            if self.magic_matcher is MagicMatcher.DEFAULT_INSTANCE:
+                mimetypes: Optional[FrozenSet[str]] = None
+            else:
+                mimetypes = frozenset(self.magic_matcher.mimetypes)
+            self._memo_scope = (mimetypes, self.parse, self.budget, self.lazy_decoding, self.validate)
+        if self.budget is not None and self.budget.max_depth is not None:
+            # how deeply the payload can be parsed depends on how deeply it is nested
+            level: Optional[int] = _nesting_level(parent)
+        else:
+            level = None
+        return hashlib.sha256(data).digest(), self._memo_scope, level
+
+    def _match_memoized(self, data: Union[bytes, bytearray, memoryview], parent: Match) -> Iterator[Match]:
+        key = self._memo_key(data, parent)
+        detached = self.memo.get(key)
+        if detached is not None:
+            log.debug(f"Reusing the matches for the {len(data)} byte payload within {parent.name} at byte offset "
+                      f"{parent.offset}")
+            yield from attach(parent, detached)
+            return
+        first_child = len(parent._children)
+        yield from self._match(data, parent)
+        # this is not reached if the caller stopped early (e.g., because of a `ParseBudget`), so only complete
+        # results are memoized
+        self.memo.put(key, detach(parent._children[first_child:]))
+
+    def _match(
+            self,
+            file_stream: Union[str, Path, IO, bytes, FileStream],
+            parent: Optional[Match] = None,
+            magic_matches: Optional[Iterable[MagicMatch]] = None,
+            embedded_magic_matches: Optional[Iterable[Tuple[int, MagicMatch]]] = None
+    ) -> Iterator[Match]:
+        with FileStream(file_stream) as f:
+            if magic_matches is None:
+                context = MatchContext.load(f, only_match_mime=True)
+                magic_matches = self.magic_matcher.match(context)
+                if embedded_magic_matches is None and self.try_all_offsets and parent is None:
+                    # only carve the outermost file; embedded files will have been found by this scan
+                    embedded_magic_matches = self.magic_matcher.carve(context)
+            hits = self._mimetype_hits(magic_matches, embedded_magic_matches)
+            if self.executor is not None and self.parse and parent is None:
+                # nested matches are parsed within the task for their outermost match, so that the tasks never
+                # modify the same tree
+                yield from self._match_concurrently(hits, file_stream)
+            else:
+                for mimetype, result, data, offset, length in hits:
+                    yield from self.handle_mimetype(mimetype, result, data, file_stream, parent, offset=offset,
+                                                    length=length)
+
+    @staticmethod
+    def _mimetype_hits(
+            magic_matches: Iterable[MagicMatch],
+            embedded_magic_matches: Optional[Iterable[Tuple[int, MagicMatch]]]
+    ) -> Iterator[Tuple[str, TestResult, bytes, int, Optional[int]]]:
+        """Yields (mimetype, result, data, offset, length) tuples for each distinct MIME type that was matched"""
+        matched_mimetypes: Set[str] = set()
+        for magic_match in magic_matches:
+            for result in magic_match:
+                if result.test.mime is None:
+                    continue
+                mimetype = result.test.mime.resolve(magic_match.context)
+                if mimetype in matched_mimetypes:
+                    continue
+                matched_mimetypes.add(mimetype)
+                yield mimetype, result, magic_match.data, 0, None
+        if embedded_magic_matches is not None:
+            matched_offsets: Set[Tuple[int, str]] = set()
+            for offset, magic_match in embedded_magic_matches:
                 for result in magic_match:
                     if result.test.mime is None:
                         continue
-                    mimetype = result.test.mime.resolve(context)
-                    if mimetype in matched_mimetypes:
+                    mimetype = result.test.mime.resolve(magic_match.context)
+                    if (offset, mimetype) in matched_offsets:
                         continue
-                    matched_mimetypes.add(mimetype)
-                    yield from self.handle_mimetype(mimetype, result, context.data, file_stream, parent)
+                    matched_offsets.add((offset, mimetype))
+                    yield mimetype, result, magic_match.data, offset, len(magic_match.data)
+
+    def _submit(self, match: Match, file_stream: Union[str, Path, IO, bytes, FileStream]) -> Future:
+        if not isinstance(self.executor, ProcessPoolExecutor):
+            return self.executor.submit(lambda: list(self.parse_match(match, file_stream)))
+        elif not isinstance(file_stream, (str, Path)):
+            raise ValueError("Files can only be parsed in a process pool if they are given as a path")
+        if self.magic_matcher is MagicMatcher.DEFAULT_INSTANCE:
+            mimetypes: Optional[Tuple[str, ...]] = None
+        else:
+            mimetypes = tuple(sorted(self.magic_matcher.mimetypes))
+        return self.executor.submit(
+            _parse_in_worker, str(file_stream), match.name, str(match.match), match.relative_offset, match.length,
+            self.try_all_offsets, mimetypes, self.budget, self.lazy_decoding
+        )
+
+    def _match_concurrently(
+            self,
+            hits: Iterable[Tuple[str, TestResult, bytes, int, Optional[int]]],
+            file_stream: Union[str, Path, IO, bytes, FileStream]
+    ) -> Iterator[Match]:
+        # matches that have been submitted but not yet yielded, in the order in which they must be yielded
+        pending: Deque[Tuple[Match, Future]] = deque()
+
+        def finished(block: bool) -> Iterator[Match]:
+            while pending and (block or pending[0][1].done()):
+                match, future = pending.popleft()
+                yield match
+                result = future.result()
+                if isinstance(self.executor, ProcessPoolExecutor):
+                    match.truncated, detached = result
+                    yield from attach(match, detached)
+                else:
+                    yield from result
+
+        try:
+            for mimetype, result, data, offset, length in hits:
+                match = self._new_match(mimetype, result, data, offset=offset, length=length)
+                pending.append((match, self._submit(match, file_stream)))
+                yield from finished(block=False)
+            yield from finished(block=True)
+        finally:
+            # if the caller stopped early, do not bother parsing the rest
+            for _, future in pending:
+                future.cancel()
+
+
+# A match subtree that is independent of its parent: one (parent index, whether it is a file match rather than a
+# submatch, name, value, relative offset, length, display name, image data, decoded data, extension, truncated) tuple
+# per match, in pre-order, where a parent index of -1 is the parent the subtree is attached to
+DetachedMatch = Tuple[
+    int, bool, str, Any, int, Optional[int], str, Optional[str], Optional[bytes], Optional[str], Optional[str]
+]
+
+
+def detach(matches: Iterable[Match], picklable: bool = False) -> List[DetachedMatch]:
+    """
+    Returns the subtrees rooted at `matches` (which must all have the same parent) in a form that can be reattached to
+    any other parent with :func:`attach`.
+
+    If `picklable` is True, the parsed values are replaced with their string representations, since the objects
+    produced by parsers are not generally picklable.
+
+    """
+    detached: List[DetachedMatch] = []
+    indexes: Dict[int, int] = {}
+    stack: List[Match] = list(reversed(list(matches)))
+    while stack:
+        match = stack.pop()
+        indexes[id(match)] = len(detached)
+        extension = None if match._extension is _UNGUESSED else match._extension
+        if picklable:
+            # parsed values (e.g., struct fields) are often subclasses of builtin types that cannot be pickled
+            detached.append((
+                indexes.get(id(match.parent), -1), not isinstance(match, Submatch), str(match.name),
+                str(match.match), int(match.relative_offset), None if match._length is None else int(match._length),
+                str(match.display_name), None if match.img_data is None else str(match.img_data),
+                None if match.decoded is None else bytes(match.decoded),
+                None if extension is None else str(extension), match.truncated
+            ))
+        else:
+            detached.append((
+                indexes.get(id(match.parent), -1), not isinstance(match, Submatch), match.name, match._match,
+                match.relative_offset, match._length, match.display_name, match.img_data, match._decoded, extension,
+                match.truncated
+            ))
+        stack.extend(reversed(match._children))
+    return detached
+
+
+def attach(parent: Match, detached: Iterable[DetachedMatch]) -> Iterator[Match]:
+    """Reconstructs subtrees returned by :func:`detach` as descendants of `parent`, yielding the matches in pre-order"""
+    matches: List[Match] = []
+    for (parent_index, is_file, name, value, relative_offset, length, display_name, img_data, decoded, extension,
+         truncated) in detached:
+        match = (Match if is_file else Submatch)(
+            name,
+            value,
+            relative_offset,
+            length=length,
+            parent=parent if parent_index < 0 else matches[parent_index],
+            display_name=display_name,
+            img_data=img_data,
+            decoded=decoded,
+            extension=extension
+        )
+        match.truncated = truncated
+        matches.append(match)
+        yield match
+
+
+DEFAULT_MEMO_SIZE: int = 64 * 1024 * 1024  # 64 MiB
+
+
+def _detached_size(detached: Iterable[DetachedMatch]) -> int:
+    """
+    Estimates the number of bytes of memory retained by a detached match subtree.
+
+    A `memoryview` value (e.g., the raw bytes of a Kaitai struct field) keeps its entire underlying buffer alive, so the
+    size of each distinct underlying buffer is counted, too.
+
+    """
+    size = 0
+    buffers: Set[int] = set()
+    for entry in detached:
+        size += sys.getsizeof(entry)
+        for value in entry:
+            if value is None or isinstance(value, (bool, int)):
+                continue
+            size += sys.getsizeof(value)
+            if isinstance(value, memoryview) and id(value.obj) not in buffers:
+                buffers.add(id(value.obj))
+                try:
+                    size += len(value.obj)
+                except TypeError:
+                    size += value.nbytes
+    return size
+
+
+class PayloadMemo:
+    """
+    A memo of the matches for payloads (e.g., decompressed archive members or decoded PDF streams) that are analyzed
+    recursively, keyed by their contents.
+
+    When a :class:`Matcher` with a memo recurses into a payload that it has already analyzed, the resulting match
+    subtree is grafted in at the new location rather than matching and parsing the payload again. A memo can be shared
+    between matchers (e.g., for all of the files in a batch): matchers with different magic matchers or budgets never
+    share results. The subtrees remembered are bounded to an estimated `max_size` bytes in total; the least recently
+    used are forgotten first. Subtrees that themselves contain decoded data are never remembered, since the decoded
+    data can be arbitrarily larger than the payload (and the decoder of a lazily decoded payload can keep the entire
+    document it was decoded from alive).
+
+    """
+    def __init__(self, max_size: int = DEFAULT_MEMO_SIZE):
+        self.max_size: int = max_size
+        self.size: int = 0
+        self._entries: "OrderedDict[Tuple[Any, ...], Tuple[List[DetachedMatch], int]]" = OrderedDict()
+        self._lock: Lock = Lock()
+        self.hits: int = 0
+        self.misses: int = 0
+
+    def get(self, key: Tuple[Any, ...]) -> Optional[List[DetachedMatch]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def put(self, key: Tuple[Any, ...], detached: List[DetachedMatch]):
+        # the decoded data are the ninth element of each detached match
+        if any(entry[8] is not None for entry in detached):
+            return
+        size = sys.getsizeof(key) + _detached_size(detached)
+        if size > self.max_size:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.size -= previous[1]
+            self._entries[key] = (detached, size)
+            self.size += size
+            while self.size > self.max_size:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self.size -= evicted_size
+
+    def __len__(self):
+        return len(self._entries)
+
+
+_WORKER_MATCHERS: Dict[Tuple[bool, Optional[Tuple[str, ...]], Optional[ParseBudget], bool], Matcher] = {}
+
+
+def _parse_in_worker(
+        path: str,
+        mimetype: str,
+        description: str,
+        offset: int,
+        length: int,
+        try_all_offsets: bool,
+        mimetypes: Optional[Tuple[str, ...]],
+        budget: Optional[ParseBudget] = None,
+        lazy_decoding: bool = False
+) -> Tuple[Optional[str], List[DetachedMatch]]:
+    """Returns the reason parsing the root match was truncated (if it was) along with its detached submatches"""
+    key = (try_all_offsets, mimetypes, budget, lazy_decoding)
+    if key not in _WORKER_MATCHERS:
+        if mimetypes is None:
+            magic_matcher = MagicMatcher.DEFAULT_INSTANCE
+        else:
+            magic_matcher = MagicMatcher.DEFAULT_INSTANCE.only_match(mimetypes=mimetypes)
+        _WORKER_MATCHERS[key] = Matcher(try_all_offsets=try_all_offsets, matcher=magic_matcher, budget=budget,
+                                        memo=PayloadMemo(), lazy_decoding=lazy_decoding)
+    matcher = _WORKER_MATCHERS[key]
+    root = Match(mimetype, description, offset, length=length, matcher=matcher)
+    for _ in matcher.parse_match(root, path):
+        pass
+    return root.truncated, detach(root.children, picklable=True)
 
 
 class Analyzer:
     def __init__(self, path: Union[str, Path], try_all_offsets: bool = False, parse: bool = True,
-                 magic_matcher: Optional[MagicMatcher] = None):
+                 magic_matcher: Optional[MagicMatcher] = None, cache: Optional[ResultCache] = None,
+                 executor: Optional[Executor] = None, budget: Optional[ParseBudget] = None,
+                 memo: Optional[PayloadMemo] = None, identify_window: Optional[IdentificationWindow] = None,
+                 lazy_decoding: bool = False, validate: bool = False):
         self.path: Union[str, Path] = path
         self.try_all_offsets: bool = try_all_offsets
+        if identify_window is not None and try_all_offsets:
+            log.warning("Ignoring the identification window, since finding embedded files requires scanning the "
+                        "entire file")
+            identify_window = None
+        # if set, only this window of the file is read up front to identify it
+        self.identify_window: Optional[IdentificationWindow] = identify_window
         self.parse: bool = parse
+        self.cache: Optional[ResultCache] = cache
+        self.executor: Optional[Executor] = executor
+        self.budget: Optional[ParseBudget] = budget
+        # identical payloads within the file are only analyzed once; the memo can also be shared between analyzers
+        self.memo: PayloadMemo = PayloadMemo() if memo is None else memo
+        self.lazy_decoding: bool = lazy_decoding
+        # if set (and not parsing), the matches of MIME types whose parsers can cheaply validate them are confirmed
+        self.validate: bool = validate
         self._magic_matcher: Optional[MagicMatcher] = magic_matcher
+        self._content_hash: Optional[str] = None
         self._matcher: Optional[Matcher] = None
         self._matches: Optional[List[Match]] = None
         self._match_iterator: Optional[Iterator[Match]] = None
-        self._magic_matches: Optional[List[MagicMatch]] = None
-        self._magic_match_iterator: Optional[Iterator[MagicMatch]] = None
+        self._data: Optional[Union[bytes, mmap.mmap, WindowedData]] = None
+        self._contexts: Dict[bool, MatchContext] = {}
+        self._magic_passes: Dict[bool, LazyIterableSequence[MagicMatch]] = {}
+        self._embedded_magic_passes: Dict[bool, LazyIterableSequence[Tuple[int, MagicMatch]]] = {}
 
     @property
     def magic_matcher(self) -> MagicMatcher:
@@ -308,22 +1082,166 @@ class Analyzer:
         else:
             return self._magic_matcher
 
+    def context(self, only_match_mime: bool = False) -> MatchContext:
+        """Returns a match context for the file; the file is only ever loaded once and is shared between contexts"""
+        if only_match_mime not in self._contexts:
+            if self._data is None:
+                loaded = MatchContext.load(self.path, only_match_mime=only_match_mime, window=self.identify_window)
+                self._data = loaded.data
+            else:
+                loaded = MatchContext(self._data, path=Path(self.path), only_match_mime=only_match_mime)
+            self._contexts[only_match_mime] = loaded
+        return self._contexts[only_match_mime]
+
+    @property
+    def content_hash(self) -> str:
+        """The SHA256 hex digest of the file's contents"""
+        if self._content_hash is None:
+            sha256 = hashlib.sha256()
+            data = self.context().data
+            for offset in range(0, len(data), HASH_CHUNK_SIZE):
+                sha256.update(data[offset:offset + HASH_CHUNK_SIZE])
+            self._content_hash = sha256.hexdigest()
+        return self._content_hash
+
+    def cache_key(self, kind: str) -> str:
+        """Returns the key under which a result of the given kind for this file is stored in `self.cache`"""
+        if self._magic_matcher is None or self._magic_matcher is MagicMatcher.DEFAULT_INSTANCE:
+            mimetypes: Optional[List[str]] = None
+        else:
+            # the matcher was filtered (e.g., by the `--filetype` option)
+            mimetypes = sorted(self._magic_matcher.mimetypes)
+        return ResultCache.key(
+            self.content_hash,
+            kind,
+            polyfile=__version__,
+            magic=MagicSnapshot(DEFAULT_MAGIC_DEFS).fingerprint,
+            mimetypes=mimetypes,
+            parse=self.parse,
+            try_all_offsets=self.try_all_offsets,
+            budget=None if self.budget is None else self.budget.to_dict(),
+            identify_window=None if self.identify_window is None else self.identify_window.to_dict(),
+            lazy_decoding=self.lazy_decoding,
+            validate=self.validate
+        )
+
+    def cached_result(self, kind: str) -> Optional[Any]:
+        """Returns the cached result of the given kind for this file, or None if there is no cache or no entry"""
+        if self.cache is None:
+            return None
+        result = self.cache.get(self.cache_key(kind))
+        if result is not None:
+            log.debug(f"Using the cached {kind} result for {self.path!s}")
+        return result
+
+    def cache_result(self, kind: str, result: Any):
+        if self.cache is not None:
+            self.cache.put(self.cache_key(kind), result)
+
+    def magic_pass(self, only_match_mime: bool = False) -> LazyIterableSequence[MagicMatch]:
+        """
+        Returns the results of matching the file against `self.magic_matcher`.
+
+        The results are lazily computed and cached, so every output format shares the same pass over the file.
+
+        """
+        if only_match_mime not in self._magic_passes:
+            self._magic_passes[only_match_mime] = LazyIterableSequence(
+                self.magic_matcher.match(self.context(only_match_mime))
+            )
+        return self._magic_passes[only_match_mime]
+
+    def embedded_magic_pass(self, only_match_mime: bool = False) -> LazyIterableSequence[Tuple[int, MagicMatch]]:
+        """
+        Returns the (offset, match) pairs for files embedded at nonzero offsets, lazily computed and cached.
+
+        This is always empty unless `try_all_offsets` is True.
+
+        """
+        if only_match_mime not in self._embedded_magic_passes:
+            if self.try_all_offsets:
+                embedded: Iterable[Tuple[int, MagicMatch]] = self.magic_matcher.carve(self.context(only_match_mime))
+            else:
+                embedded = ()
+            self._embedded_magic_passes[only_match_mime] = LazyIterableSequence(embedded)
+        return self._embedded_magic_passes[only_match_mime]
+
     def mime_types(self) -> Iterator[Tuple[str, MagicMatch]]:
         mimetypes: Dict[str, Set[str]] = {}
-        with open(self.path, "rb") as f:
-            for match in self.magic_matcher.match(MatchContext.load(f, only_match_mime=True)):
-                for mimetype in match.mimetypes:
-                    match_text = str(match)
-                    if mimetype not in mimetypes:
-                        mimetypes[mimetype] = set()
-                    if match_text not in mimetypes[mimetype]:
-                        yield mimetype, match
-                        mimetypes[mimetype].add(match_text)
+        matches = itertools.chain(
+            self.magic_pass(only_match_mime=True),
+            (match for _, match in self.embedded_magic_pass(only_match_mime=True))
+        )
+        for match in matches:
+            for mimetype in match.mimetypes:
+                match_text = str(match)
+                if mimetype not in mimetypes:
+                    mimetypes[mimetype] = set()
+                if match_text not in mimetypes[mimetype]:
+                    yield mimetype, match
+                    mimetypes[mimetype].add(match_text)
+
+    def mime_type_descriptions(self) -> Iterator[Tuple[str, str]]:
+        """
+        Yields the same (mimetype, match) pairs as :meth:`Analyzer.mime_types`, but with the match's description in
+        place of the match itself.
+
+        If a result cache is set, the pairs are read from the cache if possible, and otherwise saved to the cache
+        once they have all been yielded.
+
+        """
+        cached = self.cached_result("mime")
+        if cached is not None:
+            for mimetype, description in cached:
+                yield mimetype, description
+            return
+        results: List[Tuple[str, str]] = []
+        for mimetype, match in self.mime_types():
+            description = str(match)
+            results.append((mimetype, description))
+            yield mimetype, description
+        self.cache_result("mime", results)
+
+    def descriptions(self) -> Iterator[str]:
+        """
+        Yields the unique descriptions of the file's magic matches, followed by those of its embedded files.
+
+        If a result cache is set, the descriptions are read from the cache if possible, and otherwise saved to the
+        cache once they have all been yielded.
+
+        """
+        cached = self.cached_result("file")
+        if cached is not None:
+            yield from cached
+            return
+        results: List[str] = []
+        lines: Set[str] = set()
+        embedded_descriptions = (
+            f"{match!s} (embedded at byte offset {offset})"
+            for offset, match in self.embedded_magic_matches()
+        )
+        for line in itertools.chain((str(match) for match in self.magic_matches()), embedded_descriptions):
+            if line not in lines:
+                lines.add(line)
+                results.append(line)
+                yield line
+        self.cache_result("file", results)
+
+    def embedded_magic_matches(self) -> Iterator[Tuple[int, MagicMatch]]:
+        """
+        Yields (offset, match) pairs for files embedded at nonzero offsets.
+
+        This only yields anything if `try_all_offsets` is True.
+
+        """
+        yield from self.embedded_magic_pass()
 
     @property
     def matcher(self) -> Matcher:
         if self._matcher is None:
-            self._matcher = Matcher(parse=self.parse, matcher=self.magic_matcher)
+            self._matcher = Matcher(try_all_offsets=self.try_all_offsets, parse=self.parse,
+                                    matcher=self.magic_matcher, executor=self.executor, budget=self.budget,
+                                    memo=self.memo, lazy_decoding=self.lazy_decoding, validate=self.validate)
         return self._matcher
 
     @property
@@ -331,75 +1249,115 @@ class Analyzer:
         return self._matches
 
     @property
-    def magic_matches_so_far(self) -> List[MagicMatch]:
-        return self._magic_matches
+    def magic_matches_so_far(self) -> Sequence[MagicMatch]:
+        if False not in self._magic_passes:
+            return ()
+        return self._magic_passes[False].items_so_far
+
+    def matches(self, retain: bool = True) -> Iterator[Match]:
+        """
+        Yields the file's top-level matches.
+
+        The matches are retained (see :attr:`Analyzer.matches_so_far`), so they are only computed once. If `retain` is
+        False and the matches have not yet been computed, they are not retained, so each match (along with all of its
+        submatches) can be freed as soon as the caller is done with it; they are recomputed if they are needed again.
 
-    def matches(self) -> Iterator[Match]:
+        Note that a top-level match is yielded before its submatches have been parsed; they are parsed as the iteration
+        continues.
+
+        """
+        if not retain and self._matches is None:
+            yield from self._top_level_matches(self._match_all())
+            return
         if self._matches is None or self._match_iterator is not None:
             if self._matches is None:
                 self._matches = []
-                self._match_iterator = iter(self.matcher.match(self.path))
+                self._match_iterator = self._top_level_matches(self._match_all())
             else:
                 yield from self._matches
-            while True:
-                try:
-                    match = next(self._match_iterator)
-                except StopIteration:
-                    self._match_iterator = None
-                    break
-                if hasattr(match.match, "filetype"):
-                    filetype = match.match.filetype
-                else:
-                    filetype = match.name
-                if match.parent is None:
-                    log.info(f"Found a file of type {filetype} at byte offset {match.offset}")
-                    self._matches.append(match)
-                    yield match
-                elif isinstance(match, Submatch):
-                    log.debug(f"Found a subregion of type {filetype} at byte offset {match.offset}")
-                else:
-                    log.info(f"Found an embedded file of type {filetype} at byte offset {match.offset}")
+            for match in self._match_iterator:
+                self._matches.append(match)
+                yield match
+            self._match_iterator = None
         else:
             yield from self._matches
 
-    def magic_matches(self) -> Iterator[Match]:
-        if self._magic_matches is None or self._magic_match_iterator is not None:
-            if self._magic_matches is None:
-                self._magic_matches = []
-                self._magic_match_iterator = iter(self.matcher.identify(self.path))
+    def _match_all(self) -> Iterator[Match]:
+        return iter(self.matcher.match(
+            self.path,
+            magic_matches=self.magic_pass(only_match_mime=True),
+            embedded_magic_matches=self.embedded_magic_pass(only_match_mime=True)
+        ))
+
+    @staticmethod
+    def _top_level_matches(matches: Iterator[Match]) -> Iterator[Match]:
+        """Logs each match, yielding only the top-level ones"""
+        for match in matches:
+            if hasattr(match.match, "filetype"):
+                filetype = match.match.filetype
             else:
-                yield from self._magic_matches
-            while True:
-                try:
-                    match = next(self._magic_match_iterator)
-                    yield match
-                except StopIteration:
-                    self._magic_match_iterator = None
-                    break
-        else:
-            yield from self._magic_matches
+                filetype = match.name
+            if match.parent is None:
+                log.info(f"Found a file of type {filetype} at byte offset {match.offset}")
+                yield match
+            elif isinstance(match, Submatch):
+                log.debug(f"Found a subregion of type {filetype} at byte offset {match.offset}")
+            else:
+                log.info(f"Found an embedded file of type {filetype} at byte offset {match.offset}")
 
-    def sbud(self, matches: Optional[Iterable[Match]] = None) -> Dict[str, Any]:
-        if matches is None:
-            matches = self.matches()
+    def magic_matches(self) -> Iterator[MagicMatch]:
+        yield from self.magic_pass()
+
+    def cached_sbud(self) -> Optional[Dict[str, Any]]:
+        """Returns the SBUD for this file from the result cache, or None if it is not cached"""
+        sbud = self.cached_result("sbud")
+        if sbud is not None:
+            # the same content may have been cached under a different file name
+            sbud['fileName'] = str(self.path)
+        return sbud
+
+    def hashes(self) -> Tuple[str, str, str]:
+        """Returns the MD5, SHA1, and SHA256 hex digests of the file's contents, computed in a single chunked pass"""
         md5 = hashlib.md5()
         sha1 = hashlib.sha1()
         sha256 = hashlib.sha256()
-        with open(self.path, 'rb') as hash_file:
-            data = hash_file.read()
-            md5.update(data)
-            sha1.update(data)
-            sha256.update(data)
-            b64contents = base64.b64encode(data)
-            file_length = len(data)
-            del data
-        return {
-            'MD5': md5.hexdigest(),
-            'SHA1': sha1.hexdigest(),
-            'SHA256': sha256.hexdigest(),
-            'b64contents': b64contents.decode('utf-8'),
-            'fileName': self.path,
-            'length': file_length,
+        # reuse the data that were already loaded for matching rather than re-reading the file
+        data = self.context().data
+        for offset in range(0, len(data), HASH_CHUNK_SIZE):
+            chunk = data[offset:offset + HASH_CHUNK_SIZE]
+            md5.update(chunk)
+            sha1.update(chunk)
+            sha256.update(chunk)
+        self._content_hash = sha256.hexdigest()
+        return md5.hexdigest(), sha1.hexdigest(), self._content_hash
+
+    def sbud(self, matches: Optional[Iterable[Match]] = None) -> Dict[str, Any]:
+        """
+        Returns the SBUD for the given matches.
+
+        If `matches` is None, the SBUD is of all of the file's matches; in that case, the result cache (if any) is
+        consulted first, and the SBUD is saved to it if it was not already cached.
+
+        This materializes the entire SBUD, including the base64-encoded file contents; to output it without doing so,
+        use :meth:`Analyzer.write_sbud`.
+
+        """
+        complete = matches is None
+        if complete:
+            sbud = self.cached_sbud()
+            if sbud is not None:
+                return sbud
+            # top-level matches are yielded before their submatches have been parsed, so finish parsing them first
+            matches = list(self.matches())
+        md5, sha1, sha256 = self.hashes()
+        data = self.context().data
+        sbud = {
+            'MD5': md5,
+            'SHA1': sha1,
+            'SHA256': sha256,
+            'b64contents': base64.b64encode(data).decode('utf-8'),
+            'fileName': str(self.path),
+            'length': len(data),
             'versions': {
                 'polyfile': __version__
             },
@@ -407,3 +1365,111 @@ class Analyzer:
                 match.to_obj() for match in matches
             ]
         }
+        if complete:
+            self.cache_result("sbud", sbud)
+        return sbud
+
+    def write_sbud(
+            self,
+            output: TextIO,
+            matches: Optional[Iterable[Match]] = None,
+            include_contents: bool = True,
+            stop: Optional[Callable[[], bool]] = None
+    ) -> int:
+        """
+        Writes the same JSON as `json.dump(self.sbud(matches), output)`, but without ever materializing it.
+
+        The file is hashed and base64-encoded in chunks, and each entry of `struc` is written as soon as it has been
+        completely parsed, so memory use does not grow with the size of the file. If `include_contents` is False,
+        the `b64contents` field is omitted entirely.
+
+        If `matches` is None, the SBUD is of all of the file's matches, and the result cache (if any) is used just as
+        it is by :meth:`Analyzer.sbud`. Unless they were already computed, the matches are then not retained (see
+        :meth:`Analyzer.matches`), so each entry of `struc` is freed once it is written. If `stop` is provided, it is
+        called before each top-level match is written, and if it returns True, the SBUD of the matches written so far is
+        completed (and not cached). Likewise, if a :class:`KeyboardInterrupt` is raised while matching, the SBUD of
+        the matches so far is completed (and not cached) before it is re-raised, so the output is always valid JSON.
+
+        Returns the number of top-level matches written.
+
+        """
+        complete = matches is None
+        if complete:
+            sbud = self.cached_sbud()
+            if sbud is not None:
+                if not include_contents:
+                    del sbud['b64contents']
+                dump(sbud, output)
+                return len(sbud['struc'])
+            matches = self.matches(retain=False)
+        md5, sha1, sha256 = self.hashes()
+        if complete and include_contents and self.cache is not None:
+            # cached SBUDs must be complete, so only cache them if the contents are included
+            with self.cache.tee(self.cache_key("sbud"), output) as tee:
+                try:
+                    num_matches, stopped = self._write_sbud(tee, matches, md5, sha1, sha256, include_contents, stop)
+                except KeyboardInterrupt:
+                    tee.failed = True
+                    raise
+                if stopped:
+                    tee.failed = True
+        else:
+            num_matches, _ = self._write_sbud(output, matches, md5, sha1, sha256, include_contents, stop)
+        return num_matches
+
+    def _write_sbud(
+            self, output: TextIO, matches: Iterable[Match], md5: str, sha1: str, sha256: str, include_contents: bool,
+            stop: Optional[Callable[[], bool]] = None
+    ) -> Tuple[int, bool]:
+        """
+        Returns the number of top-level matches written, and whether `stop` stopped the writing early.
+
+        A :class:`KeyboardInterrupt` raised by `matches` is re-raised once the SBUD of the matches so far is completed.
+
+        """
+        data = self.context().data
+        output.write(dumps({'MD5': md5, 'SHA1': sha1, 'SHA256': sha256})[:-1])
+        if include_contents:
+            output.write(', "b64contents": "')
+            # the chunk size is a multiple of three, so the chunks' encodings can be concatenated without padding
+            for offset in range(0, len(data), B64_CHUNK_SIZE):
+                output.write(base64.b64encode(data[offset:offset + B64_CHUNK_SIZE]).decode('utf-8'))
+            output.write('"')
+        output.write(', ')
+        output.write(dumps({
+            'fileName': str(self.path),
+            'length': len(data),
+            'versions': {
+                'polyfile': __version__
+            }
+        })[1:-1])
+        output.write(', "struc": [')
+        # top-level matches are yielded before their submatches have been parsed, so each one is only written once
+        # the next has been yielded (or there are no more)
+        pending: Optional[Match] = None
+        num_matches = 0
+        stopped = False
+        interrupt: Optional[KeyboardInterrupt] = None
+        match_iter = iter(matches)
+        while True:
+            try:
+                match = next(match_iter, None)
+            except KeyboardInterrupt as e:
+                interrupt = e
+                stopped = True
+                match = None
+            if match is not None and stop is not None and stop():
+                stopped = True
+                match = None
+            if pending is not None:
+                pending.write_json(output)
+                num_matches += 1
+                if match is not None:
+                    output.write(", ")
+            pending = match
+            if stopped or match is None:
+                break
+        output.write("]}")
+        if interrupt is not None:
+            raise interrupt
+        return num_matches, stopped
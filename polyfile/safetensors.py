@@ -2,7 +2,7 @@ from io import BytesIO
 import json
 from typing import BinaryIO, Dict, List, Optional, Type, Union
 
-from .fileutils import FileStream
+from .fileutils import FileStream, WindowedData
 from .magic import AbsoluteOffset, FailedTest, MagicMatcher, MagicTest, MatchedTest, TestResult, TestType
 from .structs import ByteField, Endianness, Struct, StructError, StructReadError, T, UInt64
 from .structmatcher import PolyFileStruct
@@ -50,19 +50,27 @@ class SafeTensorsTest(MagicTest):
 
     def test(self, data: bytes, absolute_offset: int, parent_match: Optional[TestResult]) -> TestResult:
         # speed optimization: make sure the JSON starts with '{' before trying to decode/parse it!
-        for b in data[8:]:
-            if b == ord("{"):
-                # it looks like the start of JSON
-                break
-            elif b not in (ord(" "), ord("\t"), ord("\n"), ord("\r")):
+        # only slice out a chunk at a time, since `data` might be a memory map of a very large file
+        offset = 8
+        while True:
+            chunk = data[offset:offset + 4096]
+            if not chunk:
+                # we never found the starting "{"
+                return FailedTest(self, offset=absolute_offset, message="JSON does not start with '{'")
+            json_start = chunk.lstrip(b" \t\n\r")
+            if json_start:
+                if json_start[0] == ord("{"):
+                    # it looks like the start of JSON
+                    break
                 # this is not whitespace
                 return FailedTest(self, offset=absolute_offset, message="JSON does not start with '{'")
+            offset += len(chunk)
+        if isinstance(data, WindowedData):
+            stream = FileStream(data)
         else:
-            # we never found the starting "{"
-            return FailedTest(self, offset=absolute_offset, message="JSON does not start with '{'")
-        bstream = BytesIO(data)
-        setattr(bstream, "name", "SafetensorsBytes")
-        stream = FileStream(bstream)
+            bstream = BytesIO(data)
+            setattr(bstream, "name", "SafetensorsBytes")
+            stream = FileStream(bstream)
         try:
             _ = SafeTensorsHeader.read(stream)  # type: ignore
             return MatchedTest(self, value=data, offset=0, length=len(data))
@@ -1,6 +1,9 @@
+from array import array
 from collections import deque
 import collections.abc
-from typing import IO, Mapping, Sequence, Union
+import mmap
+import re
+from typing import Dict, IO, Iterator, List, Mapping, Optional, Pattern, Sequence, Tuple, Union
 
 from . import serialization
 
@@ -206,55 +209,206 @@ class ACNode(TrieNode):
 
 
 class MultiSequenceSearch:
-    """A datastructure for efficiently searching a sequence for multiple strings"""
+    """
+    A datastructure for efficiently searching a sequence for multiple byte strings.
+
+    The Aho-Corasick automaton is compiled into flat tables indexed by state number: the trie's edges, the fall (i.e.,
+    failure) links, and, for each state, every sequence that ends there (including those ending at states reachable
+    by its fall links). The full transition function `state × byte → state` is a single `array`, whose entries are
+    computed from the trie and the fall links the first time they are needed, so a search never has to walk the fall
+    links more than once per state and byte.
+
+    """
+    CHUNK_SIZE: int = 1024 * 1024
+    """The number of bytes of a stream or of a memory map that are searched at a time"""
+
+    MAX_SKIP_BYTES: int = 32
+    """Only skip ahead to the next byte that can start a sequence if there are at most this many such bytes"""
+
+    FORMAT_VERSION: int = 1
+
     def __init__(self, *sequences_to_find):
-        self.trie = ACNode()
-        for seq in sequences_to_find:
-            self.trie.add(seq)
-        self.trie.finalize()
+        self.sequences: List[bytes] = []
+        # the trie's edges; states are numbered in breadth-first order, and the root is state 0
+        self._children: List[Dict[int, int]] = [{}]
+        # the index of the sequence ending at each state, or -1 if there is none
+        self._ends: List[int] = [-1]
+        # the memoized transition function, which is allocated once the fall links are known
+        self._delta: array = array("i")
+        indexes: Dict[bytes, int] = {}
+        for sequence in sequences_to_find:
+            sequence = bytes(sequence)
+            if sequence in indexes:
+                continue
+            indexes[sequence] = len(self.sequences)
+            self.sequences.append(sequence)
+        # insert the sequences in breadth-first order, so that every state is numbered after its parent's fall state
+        for depth in range(max((len(sequence) for sequence in self.sequences), default=0)):
+            for index, sequence in enumerate(self.sequences):
+                if depth >= len(sequence):
+                    continue
+                state = self._state_of(sequence[:depth])
+                c = sequence[depth]
+                child = self._children[state].get(c)
+                if child is None:
+                    child = len(self._children)
+                    self._children[state][c] = child
+                    self._children.append({})
+                    self._ends.append(-1)
+                if depth == len(sequence) - 1:
+                    self._ends[child] = index
+        self._fall: array = array("i", [0]) * len(self._children)
+        for state, children in enumerate(self._children):
+            for c, child in children.items():
+                if state != 0:
+                    self._fall[child] = self._transition(self._fall[state], c)
+        self._finalize()
+
+    def _state_of(self, prefix: bytes) -> int:
+        state = 0
+        for c in prefix:
+            state = self._children[state][c]
+        return state
+
+    def _finalize(self):
+        # the sequences that end at each state, longest first
+        self._outputs: List[Optional[Tuple[bytes, ...]]] = [None] * len(self._children)
+        for state in range(1, len(self._children)):
+            inherited = self._outputs[self._fall[state]] or ()
+            if self._ends[state] >= 0:
+                self._outputs[state] = (self.sequences[self._ends[state]],) + inherited
+            elif inherited:
+                self._outputs[state] = inherited
+        self._delta = array("i", [-1]) * (len(self._children) << 8)
+        start_bytes = bytes(sorted(self._children[0].keys()))
+        if 0 < len(start_bytes) <= self.MAX_SKIP_BYTES:
+            if len(start_bytes) == 1:
+                self._start_byte: Optional[bytes] = start_bytes
+                self._start_pattern: Optional[Pattern[bytes]] = None
+            else:
+                self._start_byte = None
+                self._start_pattern = re.compile(b"[" + b"".join(re.escape(bytes((c,))) for c in start_bytes) + b"]")
+        else:
+            self._start_byte = None
+            self._start_pattern = None
+
+    def _transition(self, state: int, c: int) -> int:
+        """Computes (and memoizes) the state that follows `state` on byte `c`, following fall links as necessary"""
+        s = state
+        while True:
+            child = self._children[s].get(c)
+            if child is not None:
+                break
+            elif s == 0:
+                child = 0
+                break
+            s = self._fall[s]
+        if len(self._delta):
+            self._delta[(state << 8) | c] = child
+        return child
+
+    def __len__(self):
+        return len(self.sequences)
 
     def save(self, output_stream: IO):
-        serialization.dump(self.trie, output_stream)
+        edges = array("i")
+        for state, children in enumerate(self._children):
+            for c, child in children.items():
+                edges.extend((state, c, child))
+        serialization.dump([
+            self.FORMAT_VERSION, self.sequences, edges.tobytes(), self._fall.tobytes(), array("i", self._ends).tobytes()
+        ], output_stream)
 
     @staticmethod
-    def load(input_stream: IO):
+    def load(input_stream: IO) -> "MultiSequenceSearch":
+        version, sequences, edge_bytes, fall_bytes, end_bytes = serialization.load(input_stream)
+        if version != MultiSequenceSearch.FORMAT_VERSION:
+            raise ValueError(f"Unsupported {MultiSequenceSearch.__name__} format version {version}")
         mss = MultiSequenceSearch()
-        mss.trie = serialization.load(input_stream)
-        print(mss.trie)
-        exit(0)
+        mss.sequences = list(sequences)
+        mss._fall = array("i")
+        mss._fall.frombytes(fall_bytes)
+        ends = array("i")
+        ends.frombytes(end_bytes)
+        mss._ends = ends.tolist()
+        mss._children = [{} for _ in range(len(mss._fall))]
+        edges = array("i")
+        edges.frombytes(edge_bytes)
+        for i in range(0, len(edges), 3):
+            mss._children[edges[i]][edges[i + 1]] = edges[i + 2]
+        mss._finalize()
         return mss
 
-    def search(self, source_sequence: Union[Sequence, IO]):
-        """The Aho-Corasick Algorithm"""
-        if hasattr(source_sequence, 'read'):
-            def iterator():
-                while True:
-                    b = source_sequence.read(1)
-                    if not b:
-                        return
-                    yield b[0]
+    def _chunks(self, source_sequence: Union[Sequence, IO]) -> Iterator[bytes]:
+        if hasattr(source_sequence, "read"):
+            while True:
+                chunk = source_sequence.read(self.CHUNK_SIZE)
+                if not chunk:
+                    return
+                yield chunk
+        elif isinstance(source_sequence, (bytes, bytearray)):
+            yield source_sequence
+        elif isinstance(source_sequence, (mmap.mmap, memoryview)) or hasattr(source_sequence, "__getitem__"):
+            # e.g., a memory map, whose slices are copied, so only search a bounded amount of it at a time
+            for offset in range(0, len(source_sequence), self.CHUNK_SIZE):
+                yield bytes(source_sequence[offset:offset + self.CHUNK_SIZE])
         else:
-            def iterator():
-                return iter(source_sequence)
-
-        state = self.trie
-        for stream_offset, c in enumerate(iterator()):
-            n = state
-
-            while c not in n and n is not self.trie:
-                n = n.fall
-
-            if n is self.trie:
-                if c in n:
-                    n = n[c]
+            yield bytes(source_sequence)
+
+    def search(self, source_sequence: Union[Sequence, IO]) -> Iterator[Tuple[int, bytes]]:
+        """
+        The Aho-Corasick Algorithm
+
+        Yields (offset, sequence) pairs for every occurrence of every sequence, in increasing order of the offset at
+        which the occurrence ends (and, for occurrences ending at the same offset, from the longest to the shortest).
+
+        """
+        delta = self._delta
+        outputs = self._outputs
+        transition = self._transition
+        start_byte = self._start_byte
+        start_pattern = self._start_pattern
+        state = 0
+        base = 0
+        for chunk in self._chunks(source_sequence):
+            if start_byte is None and start_pattern is None:
+                for i, c in enumerate(chunk):
+                    next_state = delta[(state << 8) | c]
+                    if next_state < 0:
+                        next_state = transition(state, c)
+                    state = next_state
+                    out = outputs[state]
+                    if out is not None:
+                        end = base + i + 1
+                        for sequence in out:
+                            yield end - len(sequence), sequence
             else:
-                n = n[c]
-
-            state = n
-
-            while n is not self.trie:
-                yield from ((stream_offset - len(source) + 1, source) for source in n.sources)
-                n = n.fall
+                i = 0
+                n = len(chunk)
+                while i < n:
+                    if state == 0:
+                        # skip ahead to the next byte that can start a sequence
+                        if start_byte is not None:
+                            i = chunk.find(start_byte, i)
+                            if i < 0:
+                                break
+                        else:
+                            m = start_pattern.search(chunk, i)
+                            if m is None:
+                                break
+                            i = m.start()
+                    c = chunk[i]
+                    next_state = delta[(state << 8) | c]
+                    if next_state < 0:
+                        next_state = transition(state, c)
+                    state = next_state
+                    out = outputs[state]
+                    if out is not None:
+                        end = base + i + 1
+                        for sequence in out:
+                            yield end - len(sequence), sequence
+                    i += 1
+            base += len(chunk)
 
 
 class StartsWithMatcher:
@@ -307,4 +461,8 @@ if __name__ == '__main__':
     for match in swm.search(b'hacker'):
         print(match)
 
-    print(ACNode.load(mss.trie.serialize()))
+    from io import BytesIO
+    saved = BytesIO()
+    mss.save(saved)
+    saved.seek(0)
+    assert list(MultiSequenceSearch.load(saved).search(to_search)) == list(mss.search(to_search))
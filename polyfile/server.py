@@ -0,0 +1,427 @@
+"""
+A long-running analysis daemon that serves requests over a Unix domain socket.
+
+Most of the latency of a single `polyfile` invocation is start-up: loading the magic definitions and the parsers
+(along with their dependencies). `polyfile serve` pays those costs once, then forks a pool of worker processes that
+inherit the warm :class:`MagicMatcher` and registered parsers copy-on-write.
+
+The protocol is newline-delimited JSON. Each request is an object with either a `path` (which must be accessible to
+the server) or base64-encoded `data`, along with optional analysis options::
+
+    {"id": 1, "path": "/tmp/foo.pdf", "formats": ["mime", "sbud"], "parse": true, "try_all_offsets": false,
+     "filetype": ["application/*"], "timeout": 10, "budget": {"max_seconds": 5, "max_decoded_bytes": 1048576},
+     "identify_window": {"head": 1048576, "tail": 65536}, "lazy_decoding": false, "validate": false}
+
+The `budget` and `identify_window` objects have the same fields as :class:`polyfile.ParseBudget` and
+:class:`magic.IdentificationWindow`, respectively.
+
+Every request receives exactly one response: the same record that batch mode outputs (see
+:meth:`batch.BatchWorker.analyze`), plus the request's `id`. A connection may have many requests in flight at once,
+so responses are sent in the order in which they complete; the `id` is used to match them up. A request of
+`{"command": "ping"}` returns the server's version without analyzing anything.
+
+"""
+import base64
+import json
+import os
+from pathlib import Path
+from queue import Queue
+import socket
+import socketserver
+import threading
+from typing import Any, Callable, Dict, Iterable, Iterator, Optional, Tuple, Union
+
+from . import logger
+from .batch import _analyze_in_worker, _init_worker, BATCH_FORMATS, BatchOptions, pool_context, resolve_filetypes
+from .cache import ResultCache
+from .fileutils import ExactNamedTempfile
+from .magic import IdentificationWindow, MagicMatcher
+from .polyfile import __version__, load_parsers, ParseBudget
+
+
+log = logger.getStatusLogger("polyfile")
+
+
+class ServerError(Exception):
+    pass
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    server: "_UnixServer"
+
+    def handle(self):
+        # responses are written from a separate thread so a slow client can never stall the worker pool's callbacks
+        # once the client has sent all of its requests, the total number of requests is put in the queue
+        responses: "Queue[Union[int, Dict[str, Any]]]" = Queue()
+        num_requests = 0
+
+        def write_responses():
+            disconnected = False
+            num_responses = 0
+            expected_responses: Optional[int] = None
+            while expected_responses is None or num_responses < expected_responses:
+                response = responses.get()
+                if isinstance(response, int):
+                    expected_responses = response
+                    continue
+                num_responses += 1
+                if disconnected:
+                    continue
+                try:
+                    self.wfile.write(json.dumps(response).encode("utf-8"))
+                    self.wfile.write(b"\n")
+                    self.wfile.flush()
+                except OSError:
+                    # the client disconnected, but keep draining the queue
+                    disconnected = True
+
+        writer = threading.Thread(target=write_responses, daemon=True)
+        writer.start()
+        try:
+            for line in self.rfile:
+                if not line.strip():
+                    continue
+                num_requests += 1
+                self.server.analysis_server.submit(line, responses.put)
+        except OSError:
+            pass
+        finally:
+            # wait for all of this connection's requests to finish before closing it
+            responses.put(num_requests)
+            writer.join()
+
+
+if hasattr(socketserver, "ThreadingUnixStreamServer"):
+    class _UnixServer(socketserver.ThreadingUnixStreamServer):
+        daemon_threads = True
+
+        def __init__(self, socket_path: str, analysis_server: "AnalysisServer"):
+            self.analysis_server: AnalysisServer = analysis_server
+            super().__init__(socket_path, _RequestHandler)
+else:
+    _UnixServer = None  # type: ignore
+
+
+class AnalysisServer:
+    """
+    Serves analysis requests over a Unix domain socket using a pool of `jobs` worker processes.
+
+    At most `jobs + max_queue` requests are processed or queued at once; once that bound is reached, the server stops
+    reading new requests until one completes, applying backpressure to its clients.
+
+    """
+    def __init__(
+            self,
+            socket_path: str,
+            jobs: Optional[int] = None,
+            max_queue: Optional[int] = None,
+            timeout: Optional[float] = None,
+            cache: Optional[ResultCache] = None
+    ):
+        if _UnixServer is None:
+            raise ServerError("Unix domain sockets are not supported on this platform")
+        self.socket_path: str = socket_path
+        if jobs is None:
+            jobs = os.cpu_count() or 1
+        self.jobs: int = max(jobs, 1)
+        if max_queue is None:
+            max_queue = 4 * self.jobs
+        self.max_queue: int = max(max_queue, 0)
+        self.timeout: Optional[float] = timeout
+        self.cache: Optional[ResultCache] = cache
+        self._slots: threading.BoundedSemaphore = threading.BoundedSemaphore(self.jobs + self.max_queue)
+        self._pool = None
+        self._server: Optional[_UnixServer] = None
+
+    def default_options(self) -> BatchOptions:
+        if self.cache is None:
+            return BatchOptions(timeout=self.timeout)
+        return BatchOptions(timeout=self.timeout, cache_dir=str(self.cache.cache_dir),
+                            cache_max_size=self.cache.max_size)
+
+    def request_options(self, request: Dict[str, Any]) -> BatchOptions:
+        defaults = self.default_options()
+        formats = request.get("formats", ("file",))
+        if isinstance(formats, str) or not all(f in BATCH_FORMATS for f in formats):
+            raise ServerError(f"Invalid formats {formats!r}; the supported formats are {', '.join(BATCH_FORMATS)}")
+        filetypes = request.get("filetype", None)
+        if filetypes:
+            if isinstance(filetypes, str):
+                filetypes = (filetypes,)
+            mimetypes: Optional[Tuple[str, ...]] = tuple(resolve_filetypes(filetypes))
+            if not mimetypes:
+                raise ServerError(f"Filetype argument(s) {filetypes} did not match any known definitions")
+        else:
+            mimetypes = None
+        timeout = request.get("timeout", defaults.timeout)
+        if timeout is not None and not isinstance(timeout, (int, float)):
+            raise ServerError(f"Invalid timeout {timeout!r}")
+        budget = request.get("budget", None)
+        if budget is not None:
+            if not isinstance(budget, dict) or not all(
+                    value is None or (isinstance(value, (int, float)) and not isinstance(value, bool))
+                    for value in budget.values()
+            ):
+                raise ServerError(f"Invalid budget {budget!r}")
+            try:
+                budget = ParseBudget(**budget)
+            except TypeError:
+                raise ServerError(f"Invalid budget {budget!r}")
+        identify_window = request.get("identify_window", None)
+        if identify_window is not None:
+            if not isinstance(identify_window, dict) or not all(
+                    isinstance(value, int) and not isinstance(value, bool) for value in identify_window.values()
+            ):
+                raise ServerError(f"Invalid identification window {identify_window!r}")
+            try:
+                identify_window = IdentificationWindow(**identify_window)
+            except TypeError:
+                raise ServerError(f"Invalid identification window {identify_window!r}")
+        return BatchOptions(
+            formats=formats,
+            try_all_offsets=bool(request.get("try_all_offsets", False)),
+            parse=bool(request.get("parse", True)),
+            mimetypes=mimetypes,
+            timeout=timeout,
+            cache_dir=defaults.cache_dir,
+            cache_max_size=defaults.cache_max_size,
+            budget=budget,
+            identify_window=identify_window,
+            lazy_decoding=bool(request.get("lazy_decoding", False)),
+            validate=bool(request.get("validate", False))
+        )
+
+    def submit(self, line: bytes, respond: Callable[[Dict[str, Any]], None]):
+        """Parses the request and asynchronously calls `respond` with its response; `respond` is always called once"""
+        request_id = None
+        try:
+            request = json.loads(line)
+            if not isinstance(request, dict):
+                raise ServerError("Requests must be JSON objects")
+            request_id = request.get("id", None)
+            if request.get("command", None) == "ping":
+                respond({"id": request_id, "status": "ok", "version": __version__})
+                return
+            options = self.request_options(request)
+            if "path" in request:
+                path = str(request["path"])
+                tempfile: Optional[ExactNamedTempfile] = None
+            elif "data" in request:
+                name = os.path.basename(str(request.get("name", "STDIN"))) or "STDIN"
+                tempfile = ExactNamedTempfile(base64.b64decode(request["data"]), name)
+                path = tempfile.__enter__()
+            else:
+                raise ServerError("Requests must have either a `path` or `data`")
+        except (OSError, ValueError, ServerError) as e:
+            # an OSError is raised if the `name` of the data is not a valid filename
+            respond({"id": request_id, "status": "error", "error": f"Invalid request: {e!s}"})
+            return
+
+        # bound the number of requests that are queued; this blocks reading any more requests from the client
+        self._slots.acquire()
+
+        def finish(record: Dict[str, Any]):
+            self._slots.release()
+            if tempfile is not None:
+                tempfile.__exit__(None, None, None)
+                record["path"] = request.get("name", "STDIN")
+            record["id"] = request_id
+            respond(record)
+
+        def fail(e: BaseException):
+            finish({"path": path, "status": "error", "error": f"{e.__class__.__name__}: {e!s}"})
+
+        try:
+            self._pool.apply_async(_analyze_in_worker, (path, options), callback=finish, error_callback=fail)
+        except Exception as e:
+            # e.g., a ValueError if the pool is no longer running
+            fail(e)
+
+    def _remove_stale_socket(self):
+        if not os.path.exists(self.socket_path):
+            return
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+            try:
+                s.connect(self.socket_path)
+            except OSError:
+                # nothing is listening, so it is left over from a server that did not shut down cleanly
+                os.unlink(self.socket_path)
+                return
+        raise ServerError(f"Another server is already listening on {self.socket_path}")
+
+    def start(self):
+        """Loads the magic matcher, starts the worker pool, and binds the socket"""
+        # load everything before forking so that the workers all inherit it
+        _ = MagicMatcher.DEFAULT_INSTANCE.non_text_tests
+        load_parsers()
+        self._pool = pool_context().Pool(processes=self.jobs, initializer=_init_worker,
+                                         initargs=(self.default_options(),))
+        self._remove_stale_socket()
+        old_umask = os.umask(0o177)
+        try:
+            # only the user running the server may connect to it, since it can read any file that user can
+            self._server = _UnixServer(self.socket_path, self)
+        finally:
+            os.umask(old_umask)
+        log.info(f"Listening on {self.socket_path} with {self.jobs} workers")
+
+    def serve_forever(self):
+        if self._server is None:
+            self.start()
+        try:
+            self._server.serve_forever()
+        finally:
+            self.close()
+
+    def shutdown(self):
+        """Stops `serve_forever`; this must be called from a different thread"""
+        if self._server is not None:
+            self._server.shutdown()
+
+    def close(self):
+        if self._server is not None:
+            self._server.server_close()
+            self._server = None
+            try:
+                os.unlink(self.socket_path)
+            except OSError:
+                pass
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool.join()
+            self._pool = None
+
+    def __enter__(self) -> "AnalysisServer":
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class AnalysisClient:
+    """A thin client for an :class:`AnalysisServer`"""
+    def __init__(self, socket_path: str):
+        self.socket_path: str = socket_path
+        self._socket: socket.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            self._socket.connect(socket_path)
+        except OSError as e:
+            self._socket.close()
+            raise ServerError(f"Unable to connect to the PolyFile server at {socket_path}: {e!s}")
+        self._reader = self._socket.makefile("rb")
+        self._next_id: int = 0
+
+    @staticmethod
+    def request(path: Optional[str] = None, data: Optional[bytes] = None, name: Optional[str] = None,
+                **options) -> Dict[str, Any]:
+        """Returns a request for the given path or data; `options` are those supported by the server"""
+        request: Dict[str, Any] = dict(options)
+        if path is not None:
+            request["path"] = os.path.abspath(path)
+        elif data is not None:
+            request["data"] = base64.b64encode(data).decode("utf-8")
+            if name is not None:
+                request["name"] = name
+        else:
+            raise ValueError("Either a path or data must be provided")
+        return request
+
+    def send(self, request: Dict[str, Any]) -> int:
+        """Sends the request without waiting for its response; returns the request's ID"""
+        request_id = self._next_id
+        self._next_id += 1
+        self._send(request, request_id)
+        return request_id
+
+    def _send(self, request: Dict[str, Any], request_id: int):
+        request = dict(request)
+        request["id"] = request_id
+        self._socket.sendall(json.dumps(request).encode("utf-8") + b"\n")
+
+    def receive(self) -> Dict[str, Any]:
+        """Returns the next response, in the order in which the server completed them"""
+        line = self._reader.readline()
+        if not line:
+            raise ServerError(f"The PolyFile server at {self.socket_path} closed the connection")
+        return json.loads(line)
+
+    def analyze(self, path: Optional[str] = None, data: Optional[bytes] = None, **options) -> Dict[str, Any]:
+        request_id = self.send(self.request(path=path, data=data, **options))
+        while True:
+            response = self.receive()
+            if response.get("id", None) == request_id:
+                return response
+
+    def analyze_many(self, requests: Iterable[Tuple[Any, Dict[str, Any]]]) -> Iterator[Tuple[Any, Dict[str, Any]]]:
+        """
+        Pipelines many (key, request) pairs to the server, yielding (key, response) pairs as they complete.
+
+        The requests are sent from a background thread so that the server's workers are kept busy while the responses
+        are being read.
+
+        """
+        keys: Dict[int, Any] = {}
+        state = threading.Condition()
+        num_sent = 0
+        done_sending = False
+        send_error: Optional[BaseException] = None
+
+        def send_all():
+            nonlocal num_sent, done_sending, send_error
+            try:
+                for key, request in requests:
+                    with state:
+                        request_id = self._next_id
+                        self._next_id += 1
+                        keys[request_id] = key
+                    # do not hold the lock while sending, since this blocks if the server is applying backpressure
+                    self._send(request, request_id)
+                    with state:
+                        num_sent += 1
+                        state.notify()
+            except BaseException as e:
+                send_error = e
+            finally:
+                with state:
+                    done_sending = True
+                    state.notify()
+
+        sender = threading.Thread(target=send_all, daemon=True)
+        sender.start()
+        num_received = 0
+        while True:
+            with state:
+                while num_received >= num_sent and not done_sending:
+                    state.wait()
+                if num_received >= num_sent:
+                    break
+            response = self.receive()
+            num_received += 1
+            with state:
+                key = keys.pop(response.get("id", None), None)
+            yield key, response
+        sender.join()
+        if send_error is not None:
+            raise send_error
+
+    def ping(self) -> Dict[str, Any]:
+        self._socket.sendall(b'{"command": "ping"}\n')
+        return self.receive()
+
+    def close(self):
+        self._reader.close()
+        self._socket.close()
+
+    def __enter__(self) -> "AnalysisClient":
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def default_socket_path() -> Optional[Path]:
+    path = os.environ.get("POLYFILE_SERVER_SOCKET", "")
+    if path:
+        return Path(path)
+    return None
@@ -1,23 +1,23 @@
 from io import BytesIO
-from pathlib import Path
 from typing import Iterator, Optional
 from zipfile import ZipFile as PythonZip
 
-from .fileutils import ExactNamedTempfile, FileStream, Tempfile
+from .fileutils import FileStream, WindowedData
 from .logger import StatusLogger
-from .magic import AbsoluteOffset, FailedTest, MagicMatcher, MagicTest, MatchedTest, TestResult, TestType
+from .magic import (
+    AbsoluteOffset, FailedTest, MagicDefinition, MagicMatcher, MagicTest, MatchedTest, TestResult, TestType
+)
 from .polyfile import InvalidMatch, register_parser
 from .structmatcher import PolyFileStruct
 from .structs import ByteField, Constant, Endianness, StructError, UInt16, UInt32
 
 log = StatusLogger("polyfile")
 
-with ExactNamedTempfile(b"""# The default libmagic tests for detecting ZIPs assumes they start at byte offset zero
+relaxed_zip_matcher = MagicMatcher.DEFAULT_INSTANCE.add(MagicDefinition(b"""# The default libmagic tests for detecting ZIPs assumes they start at byte offset zero
 0 search \\x50\\x4b\\x05\\x06 ZIP end of central directory record
 !:mime application/zip
 !:ext zip
-""", name="RelaxedZipMatcher") as t:
-    relaxed_zip_matcher = MagicMatcher.DEFAULT_INSTANCE.add(Path(t))[0]
+""", name="RelaxedZipMatcher"))[0]
 
 
 # The default libmagic test for detecting JARs is too restrictive:
@@ -37,9 +37,13 @@ class RelaxedJarMatcher(MagicTest):
     def test(self, data: bytes, absolute_offset: int, parent_match: Optional[TestResult]) -> TestResult:
         if parent_match is None:
             return FailedTest(self, offset=absolute_offset, message="file is not a ZIP")
-        bstream = BytesIO(data)
-        setattr(bstream, "name", "RelaxedJarMatcherBytes")
-        stream = FileStream(bstream)
+        if isinstance(data, WindowedData):
+            # read the central directory lazily rather than reading the entire file
+            stream = FileStream(data)
+        else:
+            bstream = BytesIO(data)
+            setattr(bstream, "name", "RelaxedJarMatcherBytes")
+            stream = FileStream(bstream)
         stream.seek(parent_match.offset)
         try:
             eocd = EndOfCentralDirectory.read(stream)
@@ -164,20 +168,31 @@ def parse_zip(file_stream, parent):
             with file_stream.save_pos():
                 file_stream.seek(fh.start_offset)
                 zip_data = file_stream.read(eocd.start_offset + eocd.num_bytes - fh.start_offset)
-                with Tempfile(zip_data) as tmp:
-                    zf = PythonZip(tmp)
+                zf = PythonZip(BytesIO(zip_data))
         for match in fh.match(matcher=parent.matcher, parent=parent):
             is_data = False
             if match.name == "compressed_data" and match.parent.parent == parent:
+                budget = parent.matcher.budget
                 try:
-                    match.decoded = zf.read(fh.file_name.decode("utf-8"))
-                    is_data = True
+                    if budget is None or budget.max_decoded_bytes is None:
+                        match.decoded = zf.read(fh.file_name.decode("utf-8"))
+                        is_data = True
+                    else:
+                        # do not let a decompression bomb exhaust memory before its size can be checked
+                        with zf.open(fh.file_name.decode("utf-8")) as member:
+                            decoded = member.read(budget.max_decoded_bytes + 1)
+                        if len(decoded) > budget.max_decoded_bytes:
+                            match.truncated = f"exceeded the limit of {budget.max_decoded_bytes} decoded bytes"
+                            log.warning(f"Not decompressing file {fh.file_name!r} at byte offset {match.offset} "
+                                        f"because it {match.truncated}")
+                        else:
+                            match.decoded = decoded
+                            is_data = True
                 except Exception as e:
                     log.warning(f"Error decompressing file {fh.file_name!r} at byte offset {match.offset}")
             yield match
             if is_data:
-                with Tempfile(match.decoded) as tmp:
-                    yield from parent.matcher.match(tmp, parent=match)
+                yield from parent.matcher.match(match.decoded, parent=match)
     for cd in cds:
         yield from cd.match(matcher=parent.matcher, parent=parent)
     yield from eocd.match(matcher=parent.matcher, parent=parent)
@@ -31,7 +31,7 @@ setup(
         "graphviz>=0.20.1",
         "intervaltree>=2.4.0",
         "jinja2>=2.1.0",
-        "kaitaistruct~=0.10",
+        "kaitaistruct>=0.11,<1",
         "networkx>=2.6.3",
         "pdfminer.six==20220524",
         "Pillow>=5.0.0",
@@ -1,9 +1,15 @@
+from io import BytesIO
 from pathlib import Path
 from tempfile import NamedTemporaryFile
+import struct
 from unittest import TestCase
 import zipfile
 
-from polyfile.kaitai.parser import KaitaiParser, RootNode, Segment
+from kaitaistruct import EndOfStreamError, KaitaiStream, NoTerminatorFoundError
+
+from polyfile.fileutils import FileStream
+from polyfile.kaitai.parser import KaitaiParser, MappedKaitaiStream, RootNode, Segment
+from polyfile.polyfile import Match, Matcher
 
 
 class TestKaitai(TestCase):
@@ -43,3 +49,107 @@ class TestKaitai(TestCase):
         self.assertRaises(IndexError, s.__getitem__, len(s))
         self.assertRaises(ValueError, s.__getitem__, slice(0, 1, 5))
         self.assertFalse(s[20:30])
+
+    def test_zero_copy_values(self):
+        buffer = BytesIO()
+        with zipfile.ZipFile(buffer, "w") as test_zip:
+            test_zip.write(__file__)
+        data = buffer.getvalue()
+        with FileStream(data) as fs:
+            ast = KaitaiParser.load("archive/zip.ksy").parse(fs).ast
+        self.assertIsInstance(ast.raw_value, memoryview)
+        self.assertEqual(ast.raw_value, data)
+        for node in ast.dfs():
+            self.assertEqual(node.raw_value, data[node.start:node.end])
+        match = Match("application/zip", ast.raw_value, length=len(data), matcher=Matcher(parse=False))
+        self.assertIsInstance(match.match, bytes)
+        self.assertEqual(match.to_obj()["value"], str(data))
+
+    def test_stream(self):
+        buffer = BytesIO()
+        with zipfile.ZipFile(buffer, "w") as test_zip:
+            for i in range(10):
+                test_zip.writestr(f"{i}.txt", str(i))
+        data = buffer.getvalue()
+        parser = KaitaiParser.load("archive/zip.ksy")
+        expected = [(node.name, node.start, node.end) for node in parser.parse(data).ast.dfs()]
+        ast = parser.parse(data).ast
+        self.assertEqual([(node.name, node.start, node.end) for node in ast.stream()], expected)
+        # the parsed array elements were released as they were streamed
+        self.assertEqual(ast.obj.sections, [None] * len(ast.obj.sections))
+        streamed = [node.name for node in parser.parse(data).ast.stream(max_array_elements=3)]
+        self.assertIn("sections[2]", streamed)
+        self.assertNotIn("sections[3]", streamed)
+
+    def test_mapped_stream(self):
+        data = b"junk" + bytes(range(256)) + b"abc\0de\0\0ghi" + b"junk"
+        with FileStream(data, start=4, length=len(data) - 8) as fs:
+            mapped = MappedKaitaiStream(fs)
+            expected = KaitaiStream(BytesIO(data[4:-4]))
+            for io in (mapped, expected):
+                io.seek(1)
+            self.assertEqual(mapped.size(), expected.size())
+            for method in ("read_u1", "read_u2le", "read_u4be", "read_s8le", "read_f4be", "read_bits_int_be"):
+                with self.subTest(method=method):
+                    args = (3,) if method.startswith("read_bits") else ()
+                    self.assertEqual(getattr(mapped, method)(*args), getattr(expected, method)(*args))
+                    self.assertEqual(mapped.pos(), expected.pos())
+            for io in (mapped, expected):
+                io.seek(256)
+            self.assertEqual(mapped.read_bytes_term(0, False, True, True), expected.read_bytes_term(0, False, True, True))
+            self.assertEqual(mapped.read_bytes_term_multi(b"\0\0", True, False, True),
+                             expected.read_bytes_term_multi(b"\0\0", True, False, True))
+            self.assertEqual(mapped.pos(), expected.pos())
+            self.assertEqual(mapped.read_bytes_full(), expected.read_bytes_full())
+            self.assertTrue(mapped.is_eof())
+            self.assertRaises(EndOfStreamError, mapped.read_u4le)
+            self.assertRaises(NoTerminatorFoundError, mapped.read_bytes_term, 0, False, True, True)
+
+    def test_unmarked_parser(self):
+        buffer = BytesIO()
+        with zipfile.ZipFile(buffer, "w") as test_zip:
+            test_zip.write(__file__)
+        data = buffer.getvalue()
+        marked = KaitaiParser.load("archive/zip.ksy").parse(data).struct
+        parser = KaitaiParser.load("archive/zip.ksy", offsets=False)
+        self.assertFalse(parser.offsets)
+        inspector = parser.parse(data)
+        self.assertFalse(hasattr(inspector.struct, "_debug"))
+        self.assertEqual(
+            [section.section_type for section in inspector.struct.sections],
+            [section.section_type for section in marked.sections]
+        )
+        self.assertRaises(ValueError, lambda: inspector.ast)
+        self.assertTrue(parser.validate(data))
+        self.assertFalse(parser.validate(data[:-10]))
+
+    def test_unmarked_parser_imports(self):
+        # a UDP datagram in an IPv4 packet in an Ethernet frame, each of which is parsed by a separate generated parser
+        udp = struct.pack(">HHHH", 1234, 53, 8 + 5, 0) + b"hello"
+        ipv4 = struct.pack(">BBHHHBBH4s4s", 0x45, 0, 20 + len(udp), 0, 0, 64, 17, 0, bytes(4), bytes(4)) + udp
+        frame = bytes(6) + bytes(6) + struct.pack(">H", 0x0800) + ipv4
+        data = struct.pack("<IHHiIII", 0xA1B2C3D4, 2, 4, 0, 0, 65535, 1) \
+            + struct.pack("<IIII", 0, 0, len(frame), len(frame)) + frame
+        marked = KaitaiParser.load("network/pcap.ksy").parse(data).struct
+        unmarked = KaitaiParser.load("network/pcap.ksy", offsets=False).parse(data).struct
+        marked_udp = marked.packets[0].body.body.body.body
+        unmarked_udp = unmarked.packets[0].body.body.body.body
+        self.assertEqual(unmarked_udp.body, b"hello")
+        self.assertEqual(
+            (unmarked_udp.src_port, unmarked_udp.dst_port, unmarked_udp.body),
+            (marked_udp.src_port, marked_udp.dst_port, marked_udp.body)
+        )
+        # the sibling parsers were imported without their offset bookkeeping, too
+        for struct_obj in (unmarked.packets[0].body, unmarked.packets[0].body.body, unmarked_udp):
+            with self.subTest(struct=type(struct_obj).__name__):
+                self.assertFalse(hasattr(struct_obj, "_debug"))
+                self.assertNotEqual(type(struct_obj).__module__, type(marked_udp).__module__)
+
+    def test_validate_matches(self):
+        gif = bytes.fromhex("47494638396101000100800000000000ffffff21f90401000000002c00000000010001000002024401003b")
+        for data, valid in ((gif, True), (gif[:20], False)):
+            with self.subTest(valid=valid):
+                names = {match.name for match in Matcher(parse=False).match(data)}
+                self.assertIn("image/gif", names)
+                names = {match.name for match in Matcher(parse=False, validate=True).match(data)}
+                self.assertEqual("image/gif" in names, valid)
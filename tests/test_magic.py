@@ -1,10 +1,14 @@
 from pathlib import Path
+from tempfile import TemporaryDirectory
 from typing import Callable, Optional
 from unittest import TestCase
+from unittest.mock import patch
 
 # from polyfile import logger
 import polyfile.magic
-from polyfile.magic import MagicMatcher, MAGIC_DEFS
+from polyfile.fileutils import OffsetData
+from polyfile.magic import FailedTest, MagicMatcher, MagicSnapshot, MatchContext, MAGIC_DEFS, MISMATCH
+from polyfile.polyfile import Analyzer
 
 
 # logger.setLevel(logger.TRACE)
@@ -132,6 +136,94 @@ class MagicTest(TestCase):
         self.assertIn("application/x-pie-executable", matcher.mimetypes)
         self.assertIn("application/x-sharedlib", matcher.mimetypes)
 
+    def test_dispatch_index(self):
+        matcher = MagicMatcher.parse(*(d for d in MAGIC_DEFS if d.name != "der"))
+        non_text_tests = matcher.non_text_tests  # this builds the index
+        samples = (b"%PDF-1.5\n", b"PK\x03\x04\x14\x00\x00\x00", b"\x7fELF\x02\x01\x01\x00", b"#!/bin/sh\n",
+                   b"\x89PNG\r\n\x1a\n\x00\x00\x00\rIHDR", b"GIF89a\x01\x00\x01\x00", b"\x1f\x8b\x08\x00")
+        for data in samples:
+            with self.subTest(data=data):
+                context = MatchContext(data)
+                candidates = set(matcher._non_text_index.candidates(data))
+                self.assertLess(len(candidates), len(non_text_tests))
+                for test in non_text_tests:
+                    # every test that actually matches must be a candidate
+                    if any(True for _ in test.match(context)):
+                        self.assertIn(test, candidates)
+
+    def test_carving(self):
+        matcher = MagicMatcher.parse(*(d for d in MAGIC_DEFS if d.name != "der"))
+        png = b"\x89PNG\r\n\x1a\n\x00\x00\x00\rIHDR\x00\x00\x00\x01\x00\x00\x00\x01\x08\x02\x00\x00\x00"
+        data = b"hello, world!\n" * 10 + png + b"\n" * 10 + b"%PDF-1.5\n"
+        embedded = {offset: set(match.mimetypes) for offset, match in matcher.carve(data)}
+        self.assertIn("image/png", embedded.get(140, ()))
+        self.assertIn("application/pdf", embedded.get(140 + len(png) + 10, ()))
+        self.assertNotIn(0, embedded)
+
+    def test_carving_does_not_copy(self):
+        context = MatchContext(b"\x00" * 100 + b"GIF89a")
+        embedded = context[100:]
+        self.assertIsInstance(embedded.data, OffsetData)
+        self.assertIs(embedded.data.data, context.data)
+        self.assertEqual(embedded[3:].data[:3], b"89a")
+        self.assertIs(embedded[3:].data.data, context.data)
+
+    def test_carving_unsupported_tests(self):
+        cups_def = next(d for d in MAGIC_DEFS if d.name == "cups")
+        matcher = MagicMatcher.parse(cups_def)
+        # the big endian CUPS raster test uses a named test with flipped endianness, which is not yet supported
+        data = b"\x00" * 100 + b"RaS3" + b"\x00" * 500 + b"3SaR" + b"\x00" * 500
+        embedded = {offset: set(match.mimetypes) for offset, match in matcher.carve(data)}
+        self.assertNotIn(100, embedded)
+        self.assertIn("application/vnd.cups-raster", embedded.get(604, ()))
+
+    def test_snapshot(self):
+        def_files = [d for d in MAGIC_DEFS if d.name != "der"]
+        matcher = MagicMatcher.parse(*def_files)
+        with TemporaryDirectory() as cache_dir:
+            snapshot = MagicSnapshot(def_files, cache_dir=Path(cache_dir))
+            self.assertIsNone(snapshot.load())
+            self.assertTrue(snapshot.save(matcher))
+            loaded = snapshot.load()
+            self.assertIsNotNone(loaded)
+            self.assertEqual(set(matcher.mimetypes), set(loaded.mimetypes))
+            self.assertEqual(set(matcher.extensions), set(loaded.extensions))
+            self.assertEqual(len(matcher.named_tests), len(loaded.named_tests))
+            for data in (b"%PDF-1.5\n", b"PK\x03\x04\x14\x00\x00\x00", b"\x7fELF\x02\x01\x01", b"#!/bin/sh\n"):
+                self.assertEqual([str(m) for m in matcher.match(data)], [str(m) for m in loaded.match(data)])
+            # a different set of definition files must not share the same snapshot
+            self.assertNotEqual(
+                snapshot.fingerprint, MagicSnapshot(def_files[:-1], cache_dir=Path(cache_dir)).fingerprint
+            )
+
+    def test_failures_are_only_explained_on_demand(self):
+        test = next(
+            t for t in MagicMatcher.DEFAULT_INSTANCE.non_text_tests
+            if t.magic_prefix() is not None and t.magic_prefix()[0] == 0 and t.magic_prefix()[1][0] != 0xFF
+        )
+        data = b"\xFF" * 64
+        self.assertIs(test.test(data, 0, None), MISMATCH)
+        with patch.object(polyfile.magic.MagicTest, "explain_failures", True):
+            result = test.test(data, 0, None)
+        self.assertIsInstance(result, FailedTest)
+        self.assertIsNot(result, MISMATCH)
+        self.assertTrue(result.message.startswith("expected"))
+
+    def test_analyzer_single_pass(self):
+        matcher = MagicMatcher.DEFAULT_INSTANCE
+        with TemporaryDirectory() as tmpdir:
+            path = Path(tmpdir) / "test.pdf"
+            path.write_bytes(b"%PDF-1.5\n%%EOF\n")
+            analyzer = Analyzer(path, parse=False, magic_matcher=matcher)
+            with patch.object(matcher, "match", wraps=matcher.match) as match:
+                magic_matches = [str(m) for m in analyzer.magic_matches()]
+                self.assertEqual(magic_matches, [str(m) for m in analyzer.magic_matches()])
+                self.assertIn("application/pdf", {mimetype for mimetype, _ in analyzer.mime_types()})
+                self.assertEqual(len(list(analyzer.matches())), 1)
+                self.assertIn("application/pdf", {mimetype for mimetype, _ in analyzer.mime_types()})
+                # one pass for the full match and one for the MIME-only match, shared by all of the outputs
+                self.assertEqual(match.call_count, 2)
+
     def test_file_corpus(self):
         self.assertTrue(FILE_TEST_DIR.exists(), "Make sure to run `git submodule init && git submodule update` in the "
                                                 "root of this repository.")
@@ -0,0 +1,49 @@
+"""Small sample files, and a test case with a temporary directory, that are shared by the unit tests"""
+
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from typing import Iterable, List
+from unittest import TestCase
+import zlib
+
+
+PDF = b"%PDF-1.5\n1 0 obj\n<< /Type /Catalog >>\nendobj\ntrailer\n<< /Root 1 0 R >>\n%%EOF\n"
+GIF = bytes.fromhex(
+    "47494638396101000100800000000000ffffff21f90401000000002c00000000010001000002024401003b"
+)
+
+
+def pdf_with_stream(content: bytes) -> bytes:
+    """Returns a PDF with a FlateDecode stream of the given content"""
+    compressed = zlib.compress(content)
+    return b"%%PDF-1.5\n1 0 obj\n<< /Type /Catalog >>\nendobj\n2 0 obj\n<< /Length %d /Filter /FlateDecode >>\n" \
+           b"stream\n%s\nendstream\nendobj\ntrailer\n<< /Root 1 0 R >>\n%%%%EOF\n" % (len(compressed), compressed)
+
+
+def make_pdf(streams: Iterable[bytes]) -> bytes:
+    """Returns a PDF, with a cross-reference table, with a FlateDecode stream object for each of the given contents"""
+    objects = [b"<< /Type /Catalog /Pages 2 0 R >>", b"<< /Type /Pages /Kids [] /Count 0 >>"]
+    for content in streams:
+        compressed = zlib.compress(content)
+        objects.append(b"<< /Length %d /Filter /FlateDecode >>\nstream\n%s\nendstream" % (len(compressed), compressed))
+    pdf = bytearray(b"%PDF-1.5\n")
+    offsets: List[int] = []
+    for objid, body in enumerate(objects, start=1):
+        offsets.append(len(pdf))
+        pdf += b"%d 0 obj\n%s\nendobj\n" % (objid, body)
+    xref_offset = len(pdf)
+    pdf += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    for offset in offsets:
+        pdf += b"%010d 00000 n \n" % offset
+    pdf += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref_offset)
+    return bytes(pdf)
+
+
+class TemporaryDirectoryTestCase(TestCase):
+    """A test case with a temporary directory, `self.tmpdir`, that is removed after each test"""
+    def setUp(self):
+        self._tmpdir = TemporaryDirectory()
+        self.tmpdir = Path(self._tmpdir.name)
+
+    def tearDown(self):
+        self._tmpdir.cleanup()
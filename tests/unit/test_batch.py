@@ -0,0 +1,72 @@
+from io import StringIO
+import json
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from time import perf_counter
+from unittest import TestCase
+from unittest.mock import patch
+
+from polyfile.batch import analyze_batch, BatchOptions, BatchWorker, iter_paths, iter_stdin_paths, write_batch
+from polyfile.polyfile import load_parsers, ParserFunctionWrapper, PARSERS
+
+
+class BatchTest(TestCase):
+    def test_iter_paths(self):
+        with TemporaryDirectory() as tmpdir:
+            root = Path(tmpdir)
+            (root / "b").mkdir()
+            (root / "b" / "c.txt").write_text("c")
+            (root / "a.txt").write_text("a")
+            self.assertEqual(
+                list(iter_paths([tmpdir, "missing"])),
+                [str(root / "a.txt"), str(root / "b" / "c.txt"), "missing"]
+            )
+        self.assertEqual(list(iter_stdin_paths(StringIO("a\n\nb c\r\n"))), ["a", "b c"])
+
+    def test_analyze_batch(self):
+        with TemporaryDirectory() as tmpdir:
+            pdf = Path(tmpdir) / "test.pdf"
+            pdf.write_bytes(b"%PDF-1.5\n%%EOF\n")
+            missing = str(Path(tmpdir) / "missing")
+            options = BatchOptions(formats=("mime", "file"), parse=False)
+            for jobs in (1, 2):
+                with self.subTest(jobs=jobs):
+                    records = {
+                        record["path"]: record for record in analyze_batch([str(pdf), missing], options, jobs=jobs)
+                    }
+                    self.assertEqual(records[str(pdf)]["status"], "ok")
+                    self.assertIn("application/pdf", records[str(pdf)]["mime"])
+                    self.assertTrue(records[str(pdf)]["file"])
+                    # failures are reported in the stream rather than aborting the batch
+                    self.assertEqual(records[missing]["status"], "error")
+                    self.assertNotIn("mime", records[missing])
+
+    def test_write_batch(self):
+        with TemporaryDirectory() as tmpdir:
+            (Path(tmpdir) / "test.pdf").write_bytes(b"%PDF-1.5\n%%EOF\n")
+            output = StringIO()
+            num_files, num_failures = write_batch([tmpdir], BatchOptions(formats=("sbud",), parse=False), output,
+                                                  jobs=1)
+            self.assertEqual((num_files, num_failures), (1, 0))
+            records = [json.loads(line) for line in output.getvalue().splitlines()]
+            self.assertEqual(len(records), 1)
+            self.assertEqual(records[0]["sbud"]["fileName"], records[0]["path"])
+
+    def test_timeout(self):
+        def slow_parser(file_stream, parent):
+            deadline = perf_counter() + 3.0
+            while perf_counter() < deadline:
+                pass
+            yield from ()
+
+        with TemporaryDirectory() as tmpdir:
+            pdf = Path(tmpdir) / "test.pdf"
+            pdf.write_bytes(b"%PDF-1.5\n%%EOF\n")
+            # register all of the parsers first, so that none are registered (and then discarded) while patched
+            load_parsers()
+            with patch.dict(PARSERS, {"application/pdf": {ParserFunctionWrapper(slow_parser)}}):
+                record = BatchWorker(BatchOptions(formats=("sbud",), timeout=0.5)).analyze(str(pdf))
+        # the timeout must not be swallowed by the handler for parser exceptions
+        self.assertEqual(record["status"], "timeout")
+        self.assertNotIn("sbud", record)
+        self.assertLess(record["elapsed"], 2.5)
@@ -0,0 +1,110 @@
+from io import BytesIO
+import struct
+from typing import Dict, Iterator, List
+from unittest.mock import patch
+import zipfile
+import zlib
+
+from polyfile import pdf
+from polyfile.polyfile import Analyzer, load_parsers, ParserFunctionWrapper, PARSERS, ParseBudget
+
+from .fixtures import PDF, pdf_with_stream, TemporaryDirectoryTestCase
+
+
+def all_nodes(obj: dict) -> Iterator[dict]:
+    stack = list(obj["struc"])
+    while stack:
+        node = stack.pop()
+        yield node
+        stack.extend(node["subEls"])
+
+
+def truncated(obj: dict) -> Dict[str, str]:
+    """Returns a mapping of the types of the truncated nodes in the SBUD to the reasons they were truncated"""
+    return {node["type"]: node["truncated"] for node in all_nodes(obj) if "truncated" in node}
+
+
+class ParseBudgetTest(TemporaryDirectoryTestCase):
+    def setUp(self):
+        super().setUp()
+        self.zip_path = self.tmpdir / "test.zip"
+        data = BytesIO()
+        with zipfile.ZipFile(data, "w", zipfile.ZIP_DEFLATED) as zf:
+            zf.writestr("zeros.bin", b"\0" * 1000000)
+            zf.writestr("test.pdf", PDF)
+        self.zip_path.write_bytes(data.getvalue())
+
+    def test_unlimited(self):
+        self.assertEqual(truncated(Analyzer(self.zip_path, budget=ParseBudget()).sbud()), {})
+
+    def test_max_submatches(self):
+        sbud = Analyzer(self.zip_path, budget=ParseBudget(max_submatches=5)).sbud()
+        self.assertIn("5 submatches", truncated(sbud)["application/zip"])
+        # the submatches produced before the parser was stopped are kept
+        self.assertEqual(len(sbud["struc"][0]["subEls"]), 1)
+
+    def test_max_decoded_bytes(self):
+        sbud = Analyzer(self.zip_path, budget=ParseBudget(max_decoded_bytes=1000)).sbud()
+        self.assertIn("1000 decoded bytes", truncated(sbud)["compressed_data"])
+        # the small PDF is still decompressed and parsed
+        self.assertIn("application/pdf", {m["type"] for m in all_nodes(sbud)})
+
+    def test_max_depth(self):
+        sbud = Analyzer(self.zip_path, budget=ParseBudget(max_depth=0)).sbud()
+        self.assertIn("0 nested files", truncated(sbud)["compressed_data"])
+        self.assertNotIn("application/pdf", {m["type"] for m in all_nodes(sbud)})
+
+
+    def test_max_array_elements(self):
+        pcap_path = self.tmpdir / "test.pcap"
+        pcap_path.write_bytes(struct.pack("<IHHiIII", 0xa1b2c3d4, 2, 4, 0, 0, 65535, 147) + b"".join(
+            struct.pack("<IIII", i, 0, 4, 4) + b"data" for i in range(100)
+        ))
+        sbud = Analyzer(pcap_path, budget=ParseBudget(max_array_elements=10)).sbud()
+        self.assertIn("10 array elements", truncated(sbud)["packets"])
+        packets = next(node for node in all_nodes(sbud) if node["type"] == "packets")
+        self.assertEqual(len(packets["subEls"]), 10)
+
+    def test_pdf_decompression_bomb(self):
+        pdf_path = self.tmpdir / "bomb.pdf"
+        pdf_path.write_bytes(pdf_with_stream(b"\0" * 16 * 1024 * 1024))
+        inflated: List[int] = []
+
+        def counting_inflate(*args, **kwargs) -> bytes:
+            result = inflate(*args, **kwargs)
+            inflated.append(len(result))
+            return result
+
+        inflate = pdf.inflate
+        with patch("polyfile.pdf.inflate", counting_inflate):
+            sbud = Analyzer(pdf_path, budget=ParseBudget(max_decoded_bytes=100000)).sbud()
+        self.assertIn("100000 decoded bytes", truncated(sbud)["PDFObject"])
+        self.assertNotIn("DecodedStream", {node["type"] for node in all_nodes(sbud)})
+        # the stream was never fully inflated
+        self.assertTrue(inflated)
+        self.assertLessEqual(max(inflated), 100000 + pdf.INFLATE_CHUNK_SIZE)
+        # the rest of the PDF is still parsed
+        self.assertIn("Trailer", {node["type"] for node in all_nodes(sbud)})
+
+    def test_deadline_within_parser(self):
+        def stuck_parser(file_stream, parent):
+            while True:
+                parent.matcher.check_deadline(parent)
+            yield
+
+        pdf_path = self.tmpdir / "test.pdf"
+        pdf_path.write_bytes(PDF)
+        # register all of the parsers first, so that none are registered (and then discarded) while patched
+        load_parsers()
+        with patch.dict(PARSERS, {"application/pdf": {ParserFunctionWrapper(stuck_parser)}}):
+            sbud = Analyzer(pdf_path, budget=ParseBudget(max_seconds=0.2)).sbud()
+        self.assertIn("time limit of 0.2 seconds", truncated(sbud)["application/pdf"])
+
+    def test_inflate(self):
+        data = bytes(range(256)) * 10000
+        compressed = zlib.compress(data)
+        self.assertEqual(pdf.inflate(compressed), data)
+        self.assertEqual(pdf.inflate(compressed + b"trailing garbage"), data)
+        self.assertLessEqual(len(pdf.inflate(compressed, max_length=1000)), pdf.INFLATE_CHUNK_SIZE)
+        with self.assertRaises(zlib.error):
+            pdf.inflate(compressed[:-10])
@@ -0,0 +1,61 @@
+import os
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+from unittest.mock import patch
+
+from polyfile.cache import ResultCache
+from polyfile.polyfile import Analyzer
+
+
+class ResultCacheTest(TestCase):
+    def test_get_put(self):
+        with TemporaryDirectory() as cache_dir:
+            cache = ResultCache(cache_dir)
+            key = ResultCache.key("0" * 64, "mime", parse=True)
+            self.assertNotEqual(key, ResultCache.key("0" * 64, "mime", parse=False))
+            self.assertNotEqual(key, ResultCache.key("0" * 64, "sbud", parse=True))
+            self.assertIsNone(cache.get(key))
+            self.assertTrue(cache.put(key, [["application/pdf", "PDF document"]]))
+            self.assertEqual(cache.get(key), [["application/pdf", "PDF document"]])
+            self.assertEqual(len(cache), 1)
+            # corrupt entries are treated as cache misses
+            cache.path(key).write_text("{")
+            self.assertIsNone(cache.get(key))
+
+    def test_lru_eviction(self):
+        with TemporaryDirectory() as cache_dir:
+            cache = ResultCache(cache_dir, max_size=250)
+            keys = [ResultCache.key(str(i), "file") for i in range(3)]
+            for i, key in enumerate(keys):
+                self.assertTrue(cache.put(key, "x" * 100))
+                os.utime(cache.path(key), ns=(i * 1_000_000_000, i * 1_000_000_000))
+            # the first two entries fit, so the third evicted the least recently used one
+            self.assertIsNone(cache.get(keys[0]))
+            # accessing an entry makes it the most recently used
+            self.assertIsNotNone(cache.get(keys[1]))
+            self.assertTrue(cache.put(ResultCache.key("3", "file"), "x" * 100))
+            self.assertIsNone(cache.get(keys[2]))
+            self.assertIsNotNone(cache.get(keys[1]))
+            self.assertLessEqual(cache.size(), cache.max_size)
+
+    def test_analyzer_cache(self):
+        with TemporaryDirectory() as tmpdir:
+            cache = ResultCache(Path(tmpdir) / "cache")
+            pdf = Path(tmpdir) / "test.pdf"
+            pdf.write_bytes(b"%PDF-1.5\n%%EOF\n")
+            copy = Path(tmpdir) / "copy.pdf"
+            copy.write_bytes(pdf.read_bytes())
+            analyzer = Analyzer(str(pdf), parse=False, cache=cache)
+            mime_types = list(analyzer.mime_type_descriptions())
+            self.assertIn("application/pdf", {mimetype for mimetype, _ in mime_types})
+            sbud = analyzer.sbud()
+            # the same content at a different path must be served from the cache without running any matching
+            analyzer = Analyzer(str(copy), parse=False, cache=cache)
+            with patch.object(Analyzer, "magic_pass", side_effect=AssertionError("the cache was not used")):
+                self.assertEqual(list(analyzer.mime_type_descriptions()), mime_types)
+                cached_sbud = analyzer.sbud()
+            self.assertEqual(cached_sbud["fileName"], str(copy))
+            self.assertEqual(cached_sbud["struc"], sbud["struc"])
+            # different options must not share results
+            self.assertIsNone(Analyzer(str(copy), parse=True, cache=cache).cached_sbud())
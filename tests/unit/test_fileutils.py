@@ -0,0 +1,43 @@
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+
+from polyfile.fileutils import FileStream
+
+
+DATA = bytes(range(256)) * 4096
+
+
+class FileStreamTest(TestCase):
+    def test_views_have_independent_positions(self):
+        with FileStream(DATA) as fs:
+            view = fs[10:20]
+            self.assertEqual(len(view), 10)
+            self.assertEqual(view.offset(), 10)
+            fs.seek(100)
+            self.assertEqual(view.read(), DATA[10:20])
+            self.assertEqual(fs.tell(), 100)
+            self.assertEqual(fs.read(2), DATA[100:102])
+            self.assertEqual(len(fs[-5:-1]), 4)
+            self.assertEqual(fs[-5:-1].content, DATA[-5:-1])
+            self.assertEqual(view[2:4].content, DATA[12:14])
+            self.assertEqual(view.first_index_of(DATA[15:17]), 5)
+            self.assertEqual(view.first_index_of(DATA[25:27]), -1)
+
+    def test_concurrent_reads(self):
+        with TemporaryDirectory() as tmpdir:
+            path = Path(tmpdir) / "data.bin"
+            path.write_bytes(DATA)
+            with FileStream(path) as fs:
+                def read_view(offset: int) -> bytes:
+                    view = fs[offset:offset + 4096]
+                    return b"".join(iter(lambda: view.read(7), b""))
+
+                offsets = list(range(0, len(DATA), 1024))
+                with ThreadPoolExecutor(max_workers=8) as pool:
+                    results = list(pool.map(read_view, offsets))
+                for offset, result in zip(offsets, results):
+                    self.assertEqual(result, DATA[offset:offset + 4096])
+                self.assertTrue(fs.contains_all(DATA[:3], DATA[-3:]))
+                self.assertEqual(fs.buffer()[:len(DATA)], DATA)
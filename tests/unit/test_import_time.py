@@ -0,0 +1,42 @@
+import json
+import os
+import subprocess
+import sys
+from unittest import skipUnless, TestCase
+
+
+# the third party libraries that are only needed once a particular parser or test actually runs
+DEFERRED_MODULES = ("PIL", "pdfminer", "fickling", "chardet", "jinja2", "abnf", "urllib.request")
+MAX_MODULES = 300
+# wall clock time depends too much on the machine to check by default, so that check is opt-in, e.g., for benchmarking
+MAX_IMPORT_SECONDS = os.environ.get("POLYFILE_MAX_IMPORT_SECONDS", None)
+
+IMPORT_SCRIPT = f"""
+import json, sys, time
+start = time.perf_counter()
+import polyfile
+print(json.dumps({{
+    "seconds": time.perf_counter() - start,
+    "modules": len(sys.modules),
+    "deferred": [module for module in {DEFERRED_MODULES!r} if module in sys.modules]
+}}))
+"""
+
+
+def cold_import() -> dict:
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(sys.path)
+    result = subprocess.run([sys.executable, "-c", IMPORT_SCRIPT], env=env, stdout=subprocess.PIPE, check=True)
+    return json.loads(result.stdout)
+
+
+class ImportTimeTest(TestCase):
+    def test_import_budget(self):
+        result = cold_import()
+        self.assertEqual(result["deferred"], [])
+        self.assertLessEqual(result["modules"], MAX_MODULES)
+
+    @skipUnless(MAX_IMPORT_SECONDS, "set POLYFILE_MAX_IMPORT_SECONDS to check the import time")
+    def test_import_seconds(self):
+        # take the best of a few runs so that a momentarily busy machine does not cause a spurious failure
+        self.assertLessEqual(min(cold_import()["seconds"] for _ in range(3)), float(MAX_IMPORT_SECONDS))
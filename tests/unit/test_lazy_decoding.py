@@ -0,0 +1,63 @@
+from typing import Iterable, Iterator
+
+from polyfile.polyfile import Analyzer, Match, Matcher, ParseBudget
+
+from .fixtures import make_pdf, TemporaryDirectoryTestCase
+
+
+def find(matches: Iterable[Match], name: str) -> Iterator[Match]:
+    for match in matches:
+        if match.name == name:
+            yield match
+        yield from find(match.children, name)
+
+
+class LazyDecodingTest(TemporaryDirectoryTestCase):
+    STREAMS = (b"hello world " * 100, b"%PDF-1.5\n%%EOF\n")
+
+    def setUp(self):
+        super().setUp()
+        self.pdf_path = self.tmpdir / "test.pdf"
+        self.pdf_path.write_bytes(make_pdf(self.STREAMS))
+
+    def test_decoded_on_demand(self):
+        calls = []
+
+        def decode():
+            calls.append(None)
+            return b"decoded"
+
+        match = Match("root", None, matcher=Matcher(parse=False), decoded=decode)
+        self.assertFalse(calls)
+        self.assertEqual(match.decoded, b"decoded")
+        self.assertEqual(match.to_obj()["decoded"], "ZGVjb2RlZA==")
+        self.assertEqual(len(calls), 1)
+
+    def test_lazy_pdf_streams(self):
+        eager = list(Analyzer(self.pdf_path).matches())
+        lazy = list(Analyzer(self.pdf_path, lazy_decoding=True).matches())
+        self.assertEqual(
+            [(m.offset, m.length) for m in find(lazy, "PDFObject")],
+            [(m.offset, m.length) for m in find(eager, "PDFObject")]
+        )
+        self.assertTrue(any(True for _ in find(eager, "DecodedStream")))
+        self.assertFalse(any(True for _ in find(lazy, "DecodedStream")))
+        streams = list(find(lazy, "PDFStream"))
+        self.assertEqual(len(streams), len(self.STREAMS))
+        self.assertTrue(all(callable(stream._decoded) for stream in streams))
+        self.assertEqual([stream.decoded for stream in streams], list(self.STREAMS))
+
+    def test_lazy_streams_are_not_budgeted(self):
+        budget = ParseBudget(max_decoded_bytes=100)
+        self.assertIsNone(list(Analyzer(self.pdf_path, budget=budget, lazy_decoding=True).matches())[0].truncated)
+
+    def test_lazy_streams_are_limited(self):
+        budget = ParseBudget(max_decoded_bytes=1000)
+        matches = list(Analyzer(self.pdf_path, budget=budget, lazy_decoding=True).matches())
+        streams = list(find(matches, "PDFStream"))
+        # the limit is still enforced when the streams are decoded after their parser has finished
+        obj = streams[0].to_obj()
+        self.assertNotIn("decoded", obj)
+        self.assertIn("1000 decoded bytes", obj["truncated"])
+        self.assertEqual(streams[1].decoded, self.STREAMS[1])
+        self.assertIsNone(streams[1].truncated)
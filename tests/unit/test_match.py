@@ -0,0 +1,154 @@
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from io import StringIO
+import json
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+
+from polyfile.batch import pool_context
+from polyfile.cache import ResultCache
+from polyfile.fileutils import FileStream
+from polyfile.magic import MagicDefinition, MagicMatcher, MatchContext
+from polyfile.polyfile import Analyzer, LazyParser, Match, Matcher, Parser, Submatch
+
+
+class RejectingParser(Parser):
+    def validate(self, stream: FileStream) -> bool:
+        return False
+
+    def parse(self, stream: FileStream, match: Match):
+        yield from ()
+
+
+REJECTING_PARSER = RejectingParser()
+
+
+class MatchTest(TestCase):
+    def test_offsets_and_lengths(self):
+        root = Match("application/pdf", None, 5, matcher=Matcher(parse=False))
+        child = Submatch("child", None, 10, parent=root)
+        grandchild = Submatch("grandchild", None, 2, length=4, parent=child)
+        self.assertEqual(child.offset, 15)
+        self.assertEqual(grandchild.offset, 17)
+        self.assertEqual(grandchild.root_offset, 12)
+        self.assertIs(grandchild.root, root)
+        # lengths without an explicit value are extended as descendants are added
+        self.assertEqual(child.length, 6)
+        self.assertEqual(root.length, 16)
+        Submatch("late", None, 20, length=1, parent=child)
+        self.assertEqual(child.length, 21)
+        self.assertEqual(root.length, 31)
+        obj = root.to_obj()
+        self.assertEqual(obj["size"], 31)
+        self.assertEqual(obj["extension"], "pdf")
+        self.assertEqual(obj["subEls"][0]["subEls"][0]["offset"], 17)
+
+    def test_slots(self):
+        match = Match("application/pdf", None, matcher=Matcher(parse=False))
+        with self.assertRaises(AttributeError):
+            match.unknown_attribute = True
+        match.extension = "ai"
+        self.assertEqual(match.extension, "ai")
+
+    def test_lazy_parser_validate(self):
+        parser = LazyParser(__name__, "REJECTING_PARSER")
+        with FileStream(b"data") as stream:
+            self.assertFalse(parser.validate(stream))
+
+
+class StreamingSBUDTest(TestCase):
+    def test_write_sbud(self):
+        with TemporaryDirectory() as tmpdir:
+            pdf = Path(tmpdir) / "test.pdf"
+            pdf.write_bytes(b"%PDF-1.5\n1 0 obj\n<< /Type /Catalog >>\nendobj\ntrailer\n<< /Root 1 0 R >>\n%%EOF\n")
+            expected = Analyzer(pdf).sbud()
+            self.assertTrue(expected["struc"])
+            output = StringIO()
+            analyzer = Analyzer(pdf)
+            self.assertEqual(analyzer.write_sbud(output), len(expected["struc"]))
+            self.assertEqual(json.loads(output.getvalue()), expected)
+            # the matches were streamed to the output without being retained
+            self.assertIsNone(analyzer.matches_so_far)
+            output = StringIO()
+            Analyzer(pdf).write_sbud(output, include_contents=False)
+            del expected["b64contents"]
+            self.assertEqual(json.loads(output.getvalue()), expected)
+
+    def test_write_sbud_to_cache(self):
+        with TemporaryDirectory() as tmpdir:
+            pdf = Path(tmpdir) / "test.pdf"
+            pdf.write_bytes(b"%PDF-1.5\n%%EOF\n")
+            cache = ResultCache(Path(tmpdir) / "cache")
+            output = StringIO()
+            # partial results are not cached
+            self.assertEqual(Analyzer(pdf, cache=cache).write_sbud(output, stop=lambda: True), 0)
+            self.assertEqual(json.loads(output.getvalue())["struc"], [])
+            self.assertEqual(len(cache), 0)
+            output = StringIO()
+            Analyzer(pdf, cache=cache).write_sbud(output)
+            self.assertEqual(len(cache), 1)
+            self.assertEqual(Analyzer(pdf, cache=cache).cached_sbud(), json.loads(output.getvalue()))
+
+    def test_write_sbud_interrupted(self):
+        with TemporaryDirectory() as tmpdir:
+            pdf = Path(tmpdir) / "test.pdf"
+            pdf.write_bytes(b"%PDF-1.5\n%%EOF\n")
+            cache = ResultCache(Path(tmpdir) / "cache")
+            analyzer = Analyzer(pdf, cache=cache)
+            expected = Analyzer(pdf).sbud()["struc"][:1]
+            self.assertTrue(expected)
+            matches = analyzer.matches
+
+            def interrupted_matches(retain: bool = True):
+                for match in matches(retain=retain):
+                    yield match
+                    raise KeyboardInterrupt()
+
+            analyzer.matches = interrupted_matches
+            output = StringIO()
+            with self.assertRaises(KeyboardInterrupt):
+                analyzer.write_sbud(output)
+            # the matches so far are still written as a complete document, but it is not cached
+            self.assertEqual(json.loads(output.getvalue())["struc"], expected)
+            self.assertEqual(len(cache), 0)
+
+
+class InMemoryTest(TestCase):
+    def test_magic_definition(self):
+        matcher = MagicMatcher.parse(MagicDefinition(b"0\tstring\tPOLYTEST\tPolyFile test data\n"
+                                                     b"!:mime\tapplication/x-polyfile-test\n", name="test"))
+        context = MatchContext(b"POLYTEST with some trailing data", only_match_mime=True)
+        mimetypes = {mimetype for result in matcher.match(context) for mimetype in result.mimetypes}
+        self.assertEqual(mimetypes, {"application/x-polyfile-test"})
+
+    def test_match_bytes(self):
+        pdf = b"%PDF-1.5\n1 0 obj\n<< /Type /Catalog >>\nendobj\ntrailer\n<< /Root 1 0 R >>\n%%EOF\n"
+        matches = list(Matcher().match(pdf))
+        self.assertIn("application/pdf", {m.name for m in matches if m.parent is None})
+        self.assertTrue(any(m.parent is not None for m in matches))
+
+
+class ConcurrentParsingTest(TestCase):
+    def assert_same_structure(self, expected: dict, actual: dict):
+        # in a process pool, values are reconstructed from their string representations, which may include addresses
+        for obj in (expected, actual):
+            stack = [obj]
+            while stack:
+                node = stack.pop()
+                node.pop("value", None)
+                stack.extend(node["subEls"])
+        self.assertEqual(expected, actual)
+
+    def test_executors(self):
+        with TemporaryDirectory() as tmpdir:
+            pdf = Path(tmpdir) / "test.pdf"
+            pdf.write_bytes(b"%PDF-1.5\n1 0 obj\n<< /Type /Catalog >>\nendobj\ntrailer\n<< /Root 1 0 R >>\n%%EOF\n")
+            expected = [m.to_obj() for m in list(Analyzer(pdf).matches()) if m.parent is None]
+            self.assertTrue(expected[0]["subEls"])
+            with ThreadPoolExecutor(max_workers=2) as executor:
+                matches = list(Analyzer(pdf, executor=executor).matches())
+            self.assertEqual([m.to_obj() for m in matches if m.parent is None], expected)
+            with ProcessPoolExecutor(max_workers=2, mp_context=pool_context()) as executor:
+                matches = list(Analyzer(pdf, executor=executor).matches())
+            for obj, expected_obj in zip((m.to_obj() for m in matches if m.parent is None), expected):
+                self.assert_same_structure(expected_obj, obj)
@@ -0,0 +1,117 @@
+from io import BytesIO
+from pathlib import Path
+import struct
+from tempfile import TemporaryDirectory
+from typing import List
+from unittest import TestCase
+import zipfile
+
+from polyfile.polyfile import Analyzer, detach, DetachedMatch, Match, Matcher, PayloadMemo, Submatch
+
+from .fixtures import GIF, PDF, pdf_with_stream
+
+
+PDF_WITH_STREAM = pdf_with_stream(b"hello" * 100)
+
+
+def without_values(obj):
+    # the string representations of some parsed values include their addresses
+    if isinstance(obj, dict):
+        return {key: without_values(value) for key, value in obj.items() if key != "value"}
+    elif isinstance(obj, list):
+        return [without_values(value) for value in obj]
+    return obj
+
+
+def detached_subtree(name: str, decoded=None) -> List[DetachedMatch]:
+    root = Match("root", "root", 0, length=10, matcher=Matcher())
+    Submatch(name, name, 0, length=10, parent=root, decoded=decoded)
+    return detach(root.children)
+
+
+class PayloadMemoTest(TestCase):
+    def test_duplicate_members(self):
+        with TemporaryDirectory() as tmpdir:
+            path = Path(tmpdir) / "test.zip"
+            data = BytesIO()
+            with zipfile.ZipFile(data, "w") as zf:
+                for i in range(3):
+                    zf.writestr(f"doc{i}.pdf", PDF)
+                    zf.writestr(f"image{i}.gif", GIF)
+            path.write_bytes(data.getvalue())
+            memo = PayloadMemo()
+            memoized = Analyzer(path, memo=memo).sbud()
+            self.assertGreater(memo.hits, 0)
+            # a memo that cannot hold any entries is never used
+            unmemoized = Analyzer(path, memo=PayloadMemo(max_size=0)).sbud()
+            self.assertEqual(without_values(memoized), without_values(unmemoized))
+            # a memo shared between analyses reuses the payloads from earlier files
+            hits = memo.hits
+            self.assertEqual(without_values(Analyzer(path, memo=memo).sbud()), without_values(memoized))
+            self.assertGreater(memo.hits, hits)
+
+    def test_max_size(self):
+        memo = PayloadMemo(max_size=2000)
+        for i in range(100):
+            memo.put((i,), detached_subtree(f"match{i}"))
+        # the least recently used subtrees were forgotten to stay within the size limit
+        self.assertLessEqual(memo.size, memo.max_size)
+        self.assertLess(len(memo), 100)
+        self.assertIsNotNone(memo.get((99,)))
+        self.assertIsNone(memo.get((0,)))
+        # a subtree larger than the entire memo is not remembered, and does not evict anything
+        num_entries = len(memo)
+        memo.put(("large",), detached_subtree("x" * 4000))
+        self.assertIsNone(memo.get(("large",)))
+        self.assertEqual(len(memo), num_entries)
+
+    def test_decoded_data_are_not_retained(self):
+        memo = PayloadMemo()
+        memo.put(("decoded",), detached_subtree("stream", decoded=b"decoded"))
+        memo.put(("lazy",), detached_subtree("stream", decoded=lambda: b"decoded"))
+        self.assertEqual(len(memo), 0)
+        self.assertEqual(memo.size, 0)
+        with TemporaryDirectory() as tmpdir:
+            path = Path(tmpdir) / "test.zip"
+            data = BytesIO()
+            with zipfile.ZipFile(data, "w") as zf:
+                for i in range(3):
+                    zf.writestr(f"doc{i}.pdf", PDF_WITH_STREAM)
+            path.write_bytes(data.getvalue())
+            for lazy_decoding in (False, True):
+                with self.subTest(lazy_decoding=lazy_decoding):
+                    memo = PayloadMemo()
+                    sbud = Analyzer(path, memo=memo, lazy_decoding=lazy_decoding).sbud()
+                    # the PDFs' decoded streams (or, when decoding lazily, their decoders) are not retained
+                    self.assertTrue(all(entry[8] is None for detached, _ in memo._entries.values()
+                                        for entry in detached))
+                    unmemoized = Analyzer(path, memo=PayloadMemo(max_size=0), lazy_decoding=lazy_decoding).sbud()
+                    self.assertEqual(without_values(sbud), without_values(unmemoized))
+
+    def test_kaitai_values_retain_their_buffers(self):
+        # the raw values of the capture's Kaitai fields are views of the entire decompressed member
+        packet = bytes(range(128, 256)) * 512
+        pcap = struct.pack("<IHHiIII", 0xA1B2C3D4, 2, 4, 0, 0, len(packet), 147) \
+            + struct.pack("<IIII", 0, 0, len(packet), len(packet)) + packet
+        with TemporaryDirectory() as tmpdir:
+            path = Path(tmpdir) / "test.zip"
+            with zipfile.ZipFile(path, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+                for i in range(2):
+                    zf.writestr(f"capture{i}.pcap", pcap)
+            memo = PayloadMemo()
+            Analyzer(path, memo=memo).sbud()
+            self.assertGreater(memo.hits, 0)
+            sizes = [
+                size for detached, size in memo._entries.values()
+                if any(isinstance(entry[3], memoryview) for entry in detached)
+            ]
+            self.assertTrue(sizes)
+            for size in sizes:
+                self.assertGreater(size, len(pcap))
+            # a memo too small to hold the member's buffer does not retain it
+            memo = PayloadMemo(max_size=len(pcap) // 2)
+            Analyzer(path, memo=memo).sbud()
+            self.assertLessEqual(memo.size, memo.max_size)
+            self.assertFalse(any(
+                isinstance(entry[3], memoryview) for detached, _ in memo._entries.values() for entry in detached
+            ))
@@ -0,0 +1,50 @@
+from io import BytesIO
+import random
+from unittest import TestCase
+
+from polyfile.search import MultiSequenceSearch
+
+
+def naive_search(data: bytes, *sequences: bytes):
+    hits = set()
+    for sequence in sequences:
+        offset = data.find(sequence)
+        while offset >= 0:
+            hits.add((offset, sequence))
+            offset = data.find(sequence, offset + 1)
+    return hits
+
+
+class MultiSequenceSearchTest(TestCase):
+    SEQUENCES = (b"hack", b"hacker", b"crack", b"ack", b"kool", b"\x00\x00\x01", b"\xff")
+
+    def setUp(self):
+        rng = random.Random(0)
+        self.data = bytes(rng.choice(b"hackerolo\x00\x01\xff ") for _ in range(20000))
+
+    def test_search(self):
+        mss = MultiSequenceSearch(*self.SEQUENCES)
+        hits = list(mss.search(self.data))
+        self.assertEqual(set(hits), naive_search(self.data, *self.SEQUENCES))
+        self.assertEqual(len(hits), len(set(hits)))
+        ends = [offset + len(sequence) for offset, sequence in hits]
+        self.assertEqual(ends, sorted(ends))
+
+    def test_chunked_search(self):
+        mss = MultiSequenceSearch(*self.SEQUENCES)
+        mss.CHUNK_SIZE = 5
+        self.assertEqual(set(mss.search(BytesIO(self.data))), naive_search(self.data, *self.SEQUENCES))
+        self.assertEqual(set(mss.search(memoryview(self.data))), naive_search(self.data, *self.SEQUENCES))
+
+    def test_skip_ahead(self):
+        sequences = (b"kool", b"ker")
+        mss = MultiSequenceSearch(*sequences)
+        self.assertEqual(set(mss.search(self.data)), naive_search(self.data, *sequences))
+
+    def test_save_and_load(self):
+        mss = MultiSequenceSearch(*self.SEQUENCES)
+        saved = BytesIO()
+        mss.save(saved)
+        saved.seek(0)
+        loaded = MultiSequenceSearch.load(saved)
+        self.assertEqual(list(loaded.search(self.data)), list(mss.search(self.data)))
@@ -0,0 +1,98 @@
+import base64
+import json
+from pathlib import Path
+import socket
+from tempfile import TemporaryDirectory
+import threading
+from unittest import skipUnless, TestCase
+from unittest.mock import patch
+
+from polyfile.batch import pool_context
+from polyfile.server import AnalysisClient, AnalysisServer
+
+# the first 20 bytes of a valid GIF
+TRUNCATED_GIF = bytes.fromhex("47494638396101000100800000000000ffffff21")
+
+
+@skipUnless(hasattr(socket, "AF_UNIX"), "Unix domain sockets are not supported on this platform")
+class AnalysisServerTest(TestCase):
+    def test_server(self):
+        with TemporaryDirectory() as tmpdir:
+            pdf = Path(tmpdir) / "test.pdf"
+            pdf.write_bytes(b"%PDF-1.5\n%%EOF\n")
+            socket_path = str(Path(tmpdir) / "polyfile.sock")
+            server = AnalysisServer(socket_path, jobs=2, max_queue=1)
+            server.start()
+            thread = threading.Thread(target=server.serve_forever, daemon=True)
+            thread.start()
+            try:
+                with AnalysisClient(socket_path) as client:
+                    self.assertEqual(client.ping()["status"], "ok")
+                    record = client.analyze(path=str(pdf), formats=["mime"], parse=False)
+                    self.assertEqual(record["status"], "ok")
+                    self.assertIn("application/pdf", record["mime"])
+                    # the magic matches a truncated GIF, but it does not validate
+                    record = client.analyze(data=TRUNCATED_GIF, formats=["sbud"], parse=False, validate=True)
+                    self.assertEqual(record["status"], "ok")
+                    self.assertNotIn("image/gif", {match["type"] for match in record["sbud"]["struc"]})
+                    record = client.analyze(data=pdf.read_bytes(), formats=["mime"], parse=False)
+                    self.assertIn("application/pdf", record["mime"])
+                    self.assertEqual(record["path"], "STDIN")
+                    # more requests than there are workers and queue slots, to exercise backpressure
+                    requests = [
+                        (i, AnalysisClient.request(path=str(pdf) if i % 2 else "missing", formats=["mime"]))
+                        for i in range(8)
+                    ]
+                    records = dict(client.analyze_many(requests))
+                    self.assertEqual(set(records.keys()), set(range(8)))
+                    for i, record in records.items():
+                        self.assertEqual(record["status"], "ok" if i % 2 else "error")
+                    record = client.analyze(path=str(pdf), formats=["html"])
+                    self.assertEqual(record["status"], "error")
+                    record = client.analyze(
+                        path=str(pdf), formats=["mime", "sbud"], budget={"max_submatches": 10},
+                        identify_window={"head": 4096, "tail": 0}, lazy_decoding=True
+                    )
+                    self.assertEqual(record["status"], "ok")
+                    self.assertIn("application/pdf", record["mime"])
+                    for invalid in ({"budget": {"max_seconds": "1"}}, {"budget": {"unknown": 1}},
+                                    {"identify_window": {"head": -1}}, {"identify_window": [4096]}):
+                        with self.subTest(request=invalid):
+                            record = client.analyze(path=str(pdf), **invalid)
+                            self.assertEqual(record["status"], "error")
+                            self.assertIn("Invalid request", record["error"])
+                    scratch = Path(tmpdir) / "scratch"
+                    scratch.mkdir()
+                    with patch("tempfile.tempdir", str(scratch)):
+                        for name in ("x" * 4096, ".."):
+                            with self.subTest(name=name):
+                                record = client.analyze(data=pdf.read_bytes(), name=name)
+                                self.assertEqual(record["status"], "error")
+                                self.assertIn("Invalid request", record["error"])
+                    # the temporary directories for the invalid names were cleaned up
+                    self.assertEqual(list(scratch.iterdir()), [])
+                    # the connection is still usable
+                    self.assertEqual(client.ping()["status"], "ok")
+            finally:
+                server.shutdown()
+                thread.join()
+            self.assertFalse(Path(socket_path).exists())
+
+    def test_submit_after_pool_closed(self):
+        with TemporaryDirectory() as tmpdir:
+            server = AnalysisServer(str(Path(tmpdir) / "polyfile.sock"), jobs=1, max_queue=0)
+            server._pool = pool_context().Pool(processes=1)
+            server._pool.close()
+            server._pool.join()
+            responses = []
+            scratch = Path(tmpdir) / "scratch"
+            scratch.mkdir()
+            with patch("tempfile.tempdir", str(scratch)):
+                request = {"id": 1, "data": base64.b64encode(b"%PDF-1.5\n%%EOF\n").decode("ascii")}
+                server.submit(json.dumps(request).encode("utf-8"), responses.append)
+            self.assertEqual(len(responses), 1)
+            self.assertEqual(responses[0]["id"], 1)
+            self.assertEqual(responses[0]["status"], "error")
+            # the queue slot was released and the temporary file was cleaned up
+            self.assertTrue(server._slots.acquire(blocking=False))
+            self.assertEqual(list(scratch.iterdir()), [])
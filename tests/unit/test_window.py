@@ -0,0 +1,105 @@
+import hashlib
+import json
+import os
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+import zipfile
+
+from polyfile.fileutils import FileStream, WindowedData
+from polyfile.magic import IdentificationWindow, JSONTest, MagicMatcher, MatchContext
+from polyfile.polyfile import Analyzer
+
+
+DATA = bytes(range(256)) * 4096
+
+
+class WindowedDataTest(TestCase):
+    def test_reads(self):
+        with FileStream(DATA) as fs:
+            data = WindowedData(fs, head=1000, tail=500)
+            self.assertEqual(len(data), len(DATA))
+            self.assertEqual(data[:10], DATA[:10])
+            self.assertEqual(data[-10:], DATA[-10:])
+            self.assertEqual(data[-1], DATA[-1])
+            self.assertEqual(data.lazy_bytes, 0)
+            self.assertEqual(data[990:2000], DATA[990:2000])
+            self.assertEqual(data.lazy_bytes, 1000)
+            self.assertEqual(data[len(DATA) - 600:len(DATA) - 400], DATA[-600:-400])
+            self.assertEqual(list(data.segments(900)), [(900, DATA[900:1000]), (len(DATA) - 500, DATA[-500:])])
+            data.FIND_CHUNK_SIZE = 100
+            needle = DATA[5095:5105]
+            self.assertEqual(data.find(needle), DATA.find(needle))
+            self.assertEqual(data.find(needle, 10000), DATA.find(needle, 10000))
+            self.assertEqual(data.find(b"\xff\xff"), -1)
+            view = data.view(900)
+            self.assertEqual(len(view), len(DATA) - 900)
+            self.assertEqual(view[:200], DATA[900:1100])
+            self.assertEqual(view[-10:], DATA[-10:])
+            self.assertEqual(list(view.segments(50)), [(50, DATA[950:1000]), (len(DATA) - 1400, DATA[-500:])])
+            # streams of a view start at the view's offset into the file
+            with FileStream(view) as stream:
+                self.assertEqual(len(stream), len(view))
+                self.assertEqual(stream.read(10), DATA[900:910])
+            with FileStream(view, start=100, length=10) as stream:
+                self.assertEqual(stream.content, DATA[1000:1010])
+
+
+class IdentificationWindowTest(TestCase):
+    def test_large_zip(self):
+        with TemporaryDirectory() as tmpdir:
+            path = Path(tmpdir) / "large.jar"
+            with zipfile.ZipFile(path, "w", compression=zipfile.ZIP_STORED) as zf:
+                zf.writestr("META-INF/MANIFEST.MF", b"Manifest-Version: 1.0\n")
+                zf.writestr("payload.bin", os.urandom(2 * 1024 * 1024))
+            window = IdentificationWindow(head=65536, tail=65536)
+            analyzer = Analyzer(path, parse=False, identify_window=window)
+            mimetypes = {mimetype for mimetype, _ in analyzer.mime_type_descriptions()}
+            self.assertIn("application/zip", mimetypes)
+            self.assertIn("application/java-archive", mimetypes)
+            data = analyzer.context(only_match_mime=True).data
+            self.assertIsInstance(data, WindowedData)
+            # the central directory is in the tail, so only the local file header had to be read lazily
+            self.assertLess(data.lazy_bytes, 4096)
+            self.assertEqual(analyzer.content_hash, hashlib.sha256(path.read_bytes()).hexdigest())
+
+    def test_small_files_are_not_windowed(self):
+        context = MatchContext.load(FileStream(b"GIF89a"), window=IdentificationWindow(head=4096))
+        self.assertNotIsInstance(context.data, WindowedData)
+        self.assertIn("image/gif", {
+            mimetype for match in MagicMatcher.DEFAULT_INSTANCE.match(context) for mimetype in match.mimetypes
+        })
+
+    def test_text_formats_only_parse_the_head(self):
+        rows = "".join(f"{i},\"value {i}\",{i * 2}\n" for i in range(100000))
+        values = json.dumps([{"id": i, "name": f"value {i}", "valid": True} for i in range(50000)])
+        with TemporaryDirectory() as tmpdir:
+            for name, content, mimetype, matches in (
+                    ("large.csv", rows, "text/csv", True),
+                    ("large.json", values, "application/json", True),
+                    # the end of the window is in the middle of a quoted field or string
+                    ("quoted.csv", "a,b\nc,d\n\"" + "x" * 10000 + "\",e\n", "text/csv", True),
+                    ("string.json", json.dumps(["x" * 10000, 1]), "application/json", True),
+                    # data that are invalid within the window are still rejected
+                    ("invalid.csv", "a,b\nc\n" + rows, "text/csv", False),
+                    ("invalid.json", "[1, 2]] " + values, "application/json", False)
+            ):
+                with self.subTest(name=name):
+                    path = Path(tmpdir) / name
+                    path.write_text(content)
+                    data = MatchContext.load(path, window=IdentificationWindow(head=4099)).data
+                    self.assertIsInstance(data, WindowedData)
+                    test, = MagicMatcher.DEFAULT_INSTANCE.tests_by_mime[mimetype]
+                    self.assertEqual(bool(test.test(data, 0, None)), matches)
+                    # nothing outside of the window was read
+                    self.assertEqual(data.lazy_bytes, 0)
+
+    def test_json_cut_off(self):
+        for document, cut_off in (
+                ("[1, 2", True), ('{"a": "abc', True), ("[1.", True), ('{"a": tr', True), ('"\\u12', True),
+                ('{"a"', True), ("[1]e", False), ("[1, 2]x", False), ("tru", False), ('["a", }', False)
+        ):
+            with self.subTest(document=document):
+                with self.assertRaises(json.JSONDecodeError) as error:
+                    json.loads(document)
+                self.assertEqual(JSONTest.cut_off(document, error.exception), cut_off)